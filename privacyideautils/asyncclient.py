@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+An asyncio based client for the privacyIDEA server.
+
+It provides the same methods as the privacyideaclient, but all of them are
+coroutines. It requires the aiohttp package::
+
+    async with asyncprivacyideaclient("admin", "secret",
+                                      "https://privacyidea") as client:
+        responses = await asyncio.gather(
+            *[client.deletetoken(serial) for serial in serials])
+"""
+import asyncio
+import json
+import logging
+from privacyideautils.clientutils import (ClientEndpoints,
+                                          PrivacyIDEAClientError,
+                                          response_obj,
+                                          POOL_MAXSIZE)
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+
+def _clean_param(param):
+    """
+    aiohttp only accepts strings and numbers as parameters. Like requests
+    we skip parameters with the value None.
+    """
+    if not param:
+        return None
+    return {k: v if isinstance(v, (str, int, float)) and
+            not isinstance(v, bool) else str(v)
+            for k, v in param.items() if v is not None}
+
+
+class asyncprivacyideaclient(ClientEndpoints):
+    """
+    This class holds a pool of connections to the privacyIDEA server, which
+    is used by coroutines running on one event loop.
+
+    The client needs to be opened within the event loop, either by using
+    it as an async context manager or by awaiting open().
+    """
+
+    def __init__(self, username, password, baseuri="http://localhost:5000",
+                 no_ssl_check=False, pi_authorization=False,
+                 pool_maxsize=POOL_MAXSIZE, concurrency=None):
+        """
+        :param baseuri: The base of the server like http://localhost:5000
+        :type baseuri: basestring
+        :param pool_maxsize: The maximum number of connections to the server
+        :type pool_maxsize: int
+        :param concurrency: The maximum number of requests in flight. Further
+            requests wait until a running request has finished. Defaults to
+            pool_maxsize.
+        :type concurrency: int
+        """
+        if not AIOHTTP_AVAILABLE:
+            raise PrivacyIDEAClientError(1301, "The asyncio client requires "
+                                               "the aiohttp package.")
+        self.auth_token = None
+        self.headers = None
+        self.baseuri = baseuri
+        self.log = logging.getLogger('privacyideaclient')
+        self.verify_ssl = not no_ssl_check
+        self.pi_authorization = pi_authorization
+        self.pool_maxsize = pool_maxsize
+        self.concurrency = concurrency or pool_maxsize
+        self.session = None
+        self._semaphore = None
+        self._auth_lock = None
+        self._username = username
+        self._password = password
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def open(self):
+        """
+        Create the connection pool and retrieve the auth token.
+        """
+        connector = aiohttp.TCPConnector(limit=self.pool_maxsize,
+                                         limit_per_host=self.pool_maxsize,
+                                         ssl=None if self.verify_ssl else False)
+        self.session = aiohttp.ClientSession(connector=connector)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._auth_lock = asyncio.Lock()
+        try:
+            await self.set_credentials(self._username, self._password)
+        except Exception:
+            await self.close()
+            raise
+
+    async def close(self):
+        """
+        Close all pooled connections to the privacyIDEA server.
+        """
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def set_credentials(self, username, password):
+        """
+        set an authtoken from the privacyidea server by providing username
+        and password
+
+        :param username: The username of the administrator or user
+        :param password: The credential of the user
+        :return: None
+        """
+        async with self.session.post("%s/auth" % self.baseuri,
+                                     data={"username": username,
+                                           "password": password}) as r:
+            if r.status != 200:
+                raise Exception("Invalid Credentials: %s" % r.status)
+            res = await r.json(content_type=None)
+        result = res.get("result")
+        if result.get("status") is True:
+            self.auth_token = result.get("value", {}).get("token")
+            if self.pi_authorization:
+                self.headers = {"PI-Authorization": self.auth_token}
+            else:
+                self.headers = {"Authorization": self.auth_token}
+
+    async def _reauthenticate(self, expired_token):
+        async with self._auth_lock:
+            if self.auth_token == expired_token:
+                await self.set_credentials(self._username, self._password)
+
+    async def _send(self, method, uripath, param, data):
+        async with self._semaphore:
+            async with self.session.request(method,
+                                            "%s%s" % (self.baseuri, uripath),
+                                            headers=self.headers,
+                                            params=_clean_param(param),
+                                            data=_clean_param(data)) as r:
+                return r.status, await r.text()
+
+    async def _request(self, method, uripath, param=None, data=None):
+        auth_token = self.auth_token
+        status, text = await self._send(method, uripath, param, data)
+        if status == 401:
+            # The auth token expired or was revoked. We authenticate again
+            # and retry the request once.
+            self.log.debug("Got 401, reauthenticating.")
+            await self._reauthenticate(auth_token)
+            status, text = await self._send(method, uripath, param, data)
+        if status >= 300:
+            raise PrivacyIDEAClientError(eid=status, description=text)
+        try:
+            json_response = json.loads(text)
+        except ValueError:
+            json_response = None
+        return response_obj(status, json_response, text)
+
+    def get(self, uripath, param=None):
+        return self._request("GET", uripath, param=param)
+
+    def post(self, uripath, param=None):
+        return self._request("POST", uripath, data=param)
+
+    def delete(self, uripath):
+        return self._request("DELETE", uripath)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Cache the authorization token (JWT) of the privacyIDEA server on disk.
+
+Short running commands can reuse the token of a previous invocation and do
+not need to authenticate against /auth again. The tokens are stored in a
+JSON file, that is only readable by the owner. The entries are keyed by the
+URL of the server and the name of the administrator.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache",
+                                  "privacyidea", "authtoken.json")
+# Tokens, that expire within this number of seconds, are not used anymore.
+EXPIRY_MARGIN = 30
+
+
+def jwt_expiry(token):
+    """
+    Return the expiry time of a JWT as a unix timestamp.
+
+    The signature of the token is not verified. This is the job of the
+    privacyIDEA server.
+
+    :param token: The JWT
+    :return: the value of the claim "exp" or None
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(
+            payload.encode("ascii")).decode("utf-8"))
+        return int(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError, binascii.Error):
+        return None
+
+
+class AuthTokenCache(object):
+    """
+    A file, that holds the authorization tokens for several servers and
+    administrators.
+    """
+
+    def __init__(self, filename=DEFAULT_CACHE_FILE):
+        self.filename = filename
+
+    @staticmethod
+    def _key(baseuri, username):
+        return hashlib.sha256("{0!s}\0{1!s}".format(
+            baseuri.rstrip("/"), username).encode("utf-8")).hexdigest()
+
+    def _load(self):
+        try:
+            with open(self.filename) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname, 0o700)
+        # mkstemp creates the file with the mode 0600. The file is renamed
+        # atomically, so that concurrent readers never see partial data.
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".authtoken")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmpname, self.filename)
+        except Exception:
+            os.unlink(tmpname)
+            raise
+
+    def get(self, baseuri, username):
+        """
+        Return a cached token, that is still valid.
+
+        :return: the token or None
+        """
+        entry = self._load().get(self._key(baseuri, username))
+        if entry and entry.get("exp", 0) - EXPIRY_MARGIN > time.time():
+            return entry.get("token")
+        return None
+
+    def set(self, baseuri, username, token):
+        """
+        Store a token in the cache. Expired tokens are removed from the file.
+        """
+        exp = jwt_expiry(token)
+        if exp is None:
+            log.debug("The auth token has no expiry time. Not caching it.")
+            return
+        now = time.time()
+        entries = {k: v for k, v in self._load().items()
+                   if v.get("exp", 0) > now}
+        entries[self._key(baseuri, username)] = {"token": token, "exp": exp}
+        try:
+            self._save(entries)
+        except (IOError, OSError) as e:
+            log.warning("Could not write the auth token cache {0!s}: "
+                        "{1!s}".format(self.filename, e))
+
+    def delete(self, baseuri, username):
+        """
+        Remove the token of the given server and administrator.
+        """
+        entries = self._load()
+        if entries.pop(self._key(baseuri, username), None):
+            self._save(entries)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Run many requests against the privacyIDEA server with a bounded number of
+requests in flight.
+
+The operation is called for each item of a (possibly endless) stream of
+items. Only a small window of items is read ahead, so the stream is never
+read into memory completely.
+"""
+import logging
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+# The result of one operation. Either response or error is set.
+BulkResult = namedtuple("BulkResult", ["item", "response", "error"])
+
+
+class BulkExecutor(object):
+    """
+    Execute an operation for a stream of items with at most *parallel*
+    operations running at the same time.
+
+    The results are returned in the order of the items.
+    """
+
+    def __init__(self, parallel=1):
+        """
+        :param parallel: The number of operations, that run concurrently.
+        :type parallel: int
+        """
+        self.parallel = max(1, int(parallel))
+        self.succeeded = 0
+        self.failed = 0
+
+    def _call(self, operation, item):
+        try:
+            return BulkResult(item, operation(item), None)
+        except Exception as e:
+            log.debug("Operation for {0!r} failed: {1!r}".format(item, e))
+            return BulkResult(item, None, e)
+
+    def _count(self, result):
+        if result.error is None:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        return result
+
+    def run(self, operation, items):
+        """
+        Call operation(item) for all items.
+
+        Exceptions raised by the operation do not stop the run. They are
+        returned in the error field of the result.
+
+        :param operation: A callable taking one item
+        :param items: An iterable of items
+        :return: generator of BulkResult in the order of the items
+        """
+        if self.parallel == 1:
+            for item in items:
+                yield self._count(self._call(operation, item))
+            return
+
+        # Read ahead twice the number of workers, so that the workers do not
+        # idle while we wait for a slow request at the head of the window.
+        window = 2 * self.parallel
+        pending = deque()
+        pool = ThreadPoolExecutor(max_workers=self.parallel)
+        try:
+            for item in items:
+                pending.append(pool.submit(self._call, operation, item))
+                if len(pending) >= window:
+                    yield self._count(pending.popleft().result())
+            while pending:
+                yield self._count(pending.popleft().result())
+        finally:
+            # The caller may stop consuming the results early.
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+
+def bulk_executor(client, parallel):
+    """
+    Create a BulkExecutor and make sure, that the connection pool of the
+    client is large enough for the requests running in parallel.
+
+    :param client: The privacyideaclient
+    :param parallel: The number of requests in flight
+    :return: BulkExecutor
+    """
+    executor = BulkExecutor(parallel)
+    if executor.parallel > client.pool_maxsize:
+        client.set_pool_size(executor.parallel)
+    return executor
@@ -19,14 +19,27 @@ the python based management clients "privacyidea"
 
 import logging.handlers
 import pprint
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
 import gettext
+from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from privacyideautils.render import render
 
 _ = gettext.gettext
 
 __version__ = 3.0
 TIMEOUT = 5
+# The number of hosts, for which connections are pooled and the number of
+# connections, that are kept open to each of these hosts
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+# The number of tokens, that are fetched with one request, when walking
+# through the token list
+PAGESIZE = 100
+# The number of bytes, that are read at once from streamed responses
+CHUNK_SIZE = 64 * 1024
 etng = False
 
 file_opts = ['rf_file=']
@@ -74,94 +87,14 @@ class response_obj(object):
         self.text = text
 
 
-class privacyideaclient(object):
+class ClientEndpoints(object):
     """
-    This class is created to hold a connection to the privacyIDEA server
+    The REST endpoints of the privacyIDEA server.
 
-    It creates an authorization token that is sent in the HTTP header on each
-    request.
+    The transport methods get, post and delete are implemented by the
+    actual client classes.
     """
 
-    def __init__(self, username, password, baseuri="http://localhost:5000",
-                 no_ssl_check=False, pi_authorization=False):
-        """
-        :param baseuri: The base of the server like http://localhost:5000
-        :type baseuri: basestring
-        """
-        self.auth_token = None
-        self.headers = None
-        self.baseuri = baseuri
-        self.log = logging.getLogger('privacyideaclient')
-        self.verify_ssl = not no_ssl_check
-        self.pi_authorization = pi_authorization
-        if not self.verify_ssl:
-            requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-        # Do the first server communication and retrieve the auth token
-        self.set_credentials(username, password)
-
-    def _send_response(self, r):
-        if r.status_code >= 300:
-            raise PrivacyIDEAClientError(eid=r.status_code,
-                                          description=r.text)
-        try:
-            json_response = r.json
-            if callable(json_response):
-                # requests > 2.0
-                json_response = json_response()
-        except:
-            json_response = None
-
-        return response_obj(r.status_code, json_response, r.text)
-
-    def set_credentials(self, username, password):
-        """
-        set an authtoken from the privacyidea server by providing username
-        and password
-
-        :param username: The username of the administrator or user
-        :param password: The credential of the user
-        :return: None
-        """
-        r = requests.post("%s/auth" % self.baseuri,
-                          data={"username": username,
-                                "password": password},
-                          verify=self.verify_ssl)
-
-        if r.status_code == requests.codes.ok:
-            res = r.json
-            if callable(res):
-                # requests > 2.0
-                res = res()
-            result = res.get("result")
-            if result.get("status") is True:
-                self.auth_token = result.get("value", {}).get("token")
-                if self.pi_authorization:
-                    self.headers = {"PI-Authorization": self.auth_token}
-                else:
-                    self.headers = {"Authorization": self.auth_token}
-        else:
-            raise Exception("Invalid Credentials: %s" % r.status_code)
-
-    def get(self, uripath, param=None):
-        r = requests.get("%s%s" % (self.baseuri, uripath),
-                         headers=self.headers,
-                         params=param,
-                         verify=self.verify_ssl)
-        return self._send_response(r)
-
-    def post(self, uripath, param=None):
-        r = requests.post("%s%s" % (self.baseuri, uripath),
-                          headers=self.headers,
-                          data=param,
-                          verify=self.verify_ssl)
-        return self._send_response(r)
-
-    def delete(self, uripath):
-        r = requests.delete("%s%s" % (self.baseuri, uripath),
-                            headers=self.headers,
-                            verify=self.verify_ssl)
-        return self._send_response(r)
-
     def userlist(self, param):
         return self.get('/user/', param)
 
@@ -295,74 +228,244 @@ class privacyideaclient(object):
             return self.get("/resolver/")
 
 
-def dumpresult(status, data, tabformat=None):
+class privacyideaclient(ClientEndpoints):
+    """
+    This class is created to hold a connection to the privacyIDEA server
+
+    It creates an authorization token that is sent in the HTTP header on each
+    request.
+    """
+
+    def __init__(self, username, password, baseuri="http://localhost:5000",
+                 no_ssl_check=False, pi_authorization=False,
+                 pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 token_cache=None, timeout=None):
+        """
+        :param baseuri: The base of the server like http://localhost:5000
+        :type baseuri: basestring
+        :param token_cache: If given, the auth token is read from and
+            written to this cache, so that the client does not need to
+            authenticate against /auth on each invocation.
+        :type token_cache: privacyideautils.authcache.AuthTokenCache
+        :param pool_connections: The number of hosts, for which a connection
+            pool is kept.
+        :type pool_connections: int
+        :param pool_maxsize: The maximum number of connections, that are kept
+            open to a single host. This should be at least the number of
+            requests, that are run in parallel.
+        :type pool_maxsize: int
+        :param timeout: The number of seconds to wait for the server to
+            connect and to send data, e.g. TIMEOUT. By default the client
+            waits as long as the server needs.
+        :type timeout: float
+        """
+        self.auth_token = None
+        self.headers = None
+        self.baseuri = baseuri
+        self.log = logging.getLogger('privacyideaclient')
+        self.verify_ssl = not no_ssl_check
+        self.timeout = timeout
+        self.pi_authorization = pi_authorization
+        if not self.verify_ssl:
+            requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+        # All requests share one session, so that the TCP and TLS
+        # connections to the server are kept alive and reused.
+        self.session = requests.Session()
+        self.session.verify = self.verify_ssl
+        self.set_pool_size(pool_maxsize, pool_connections)
+        # The credentials are kept to reauthenticate, if the auth token
+        # expires during a long running job.
+        self._credentials = (username, password)
+        self._auth_lock = threading.Lock()
+        self.token_cache = token_cache
+        cached_token = None
+        if token_cache:
+            cached_token = token_cache.get(baseuri, username)
+        if cached_token:
+            self._set_auth_token(cached_token)
+        else:
+            # Do the first server communication and retrieve the auth token
+            self.set_credentials(username, password)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def set_pool_size(self, pool_maxsize, pool_connections=POOL_CONNECTIONS):
+        """
+        (Re)configure the connection pool of the client.
+
+        Connections, that are already open, are closed.
+
+        :param pool_maxsize: The maximum number of connections per host
+        :param pool_connections: The number of hosts, that are pooled
+        :return: None
+        """
+        self.pool_maxsize = pool_maxsize
+        for prefix in ("http://", "https://"):
+            adapter = HTTPAdapter(pool_connections=pool_connections,
+                                  pool_maxsize=pool_maxsize)
+            old_adapter = self.session.adapters.get(prefix)
+            self.session.mount(prefix, adapter)
+            if old_adapter:
+                old_adapter.close()
+
+    def close(self):
+        """
+        Close all pooled connections to the privacyIDEA server.
+        """
+        self.session.close()
+
+    def _send_response(self, r):
+        if r.status_code >= 300:
+            raise PrivacyIDEAClientError(eid=r.status_code,
+                                          description=r.text)
+        try:
+            json_response = r.json
+            if callable(json_response):
+                # requests > 2.0
+                json_response = json_response()
+        except:
+            json_response = None
+
+        return response_obj(r.status_code, json_response, r.text)
+
+    def set_credentials(self, username, password):
+        """
+        set an authtoken from the privacyidea server by providing username
+        and password
+
+        :param username: The username of the administrator or user
+        :param password: The credential of the user
+        :return: None
+        """
+        r = self.session.post("%s/auth" % self.baseuri,
+                              data={"username": username,
+                                    "password": password},
+                              timeout=self.timeout)
+
+        if r.status_code == requests.codes.ok:
+            res = r.json
+            if callable(res):
+                # requests > 2.0
+                res = res()
+            result = res.get("result")
+            if result.get("status") is True:
+                self._set_auth_token(result.get("value", {}).get("token"))
+                if self.token_cache:
+                    self.token_cache.set(self.baseuri, username,
+                                         self.auth_token)
+        else:
+            raise Exception("Invalid Credentials: %s" % r.status_code)
+
+    def _set_auth_token(self, auth_token):
+        self.auth_token = auth_token
+        if self.pi_authorization:
+            self.headers = {"PI-Authorization": self.auth_token}
+        else:
+            self.headers = {"Authorization": self.auth_token}
+
+    def _reauthenticate(self, expired_token):
+        """
+        Fetch a new auth token, unless another thread already did so.
+        """
+        with self._auth_lock:
+            if self.auth_token == expired_token:
+                self.set_credentials(*self._credentials)
+
+    def _request(self, method, uripath, **kwargs):
+        auth_token = self.auth_token
+        kwargs.setdefault("timeout", self.timeout)
+        r = self.session.request(method, "%s%s" % (self.baseuri, uripath),
+                                 headers=self.headers, **kwargs)
+        if r.status_code == 401:
+            # The auth token expired or was revoked. We authenticate again
+            # and retry the request once.
+            self.log.debug("Got 401, reauthenticating.")
+            # Return a streamed connection to the pool
+            r.close()
+            self._reauthenticate(auth_token)
+            r = self.session.request(method,
+                                     "%s%s" % (self.baseuri, uripath),
+                                     headers=self.headers, **kwargs)
+        return r
+
+    def get(self, uripath, param=None):
+        r = self._request("GET", uripath, params=param)
+        return self._send_response(r)
+
+    def post(self, uripath, param=None):
+        r = self._request("POST", uripath, data=param)
+        return self._send_response(r)
+
+    def delete(self, uripath):
+        r = self._request("DELETE", uripath)
+        return self._send_response(r)
+
+    def get_stream(self, uripath, param=None, chunk_size=CHUNK_SIZE):
+        """
+        GET the uripath and yield the body of the response in chunks. The
+        body is not held in memory completely, so this can be used for
+        large exports.
+
+        :param chunk_size: The number of bytes, that are read at once
+        :return: generator of bytes
+        """
+        r = self._request("GET", uripath, params=param, stream=True)
+        try:
+            if r.status_code >= 300:
+                raise PrivacyIDEAClientError(eid=r.status_code,
+                                              description=r.text)
+            for chunk in r.iter_content(chunk_size):
+                yield chunk
+        finally:
+            r.close()
+
+    def iter_tokens(self, param=None, pagesize=PAGESIZE):
+        """
+        Walk through the token list page by page and yield the tokens.
+
+        While the tokens of one page are consumed, the next page is already
+        fetched in the background. So at most two pages are held in memory.
+
+        :param param: The filter parameters of /token/ like user or
+            tokenrealm
+        :param pagesize: The number of tokens per request
+        :return: generator of token dictionaries
+        """
+        param = dict(param or {})
+        param["pagesize"] = pagesize
+
+        def fetch(page):
+            page_param = dict(param)
+            page_param["page"] = page
+            response = self.listtoken(page_param)
+            return response.data.get("result", {}).get("value", {})
+
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            future = prefetcher.submit(fetch, 1)
+            while future:
+                value = future.result()
+                future = None
+                if value.get("next"):
+                    future = prefetcher.submit(fetch, value.get("next"))
+                for token in value.get("tokens", []):
+                    yield token
+
+
+def dumpresult(status, data, tabformat=None, outformat="table",
+               autosize=False):
     '''
     This function is used to print the Tokenlist in a nice viewable
     ascii table.
+
+    data can be any iterable of dictionaries like a generator, that fetches
+    the rows while they are printed. See privacyideautils.render for the
+    available output formats.
     '''
-    if tabformat is None:
-        tabformat = {'tabsize': [4, 16, 14, 20, 20, 4, 4, 4, 4],
-                     'tabstr': ["%4s", "%16s", "%14s", "%20s", "%20s", "%4s", "%4s", "%4s", "%4s", "%4s"],
-                        'tabdelim': '|',
-                        'tabvisible': [0, 1, 2, 3, 4, 5, 6, 7, 8],
-                        'tabhead': ['Id', 'Desc', 'S/N', 'User', 'Resolver',
-                       'MaxFail', 'Active', 'FailCount', 'Window'],
-                        'tabentry': ['id',
-                        'description',
-                        'serial',
-                        'username',
-                        'resolver',
-                        'maxfail',
-                        'active',
-                        'failcount',
-                        'sync_window']}
-
-    tabsize = tabformat['tabsize']
-    tabstr = tabformat['tabstr']
-    tabdelim = tabformat['tabdelim']
-    tabvisible = tabformat['tabvisible']
-    tabhead = tabformat['tabhead']
-    tabentry = tabformat['tabentry']
-
-    # if not result['status']:
     if not status:
         print("The return status is false")
     else:
-
-        head = tabentry
-
-        # Set the default, if no tabformat or a wrong tabformat is passed
-        if not len(tabvisible):
-            for i in range(0, len(head)):
-                tabvisible.append(i)
-        if len(tabhead) < len(head):
-            print("tabhead " + str(len(tabhead)) + " head " + str(len(head)))
-            for i in range(0, len(head)):
-                tabhead.append('head')
-        if len(tabsize) < len(head):
-            for i in range(0, len(head)):
-                tabsize.append(10)
-        if len(tabstr) < len(head):
-            for i in range(0, len(head)):
-                tabstr.append("%10s")
-
-        # value = result['value']
-        # data = value['data']
-
-        i = 0
-        for t in tabhead:
-            print(tabstr[i] % str(t)[:tabsize[i]], tabdelim, end=' ')
-            i = i + 1
-        print()
-
-        for token in data:
-            i = 0
-            for t in tabentry:
-                # print tabstr[i] % str(token.get(t)).endcode('utf-8') [:tabsize[i]], tabdelim,
-                # text=str(token.get(t)).encode('utf-8')
-                text = token.get(t)
-                if not type(token.get(t)) == str:
-                    text = str(token.get(t))
-                print(tabstr[i] % text[:tabsize[i]], tabdelim, end=' ')
-                i = i + 1
-            print()
+        render(data, tabformat, outformat=outformat, autosize=autosize)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import importlib
+import click
+
+
+class LazyGroup(click.Group):
+    """
+    A click group, that imports the modules of its subcommands only when
+    they are invoked. This keeps the start of the command line tool fast,
+    since e.g. the hardware libraries of the token commands are not loaded
+    for other commands.
+
+    The subcommands are given as a dictionary of the command name and the
+    import path like "privacyideautils.commands.token:token".
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.lazy_subcommands = kwargs.pop("lazy_subcommands", {})
+        super(LazyGroup, self).__init__(*args, **kwargs)
+
+    def list_commands(self, ctx):
+        commands = super(LazyGroup, self).list_commands(ctx)
+        return sorted(commands + [name for name in self.lazy_subcommands
+                                  if name not in commands])
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_subcommands and cmd_name not in self.commands:
+            modname, attr = self.lazy_subcommands[cmd_name].split(":")
+            cmd = getattr(importlib.import_module(modname), attr)
+            self.add_command(cmd, cmd_name)
+        return super(LazyGroup, self).get_command(ctx, cmd_name)
+
+
+class LazyClientObject(dict):
+    """
+    The context object of the command line tool. The privacyIDEA client in
+    ctx.obj["pi_client"] is only created, when a command uses it for the
+    first time. So commands, that do not talk to the server, run without
+    the credentials and without authenticating.
+    """
+
+    def __init__(self, create_client, *args, **kwargs):
+        """
+        :param create_client: A function without arguments, that returns
+            the privacyIDEA client
+        """
+        super(LazyClientObject, self).__init__(*args, **kwargs)
+        self.create_client = create_client
+
+    def __missing__(self, key):
+        if key != "pi_client":
+            raise KeyError(key)
+        client = self[key] = self.create_client()
+        return client
+
+    def close(self):
+        """
+        Close the client, if it was created.
+        """
+        client = self.get("pi_client")
+        if client is not None:
+            client.close()
@@ -17,12 +17,93 @@
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 import click
+import csv
 import datetime
+import json
 import logging
+import os
+import tempfile
+import time
 from privacyideautils.clientutils import (showresult,
                                           dumpresult,
                                           privacyideaclient,
                                           __version__)
+from privacyideautils.bulk import bulk_executor
+
+
+def write_audit_rows(writer, rows):
+    """
+    Write the audit entries either as JSON lines or with a csv.DictWriter.
+    """
+    if isinstance(writer, csv.DictWriter):
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            writer.write(json.dumps(row) + "\n")
+
+
+def read_audit_state(statefile):
+    """
+    Return the highest audit number, that was already fetched, or None.
+    """
+    try:
+        with open(statefile) as f:
+            return int(json.load(f).get("number"))
+    except (IOError, OSError, ValueError, TypeError):
+        return None
+
+
+def write_audit_state(statefile, number):
+    """
+    Atomically write the highest fetched audit number to the state file.
+    """
+    dirname = os.path.dirname(os.path.abspath(statefile))
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".auditstate")
+    with os.fdopen(fd, "w") as f:
+        json.dump({"number": number}, f)
+    os.replace(tmpname, statefile)
+
+
+def fetch_new_audit_entries(client, last_number, rp, initial=0):
+    """
+    Fetch all audit entries with a number higher than last_number.
+
+    The audit log is read in descending order until an entry, that was
+    already fetched, is found. So usually one request is sufficient.
+
+    :param last_number: The highest audit number fetched so far. If it is
+        None, only the newest *initial* entries are returned.
+    :param rp: The number of entries per request
+    :param initial: The number of existing entries to return, if there is
+        no last_number, yet
+    :return: tuple of the list of new entries in ascending order and the
+        highest audit number
+    """
+    new_entries = []
+    newest = last_number
+    page = 1
+    while True:
+        resp = client.auditsearch({"page": page, "rp": rp,
+                                   "sortname": "number",
+                                   "sortorder": "desc"})
+        rows = resp.data.get("result").get("value").get("auditdata")
+        for row in rows:
+            number = int(row.get("number"))
+            if newest is None:
+                newest = number
+            if new_entries and number >= int(new_entries[-1].get("number")):
+                # New entries were written while paging, which shifted
+                # the pages. Skip the entries we already have.
+                continue
+            if last_number is None and len(new_entries) >= initial:
+                return new_entries[::-1], newest
+            if last_number is not None and number <= last_number:
+                return new_entries[::-1], newest
+            new_entries.append(row)
+            newest = max(newest, number)
+        if len(rows) < rp:
+            return new_entries[::-1], newest
+        page += 1
 
 
 @click.group()
@@ -68,3 +149,133 @@ def list(ctx, page, rp, sortname, sortorder, query, qtype):
     for row in auditdata:
         print(row)
     print("Total: {0!s}".format(count))
+
+
+@audit.command()
+@click.pass_context
+@click.option("--rp", help="The number of entries fetched with one request",
+              type=int, default=1000)
+@click.option("--parallel", help="The number of pages, that are fetched in parallel",
+              type=int, default=4)
+@click.option("--format", "outformat", help="The output format",
+              type=click.Choice(["jsonl", "csv"]), default="jsonl")
+@click.option("--outfile", help="The file to write to. Defaults to stdout.",
+              type=click.File("w"), default="-")
+@click.option("--sortorder", help="The order to sort by the audit number. Ascending "
+                                  "order is not affected by new entries during the export.",
+              type=click.Choice(["desc", "asc"]), default="asc")
+@click.option("--query", help="A search tearm to search for")
+@click.option("--qtype", help="The column to search for")
+def export(ctx, rp, parallel, outformat, outfile, sortorder, query, qtype):
+    """
+    Export the complete audit log.
+
+    The number of entries is read from the first page. The remaining pages
+    are fetched in parallel and written in order, while the next pages are
+    still being fetched.
+    """
+    client = ctx.obj["pi_client"]
+    param = {"rp": rp,
+             "sortname": "number",
+             "sortorder": sortorder}
+    if query:
+        param["query"] = query
+    if qtype:
+        param["qtype"] = qtype
+
+    def fetch(page):
+        page_param = dict(param)
+        page_param["page"] = page
+        resp = client.auditsearch(page_param)
+        return resp.data.get("result").get("value")
+
+    first = fetch(1)
+    count = first.get("count")
+    rows = first.get("auditdata")
+    if outformat == "csv":
+        fieldnames = []
+        for row in rows:
+            fieldnames.extend(k for k in row if k not in fieldnames)
+        writer = csv.DictWriter(outfile, fieldnames=fieldnames, extrasaction="ignore")
+        writer.writeheader()
+    else:
+        writer = outfile
+    write_audit_rows(writer, rows)
+
+    pages = (count + rp - 1) // rp
+    executor = bulk_executor(client, parallel)
+    for res in executor.run(fetch, range(2, pages + 1)):
+        if res.error:
+            raise click.ClickException("Could not fetch page {0!s}: {1!s}".format(
+                res.item, res.error))
+        write_audit_rows(writer, res.response.get("auditdata"))
+    outfile.flush()
+    click.echo("Exported {0!s} entries in {1!s} pages.".format(count, pages), err=True)
+
+
+def _sync_audit(client, statefile, outfile, rp, initial):
+    last_number = read_audit_state(statefile)
+    entries, newest = fetch_new_audit_entries(client, last_number, rp,
+                                              initial=initial)
+    write_audit_rows(outfile, entries)
+    outfile.flush()
+    # The state is written after the entries, so no entry gets lost, if we
+    # are interrupted.
+    if newest is not None and newest != last_number:
+        write_audit_state(statefile, newest)
+    return entries
+
+
+@audit.command()
+@click.pass_context
+@click.option("--statefile", help="The file, that holds the highest audit number fetched so far.",
+              required=True)
+@click.option("--outfile", help="The file to append the new entries to as JSON lines. "
+                                "Defaults to stdout.",
+              type=click.File("a"), default="-")
+@click.option("--rp", help="The number of entries fetched with one request",
+              type=int, default=100)
+@click.option("--initial", help="The number of existing entries to output, if there "
+                                "is no state file, yet.",
+              type=int, default=0)
+def sync(ctx, statefile, outfile, rp, initial):
+    """
+    Fetch the audit entries, that were written since the last call.
+    """
+    client = ctx.obj["pi_client"]
+    _sync_audit(client, statefile, outfile, rp, initial)
+
+
+@audit.command()
+@click.pass_context
+@click.option("--statefile", help="The file, that holds the highest audit number fetched so far.",
+              required=True)
+@click.option("--outfile", help="The file to append the new entries to as JSON lines. "
+                                "Defaults to stdout.",
+              type=click.File("a"), default="-")
+@click.option("--rp", help="The number of entries fetched with one request",
+              type=int, default=100)
+@click.option("--initial", help="The number of existing entries to output, if there "
+                                "is no state file, yet.",
+              type=int, default=0)
+@click.option("--interval", help="The seconds to wait between two requests.",
+              type=float, default=10)
+@click.option("--max-interval", help="If there are no new entries or the server is not "
+                                     "reachable, the interval is doubled up to this "
+                                     "number of seconds.",
+              type=float, default=300)
+def follow(ctx, statefile, outfile, rp, initial, interval, max_interval):
+    """
+    Continuously poll the audit log for new entries.
+    """
+    client = ctx.obj["pi_client"]
+    idle = 0
+    while True:
+        try:
+            entries = _sync_audit(client, statefile, outfile, rp, initial)
+        except Exception as e:
+            logging.getLogger(__name__).warning(
+                "Could not fetch the audit log: {0!s}".format(e))
+            entries = []
+        idle = 0 if entries else min(idle + 1, 32)
+        time.sleep(min(interval * 2 ** max(idle - 1, 0), max_interval))
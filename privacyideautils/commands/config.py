@@ -19,10 +19,12 @@
 import click
 import datetime
 import logging
+import sys
 from privacyideautils.clientutils import (showresult,
                                           dumpresult,
                                           privacyideaclient,
                                           __version__)
+from privacyideautils.bulk import bulk_executor
 
 
 @click.group()
@@ -49,28 +51,46 @@ def list(ctx):
 @click.pass_context
 @click.option('--config', required=True, multiple=True,
               help="Set a configuration value. Use it like --config key=value.")
-def set(ctx, config):
+@click.option('--parallel', help="The number of values, that are set in parallel.",
+              type=int, default=1)
+def set(ctx, config, parallel):
     """
     Set configuration values of privacyIDEA.
     """
     client = ctx.obj["pi_client"]
-    for conf in config:
+
+    def setconfig(conf):
         param = {}
         (k, v) = conf.split("=")
         param[k] = v
-        response = client.setconfig(param)
-        showresult(response.data)
+        return client.setconfig(param)
+
+    executor = bulk_executor(client, parallel)
+    for res in executor.run(setconfig, config):
+        if res.error:
+            print("Could not set %s: %s" % (res.item, res.error))
+        else:
+            showresult(res.response.data)
+    if executor.failed:
+        sys.exit(1)
 
 
 @config.command()
 @click.pass_context
 @click.option('--key', required=True, multiple=True,
               help="Delete config values from the privacyIDEA server by key.")
-def delete(ctx, key):
+@click.option('--parallel', help="The number of values, that are deleted in parallel.",
+              type=int, default=1)
+def delete(ctx, key, parallel):
     """
     Delete a configuration value from the privacyIDEA server.
     """
     client = ctx.obj["pi_client"]
-    for k in key:
-        response = client.deleteconfig(k)
-        showresult(response.data)
+    executor = bulk_executor(client, parallel)
+    for res in executor.run(client.deleteconfig, key):
+        if res.error:
+            print("Could not delete %s: %s" % (res.item, res.error))
+        else:
+            showresult(res.response.data)
+    if executor.failed:
+        sys.exit(1)
@@ -17,107 +17,79 @@
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 from __future__ import print_function
+import binascii
 import click
-import datetime
+import csv
+import json
 import logging
-import qrcode
+import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from six.moves import queue
 from privacyideautils.clientutils import (showresult,
                                           dumpresult,
                                           privacyideaclient,
+                                          PAGESIZE,
                                           __version__)
-from privacyideautils.etokenng import initetng
-from privacyideautils.initdaplug import init_dongle
-from privacyideautils.nitrokey import NitroKey
-from privacyideautils.yubikey import (enrollYubikey, YubikeyPlug,
-                                      create_static_password, MODE_YUBICO,
-                                      MODE_OATH, MODE_STATIC)
-from email.mime.text import MIMEText
-import smtplib
-
-
-def cifs_push(config, text):
-    '''
-    Push the the data text to a cifs share
-
-    :param config: dictionary with the fields cifs_server, cifs_share,
-                   cifs_dir, cifs_user, cifs_password
-    :type config: dict
-    :param text: text to be pushed to the windows share
-    :type text: string
-
-    '''
-    FILENAME = datetime.datetime.now().strftime("/tmp/%y%m%d-%H%M%S"
-                                                "_privacyideaadm.out")
-    f = open(FILENAME, 'w')
-    f.write(text)
-    f.close()
-
-    filename = os.path.basename(FILENAME)
-
-    print("Pushing %s to %s//%s/%s" % (filename,
-                                       config.get("cifs_server"),
-                                       config.get("cifs_share", ""),
-                                       config.get("cifs_dir")))
-
-    args = ["smbclient",
-            "//%s\\%s" % (config.get("cifs_server"),
-                          config.get("cifs_share", "")),
-            "-U", "%s%%%s" % (config.get("cifs_user"),
-                              config.get("cifs_password")), "-c",
-            "put %s %s\\%s" % (FILENAME,
-                               config.get("cifs_dir", "."),
-                               filename)]
-
-    p = subprocess.Popen(args,
-                         cwd=None,
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE,
-                         shell=False)
-    (result, error) = p.communicate()
-    _rcode = p.returncode
-    print(result)
-    print(error)
+from privacyideautils.bulk import bulk_executor
+from privacyideautils.journal import JobJournal, DONE, FAILED
+from privacyideautils.render import OUTPUT_FORMATS
 
-    try:
-        os.remove(FILENAME)
-    except Exception as e:
-        print("couldn't remove push test file: %r" % e)
+# The modules for the hardware tokens, the QR codes, emails and exports are
+# imported in the commands, that use them. This keeps the start of the
+# command line tool fast.
 
 
-def sendmail(config, text):
+def read_token_file(filename):
     """
-    Send an email with the text
+    Read the token definitions from a CSV file with a header line or from a
+    file with one JSON object per line. The file is read line by line.
 
-    :param config: dictionary with the fields mail_from, mail_to, mail_host,
-                   mail_subject
-    :type config: dict
-    :param text: text to be sent via mail
-    :type text: string
+    :param filename: The name of the file. Files ending with .json or
+        .jsonl are read as JSON lines.
+    :return: generator of tuples (line number, token parameters)
     """
-    if not config.get("mail_to"):
-        Exception("mail_to required!")
-
-    if not config.get("mail_host"):
-        Exception("mail_host required!")
+    with open(filename) as f:
+        if os.path.splitext(filename)[1].lower() in (".json", ".jsonl"):
+            for lineno, line in enumerate(f, 1):
+                if line.strip():
+                    yield lineno, json.loads(line)
+        else:
+            reader = csv.DictReader(f, skipinitialspace=True)
+            for row in reader:
+                yield reader.line_num, row
 
-    print("sending mail to %s" % config.get("mail_to"))
-    msg = MIMEText(text)
-    sender = config.get("mail_from")
-    recipient = config.get("mail_to")
-    msg['Subject'] = config.get("mail_subject")
-    msg['From'] = sender
-    msg['To'] = recipient
 
-    mail = smtplib.SMTP(config.get("mail_host"), config.get("mail_port") or 25)
-    mail.ehlo()
-    if config.get("mail_tls"):
-        mail.starttls()
-    if config.get("mail_user"):
-        mail.login(config.get("mail_user"), config.get("mail_password"))
+def read_batch_results(filename):
+    """
+    Return the line numbers of the token definitions, that were already
+    enrolled successfully according to the results file.
+    """
+    done = []
+    if os.path.exists(filename):
+        with open(filename) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # The last line may be incomplete after an interruption
+                    continue
+                if result.get("status") == "ok":
+                    done.append(result.get("line"))
+    return frozenset(done)
+
+
+def get_token_holders(client, realm):
+    """
+    Return the names of the users in the realm, who have at least one token.
 
-    mail.sendmail(sender, [recipient], msg.as_string())
-    mail.quit()
+    The token list of the realm is read once page by page.
+    """
+    return {tok.get("username")
+            for tok in client.iter_tokens({"tokenrealm": realm})
+            if tok.get("username") and tok.get("user_realm", realm) == realm}
 
 
 @click.group()
@@ -142,12 +114,27 @@ def token(ctx):
                               "result to a CIFS server with this username.")
 @click.option('--cifs_password', help="If exporting as CSV you can save the "
                               "result to a CIFS server with this password.")
+@click.option('--cifs_dir', help="The directory on the CIFS share.", default=".")
 @click.option('--mail_host', help="If exporting as CSV you can send the "
                               "result as mail via this mail host.")
 @click.option('--mail_to', help="If exporting as CSV you can send the "
                               "result to this email address.")
-def list(ctx, user, serial, csv, export_fields, mail_host, mail_to,
-         cifs_server, cifs_user, cifs_password):
+@click.option('--mail_from', help="The sender of the email with the CSV export.")
+@click.option('--outfile', help="Write the CSV export to this file instead of stdout.")
+@click.option('--gzip', 'compress', is_flag=True,
+              help="Compress the CSV export with gzip.")
+@click.option('--pagesize', help="The number of tokens fetched with one request.",
+              type=int, default=PAGESIZE)
+@click.option('--format', 'outformat', help="The output format of the token list. "
+                                            "The option --csv exports the token "
+                                            "list on the server instead.",
+              type=click.Choice(OUTPUT_FORMATS), default="table")
+@click.option('--autosize', is_flag=True,
+              help="Determine the column widths from the first tokens and do not "
+                   "truncate the cells of the table.")
+def list(ctx, user, serial, csv, export_fields, cifs_server, cifs_user, cifs_password,
+         cifs_dir, mail_host, mail_to, mail_from, outfile, compress, pagesize, outformat,
+         autosize):
     """
     List tokens
     """
@@ -158,22 +145,32 @@ def list(ctx, user, serial, csv, export_fields, mail_host, mail_to,
     if serial:
         param["serial"] = serial
     if csv:
+        from privacyideautils.export import (FileSink, GzipSink, MailSink, CifsSink,
+                                             export_filename, write_export)
         param['outform'] = 'csv'
         if export_fields:
             param['user_fields'] = export_fields
-        resp = client.listtoken(param)
-        r1 = resp.data
+        # The export is streamed from the server to all destinations.
+        filename = export_filename("csv", compress)
+        sinks = []
         if mail_host and mail_to:
-            sendmail(mail_host, mail_to, r1)
+            sinks.append(MailSink(mail_host, mail_to, filename,
+                                  mail_from=mail_from,
+                                  subject="privacyIDEA token export",
+                                  content_type="application/gzip"
+                                  if compress else "text/csv"))
         if cifs_server and cifs_user and cifs_password:
-            cifs_push(cifs_server, cifs_user, cifs_password, r1)
+            sinks.append(CifsSink(cifs_server, cifs_user, cifs_password,
+                                  filename, cifs_dir))
+        if outfile or not sinks:
+            sinks.append(FileSink(outfile))
+        if compress:
+            sinks = [GzipSink(sink) for sink in sinks]
+        write_export(client.get_stream("/token/", param), sinks)
     else:
-        resp = client.listtoken(param)
-        if resp.status == 200:
-            r1 = resp.data
-            result = r1['result']
-            dumpresult(result['status'],
-                       result['value']['tokens'])
+        # The tokens are printed while the following pages are fetched.
+        dumpresult(True, client.iter_tokens(param, pagesize=pagesize),
+                   outformat=outformat, autosize=autosize)
 
 
 @token.command()
@@ -216,6 +213,7 @@ def init(ctx, user, serial, description, pin, otpkey, genkey, type, etng):
         param["pin"] = pin
 
     if etng:
+        from privacyideautils.etokenng import initetng
         tokenlabel = user
         tdata = initetng({'label': tokenlabel,
                           'debug': True})
@@ -238,11 +236,80 @@ def init(ctx, user, serial, description, pin, otpkey, genkey, type, etng):
         if param.get("genkey"):
             print("otpkey: {0!s}".format(resp.data.get("detail", {}).get("otpkey", {}).get("value")))
             googleurl = resp.data.get("detail", {}).get("googleurl", {}).get("value")
+            import qrcode
             qr = qrcode.QRCode()
             qr.add_data(googleurl)
             qr.print_ascii(tty=True)
 
 
+@token.command("init-batch")
+@click.pass_context
+@click.option("-f", "--file", "filename", required=True,
+              help="A CSV file with a header line or a JSON lines file (*.jsonl) with "
+                   "the token definitions. Possible fields are type, serial, otpkey, "
+                   "user, realm, description and pin.")
+@click.option("--results", required=True,
+              help="The file, the results are appended to as JSON lines. It contains "
+                   "the serials and generated OTP keys. If the file exists, the tokens "
+                   "that were already enrolled are skipped.")
+@click.option("--parallel", help="The number of tokens, that are enrolled in parallel.",
+              type=int, default=4)
+def init_batch(ctx, filename, results, parallel):
+    """
+    Initialize many tokens from a file.
+
+    If the enrollment is interrupted, run the same command again to enroll
+    the remaining tokens.
+    """
+    client = ctx.obj["pi_client"]
+    done = read_batch_results(results)
+    skipped = []
+
+    def pending():
+        for lineno, definition in read_token_file(filename):
+            if lineno in done:
+                skipped.append(lineno)
+            else:
+                yield lineno, definition
+
+    def enroll(item):
+        param = {k: v for k, v in item[1].items() if v not in (None, "")}
+        if not param.get("otpkey") and \
+                param.get("type", "hotp").lower() in ("hotp", "totp"):
+            param["genkey"] = 1
+        return client.inittoken(param)
+
+    # The results contain OTP keys, so the file is only readable by the owner
+    fd = os.open(results, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+    with os.fdopen(fd, "a+") as resultfile:
+        if resultfile.tell():
+            resultfile.seek(resultfile.tell() - 1)
+            if resultfile.read(1) != "\n":
+                # Terminate the incomplete line of an interrupted run
+                resultfile.write("\n")
+        executor = bulk_executor(client, parallel)
+        for res in executor.run(enroll, pending()):
+            lineno, definition = res.item
+            result = {"line": lineno, "serial": definition.get("serial")}
+            if res.error:
+                result["status"] = "error"
+                result["error"] = str(res.error)
+                print("Line {0!s}: {1!s}".format(lineno, res.error))
+            else:
+                detail = res.response.data.get("detail", {})
+                result["status"] = "ok"
+                result["serial"] = detail.get("serial")
+                if detail.get("otpkey"):
+                    result["otpkey"] = detail.get("otpkey").get("value")
+            resultfile.write(json.dumps(result) + "\n")
+            resultfile.flush()
+
+    print("Enrolled {0!s} tokens, {1!s} failed, {2!s} skipped.".format(
+        executor.succeeded, executor.failed, len(skipped)))
+    if executor.failed:
+        sys.exit(1)
+
+
 @token.command()
 @click.pass_context
 @click.option("--realm",
@@ -262,9 +329,17 @@ def init(ctx, user, serial, description, pin, otpkey, genkey, type, etng):
               is_flag=True)
 @click.option("--mail_user", help="Username, if required by mailserver.")
 @click.option("--mail_password", help="Password, if required by mailserver.")
-@click.option("--mail_subject", help="The subject of the email")
+@click.option("--mail_connections", help="The number of connections to the mailserver, "
+                                         "that send emails in parallel.",
+              type=int, default=2)
+@click.option("--parallel", help="The number of tokens, that are enrolled in parallel.",
+              type=int, default=4)
+@click.option("--journal", help="Record the progress in this file. If the command is "
+                                "interrupted, run it again with the same journal to "
+                                "process only the remaining users and emails.")
 def registration(ctx, realm, dump, mail_host, mail_from, mail_subject,
-                 mail_body, mail_port, mail_tls, mail_user, mail_password):
+                 mail_body, mail_port, mail_tls, mail_user, mail_password,
+                 mail_connections, parallel, journal):
     """
     enroll registration tokens for all users in a realm, who do not have a
     token, yet.
@@ -274,40 +349,76 @@ def registration(ctx, realm, dump, mail_host, mail_from, mail_subject,
     data = response.data
     result = data.get('result')
     users = result.get('value')
+
+    journal = JobJournal(journal) if journal else None
+    enroll_op = "token registration {0!s}".format(realm)
+    mail_op = "token registration mail {0!s}".format(realm)
     tokens = []
-    for user in users:
+    if journal:
+        # The registration codes of the tokens, that were created by an
+        # interrupted job, are kept in the journal until the email is sent.
+        enrolled = journal.done(enroll_op)
+        mailed = journal.done(mail_op)
+        tokens = [token for username, token in enrolled.items()
+                  if token and username not in mailed]
+        users = [user for user in users if user.get("username") not in enrolled]
+
+    # Only the users, who have no token, get a registration token.
+    holders = get_token_holders(client, realm)
+    users = [user for user in users if user.get("username") not in holders]
+
+    def enroll(user):
         username = user.get("username")
-        email = user.get("email")
-        # check, if the user has tokens
-        count = get_users_token_num(client, username, realm)
-        if count == 0:
-            # User has no token, create one.
-            print("Creating token for user %s" % username)
-            response = client.inittoken({"type": "registration",
-                                         "user": username,
-                                         "realm": realm})
-            result = response.data.get("result")
-            detail = response.data.get("detail")
-            registrationcode = detail.get("registrationcode")
-            serial = detail.get("serial")
-            tokens.append({"username": username,
-                           "email": email,
-                           "serial": serial,
-                           "registration": registrationcode})
-
-    for token in tokens:
-        if dump:
-            print(token)
+        response = client.inittoken({"type": "registration",
+                                     "user": username,
+                                     "realm": realm})
+        detail = response.data.get("detail")
+        return {"username": username,
+                "email": user.get("email"),
+                "serial": detail.get("serial"),
+                "registration": detail.get("registrationcode")}
+
+    executor = bulk_executor(client, parallel)
+    for res in executor.run(enroll, users):
+        if res.error:
+            print("Could not create token for user %s: %s"
+                  % (res.item.get("username"), res.error))
         else:
-            print("Sending email to %(email)s" % token)
-            config = {"mail_to": token.get("email"),
-                      "mail_from": mail_from,
-                      "mail_host": mail_host,
-                      "mail_port": mail_port,
-                      "mail_tls": mail_tls,
-                      "mail_user": mail_user,
-                      "mail_password": mail_password}
-            sendmail(config, mail_body % token)
+            print("Created token for user %s" % res.item.get("username"))
+            tokens.append(res.response)
+        if journal:
+            journal.record(enroll_op, res.item.get("username"),
+                           FAILED if res.error else DONE,
+                           data=res.response, error=res.error)
+
+    mail_failed = 0
+    if dump:
+        for token in tokens:
+            print(token)
+            if journal:
+                journal.record(mail_op, token.get("username"), DONE)
+    elif tokens:
+        from privacyideautils.mailer import MailDispatcher
+        messages = [(token.get("email"), mail_subject, mail_body % token)
+                    for token in tokens]
+        with MailDispatcher(mail_host, mail_port, sender=mail_from,
+                            tls=mail_tls, user=mail_user,
+                            password=mail_password,
+                            workers=mail_connections) as mailer:
+            for token, res in zip(tokens, mailer.send(messages)):
+                if res.error:
+                    print("Could not send email to %s: %s"
+                          % (res.item[0], res.error))
+                    continue
+                print("Sent email to %s" % res.item[0])
+                if journal:
+                    journal.record(mail_op, token.get("username"), DONE)
+            mail_failed = mailer.failed
+
+    if journal:
+        journal.close()
+    if executor.failed or mail_failed:
+        sys.exit(1)
 
 
 @token.command()
@@ -323,7 +434,7 @@ def registration(ctx, realm, dump, mail_host, mail_from, mail_subject,
                    "the yubikey as prefix.", is_flag=True)
 @click.option("--yubimode", help="The mode the yubikey should "
                                  "be initialized in. (default=OATH)",
-              type=click.Choice([MODE_OATH, MODE_YUBICO, MODE_STATIC]),
+              type=click.Choice(["OATH", "YUBICO", "STATIC"]),
               default="OATH")
 @click.option("--filename",
               help="If the initialized yubikeys should not be "
@@ -352,86 +463,223 @@ def registration(ctx, realm, dump, mail_host, mail_from, mail_subject,
                    "only programmable with this new access key. "
                    "You can reset the access key by setting the "
                    "new access key to '000000000000'.")
+@click.option("--journal", help="Record the enrolled yubikeys in this file. Yubikeys, "
+                                "that are already enrolled, are skipped and tokens, "
+                                "which could not be submitted to the server, are "
+                                "submitted again at the next start.")
+@click.option("--multi", help="Enroll all yubikeys, that are plugged in, at the "
+                              "same time, e.g. with a USB hub. This requires "
+                              "--journal or --filename.",
+              is_flag=True)
 def yubikey_mass_enroll(ctx, yubiprefix, yubiprefixrandom, yubiprefixserial,
-                        yubimode, filename, yubislot, yubicr, description, access, newaccess, realm):
+                        yubimode, filename, yubislot, yubicr, description, access, newaccess,
+                        realm, journal, multi):
     """
     Initialize a bunch of yubikeys
     """
+    from privacyideautils.yubikey import enrollYubikey, YubikeyPlug
+    if multi and not (journal or filename):
+        # The tokens are submitted in the background. Without a journal or
+        # a file the OTP keys of tokens, that could not be submitted, would
+        # be lost.
+        raise click.UsageError("--multi requires --journal or --filename.")
     client = ctx.obj["pi_client"]
-    yp = YubikeyPlug()
-    while True:
-        print("\nPlease insert the next yubikey.", end=' ')
-        sys.stdout.flush()
-        submit_param = {}
-        _ret = yp.wait_for_new_yubikey()
-        otpkey, serial, prefix = enrollYubikey(
-            debug=False,
-            APPEND_CR=not yubicr,
-            prefix_serial=yubiprefixserial,
-            fixed_string=yubiprefix,
-            len_fixed_string=yubiprefixrandom,
-            slot=int(yubislot),
-            mode=yubimode,
-            challenge_response=yubicr,
-            access_key=access,
-            new_access_key=newaccess)
-        if yubimode == MODE_OATH:
-            # According to http://www.openauthentication.org/oath-id/prefixes/
-            # The OMP of Yubico is UB
-            # As TokenType we use OM (oath mode)
-            submit_param = {'type': 'HOTP',
-                            'serial': "UBOM%s_%s" % (serial, yubislot),
-                            'otpkey': otpkey,
-                            'description': description,
-                            'otplen': 6,
-                            'yubikey.prefix': prefix}
-            if yubicr:
-                submit_param['type'] = 'TOTP'
-                submit_param['timeStep'] = 30
-
-        elif yubimode == MODE_STATIC:
-            password = create_static_password(otpkey)
-            # print "otpkey   ", otpkey
-            # print "password ", password
-            submit_param = {'serial': "UBSM%s_%s" % (serial, yubi_slot),
-                            'otpkey': password,
-                            'type': "pw",
-                            'description': description,
-                            'yubikey.prefix': prefix}
-
-        elif yubimode == MODE_YUBICO:
-            yubi_otplen = 32
-            if prefix:
-                yubi_otplen = 32 + len(prefix)
-            elif yubiprefixrandom:
-                # default prefix length for MODE_YUBICO is 6
-                if yubiprefixrandom is None:
-                    yubiprefixrandom = 6
-                yubi_otplen = 32 + (yubiprefixrandom * 2)
-            # According to http://www.openauthentication.org/oath-id/prefixes/
-            # The OMP of Yubico is UB
-            # As TokenType we use AM (AES mode)
-            submit_param = {'type': 'yubikey',
-                            'serial': "UBAM%s_%s" % (serial, yubislot),
-                            'otpkey': otpkey,
-                            'otplen': yubi_otplen,
-                            'description': description,
-                            'yubikey.prefix': prefix}
-
-        if realm:
-            submit_param['realm'] = realm
+    journal = JobJournal(journal) if journal else None
+    operation = "token yubikey_mass_enroll"
 
+    def submit(item, submit_param):
         if filename:
             # Now we write the data to a file
             f = open(filename, mode="a")
             f.write("%(serial)s, %(otpkey)s, %(type)s, %(otplen)s\n" %
                     submit_param)
             f.close()
+        elif journal:
+            # The yubikey is already programmed. If the server can not be
+            # reached, we keep the token data to submit it later.
+            try:
+                resp = client.inittoken(submit_param)
+            except Exception as e:
+                print("Could not submit token %s: %s" % (submit_param.get("serial"), e))
+                journal.record(operation, item, FAILED, data=submit_param, error=e)
+                return
+            print(resp.status)
+            showresult(resp.data)
         else:
             # The token is submitted to the privacyIDEA system
             resp = client.inittoken(submit_param)
             print(resp.status)
             showresult(resp.data)
+        if journal:
+            journal.record(operation, item, DONE)
+
+    if journal:
+        for item, submit_param in journal.items(operation, (FAILED,)):
+            print("Submitting token %s again." % submit_param.get("serial"))
+            submit(item, submit_param)
+    # "set" is the command of this module
+    enrolled = {item for item in (journal.done(operation) if journal else ())}
+
+    enroll_param = {"debug": False,
+                    "APPEND_CR": not yubicr,
+                    "prefix_serial": yubiprefixserial,
+                    "fixed_string": yubiprefix,
+                    "len_fixed_string": yubiprefixrandom,
+                    "slot": int(yubislot),
+                    "mode": yubimode,
+                    "challenge_response": yubicr,
+                    "access_key": access,
+                    "new_access_key": newaccess}
+
+    def token_param(otpkey, serial, prefix):
+        submit_param = _yubikey_token_param(otpkey, serial, prefix, yubimode,
+                                            yubislot, yubicr, yubiprefixrandom,
+                                            description)
+        if realm:
+            submit_param['realm'] = realm
+        return submit_param
+
+    yp = YubikeyPlug()
+    if multi:
+        _enroll_yubikeys_parallel(yp, enroll_param, token_param, submit,
+                                  enrolled, yubislot)
+        return
+    while True:
+        print("\nPlease insert the next yubikey.", end=' ')
+        sys.stdout.flush()
+        _ret = yp.wait_for_new_yubikey()
+        item = "%s_%s" % (yp.last_serial, yubislot)
+        if item in enrolled:
+            print("The yubikey %s is already enrolled." % yp.last_serial)
+            continue
+        otpkey, serial, prefix = enrollYubikey(**enroll_param)
+        submit(item, token_param(otpkey, serial, prefix))
+        enrolled.add(item)
+
+
+def _yubikey_token_param(otpkey, serial, prefix, yubimode, yubislot, yubicr,
+                         yubiprefixrandom, description):
+    """
+    Return the parameters to initialize the token of an enrolled yubikey
+    on the privacyIDEA server.
+    """
+    from privacyideautils.yubikey import (create_static_password,
+                                          MODE_YUBICO, MODE_OATH, MODE_STATIC)
+    submit_param = {}
+    if yubimode == MODE_OATH:
+        # According to http://www.openauthentication.org/oath-id/prefixes/
+        # The OMP of Yubico is UB
+        # As TokenType we use OM (oath mode)
+        submit_param = {'type': 'HOTP',
+                        'serial': "UBOM%s_%s" % (serial, yubislot),
+                        'otpkey': otpkey,
+                        'description': description,
+                        'otplen': 6,
+                        'yubikey.prefix': prefix}
+        if yubicr:
+            submit_param['type'] = 'TOTP'
+            submit_param['timeStep'] = 30
+
+    elif yubimode == MODE_STATIC:
+        password = create_static_password(otpkey)
+        # print "otpkey   ", otpkey
+        # print "password ", password
+        submit_param = {'serial': "UBSM%s_%s" % (serial, yubislot),
+                        'otpkey': password,
+                        'type': "pw",
+                        'description': description,
+                        'yubikey.prefix': prefix}
+
+    elif yubimode == MODE_YUBICO:
+        yubi_otplen = 32
+        if prefix:
+            yubi_otplen = 32 + len(prefix)
+        elif yubiprefixrandom:
+            # default prefix length for MODE_YUBICO is 6
+            if yubiprefixrandom is None:
+                yubiprefixrandom = 6
+            yubi_otplen = 32 + (yubiprefixrandom * 2)
+        # According to http://www.openauthentication.org/oath-id/prefixes/
+        # The OMP of Yubico is UB
+        # As TokenType we use AM (AES mode)
+        submit_param = {'type': 'yubikey',
+                        'serial': "UBAM%s_%s" % (serial, yubislot),
+                        'otpkey': otpkey,
+                        'otplen': yubi_otplen,
+                        'description': description,
+                        'yubikey.prefix': prefix}
+    return submit_param
+
+
+def _enroll_yubikeys_parallel(yp, enroll_param, token_param, submit,
+                              enrolled, yubislot):
+    """
+    Enroll all plugged yubikeys at the same time with one thread for each
+    yubikey. The tokens are submitted by a separate thread, so that a slow
+    server does not hold up the programming of the yubikeys. Then wait for
+    the next yubikeys to be plugged in.
+
+    Yubikeys, that could not be enrolled, are tried again in the next round,
+    i.e. when a yubikey was plugged in or, without uevents, at the next poll.
+    """
+    from privacyideautils.yubikey import (enrollYubikey, find_yubikeys,
+                                          open_yubikey, release_yubikey)
+
+    submissions = queue.Queue()
+
+    def submitter():
+        while True:
+            job = submissions.get()
+            if job is None:
+                return
+            try:
+                submit(*job)
+            except Exception as e:
+                print("Could not submit token %s: %s" % (job[1].get("serial"),
+                                                         e))
+
+    def enroll(item, serial, position):
+        # Each worker opens its yubikey and releases it, when it is done
+        yk = open_yubikey(serial, position)
+        try:
+            otpkey, serial, prefix = enrollYubikey(yk=yk, **enroll_param)
+        finally:
+            release_yubikey(yk)
+        # The yubikey is programmed, the server may take its time
+        submissions.put((item, token_param(otpkey, serial, prefix)))
+
+    thread = threading.Thread(target=submitter)
+    thread.daemon = True
+    thread.start()
+    start = time.time()
+    count = 0
+    try:
+        while True:
+            new = [("%s_%s" % (serial, yubislot), serial, position)
+                   for serial, position in sorted(find_yubikeys().items())]
+            new = [key for key in new if key[0] not in enrolled]
+            if new:
+                print("\nEnrolling %s yubikeys." % len(new))
+                with ThreadPoolExecutor(max_workers=len(new)) as pool:
+                    results = [(key[0], pool.submit(enroll, *key))
+                               for key in new]
+                    for item, future in results:
+                        try:
+                            future.result()
+                            enrolled.add(item)
+                            count += 1
+                        except Exception as e:
+                            print("Could not enroll yubikey %s: %s" % (item, e))
+                minutes = max(time.time() - start, 1) / 60
+                print("Enrolled %s yubikeys in %.1f minutes (%.1f keys per "
+                      "minute)." % (count, minutes, count / minutes))
+                print("\nPlease replace the yubikeys.", end=' ')
+                sys.stdout.flush()
+            yp.watcher.wait_for_arrival()
+    finally:
+        submissions.put(None)
+        print("\nWaiting for the tokens to be submitted.")
+        thread.join()
 
 
 @token.command()
@@ -452,6 +700,7 @@ def nitrokey_mass_enroll(ctx, nitromode, slot, description, pin, digits, slotnam
     """
     Initialize a bunch of Nitrokeys
     """
+    from privacyideautils.nitrokey import NitroKey
     client = ctx.obj["pi_client"]
     NK = NitroKey()
     if nitromode == "TOTP":
@@ -504,6 +753,7 @@ def daplug_mass_enroll(ctx, keyboard, hidmap, otplen):
     """
     Initialize a bunch of daplug dongles.
     """
+    from privacyideautils.initdaplug import init_dongle
     client = ctx.obj["pi_client"]
     (serial, hotpkey) = init_dongle(keyboard=keyboard,
                                     mapping=hidmap,
@@ -535,6 +785,7 @@ def etokenng_mass_enroll(ctx, label, description):
     Random User PINs and SO-PINs will be set.
     The SO-PIN will be stored in the Token-Database.
     """)
+    from privacyideautils.etokenng import initetng
     client = ctx.obj["pi_client"]
     param = {}
     while True:
@@ -638,34 +889,61 @@ def enabletoken(ctx, serial, user):
 @click.option("--user", help="The username of the user, whose tokens should be deleted")
 @click.option("--realm", help="Delete all tokens of the given type in this realm.")
 @click.option("--type", help="Delete all tokens of this type in the given realm.")
-def delete(ctx, serial, user, realm, type):
+@click.option("--parallel", help="The number of tokens, that are deleted in parallel.",
+              type=int, default=1)
+@click.option("--journal", help="Record the progress in this file. If the command is "
+                                "interrupted, run it again with the same journal to "
+                                "delete only the remaining tokens.")
+def delete(ctx, serial, user, realm, type, parallel, journal):
     """
     Delete tokens based on serial, user, realm or token type.
     """
     client = ctx.obj["pi_client"]
+    if type and not realm and not serial and not user:
+        print("If you want to delete a tokentype, you need to specify a realm!")
+        sys.exit(1)
+    journal = JobJournal(journal) if journal else None
+    operation = "token delete " + json.dumps({"serial": serial, "user": user,
+                                              "realm": realm, "type": type},
+                                             sort_keys=True)
     serials = []
-    if serial:
+    if journal and journal.known(operation):
+        # Continue an interrupted job without listing the tokens again
+        serials = [item for item, _data in journal.items(operation)]
+        print("Resuming the job, %s tokens are left." % len(serials))
+
+    elif serial:
         serials = [serial]
 
     elif user:
-        response = client.listtoken({"user": user, "realm": realm})
-        value = response.data.get("result", {}).get("value")
-        for token in value.get("tokens"):
+        for token in client.iter_tokens({"user": user, "realm": realm}):
             serials.append(token.get("serial"))
 
     elif type:
-        if not realm:
-            print("If you want to delete a tokentype, you need to specify a realm!")
-            sys.exit(1)
-        response = client.listtoken({"tokenrealm": realm, "type": type})
-        value = response.data.get("result", {}).get("value")
-        for token in value.get("tokens"):
+        # All serials are read before deleting, since deleting tokens
+        # would shift the pages of the token list.
+        for token in client.iter_tokens({"tokenrealm": realm, "type": type}):
             serials.append(token.get("serial"))
 
-    for serial in serials:
-        print("Delete token %s" % serial)
-        response = client.deletetoken(serial)
-        showresult(response.data)
+    if journal:
+        journal.add(operation, serials)
+
+    executor = bulk_executor(client, parallel)
+    for res in executor.run(client.deletetoken, serials):
+        print("Delete token %s" % res.item)
+        if res.error:
+            print(res.error)
+        else:
+            showresult(res.response.data)
+        if journal:
+            journal.record(operation, res.item, FAILED if res.error else DONE,
+                           error=res.error)
+
+    if journal:
+        journal.close()
+    if executor.failed:
+        print("%s tokens could not be deleted." % executor.failed)
+        sys.exit(1)
 
 
 @token.command()
@@ -682,10 +960,56 @@ def resync(ctx, serial, otp1, otp2):
     param["serial"] = serial
     param["otp1"] = otp1
     param["otp2"] = otp2
-    response = client.removetoken(param)
+    response = client.resynctoken(param)
     showresult(response.data)
 
 
+@token.command()
+@click.option("--otpkey", help="The OTP key of the token in hex", required=True)
+@click.option("--otp1", help="First OTP value", required=True)
+@click.option("--otp2", help="Second consecutive OTP value", required=True)
+@click.option("--start", help="The first counter of the window. For TOTP "
+                              "tokens the default is the time step "
+                              "window/2 before now.", type=int)
+@click.option("--window", help="The number of counters to search.",
+              type=int, default=1000000)
+@click.option("--digits", help="The length of the OTP values.",
+              type=click.Choice(["6", "8"]), default="6")
+@click.option("--hashlib", "hashname", help="The hash algorithm.",
+              type=click.Choice(["sha1", "sha256", "sha512"]), default="sha1")
+@click.option("--timestep", help="Search the time steps of a TOTP token "
+                                 "with this step in seconds.", type=int)
+@click.option("--workers", help="The number of processes. The default is "
+                                "the number of CPUs.", type=int)
+def find_counter(otpkey, otp1, otp2, start, window, digits, hashname,
+                 timestep, workers):
+    """
+    Find the counter of two consecutive OTP values of a token, whose OTP key
+    is known, e.g. from the file of yubikey_mass_enroll. The counter shows,
+    how far the token is off, before it is resynchronized.
+    """
+    from privacyideautils.hotp import find_counter as search
+    if start is None:
+        start = int(time.time() // timestep) - window // 2 if timestep else 0
+    try:
+        key = binascii.unhexlify(otpkey)
+    except (TypeError, ValueError):
+        raise click.BadParameter("The OTP key must be hex.",
+                                 param_hint="--otpkey")
+    counter = search(key, otp1, otp2, start=start, window=window,
+                     digits=int(digits), hashname=hashname, workers=workers)
+    if counter is None:
+        click.echo("The OTP values were not found in the window "
+                   "{0!s} to {1!s}.".format(start, start + window - 1))
+        sys.exit(1)
+    if timestep:
+        click.echo("Found the OTP values at time step {0!s} ({1!s} seconds "
+                   "from now).".format(counter, int(counter * timestep -
+                                                    time.time())))
+    else:
+        click.echo("Found the OTP values at counter {0!s}.".format(counter))
+
+
 @token.command()
 @click.pass_context
 @click.option("--serial", help="Serial number of the token")
@@ -23,6 +23,7 @@ from privacyideautils.clientutils import (showresult,
                                           dumpresult,
                                           privacyideaclient,
                                           __version__)
+from privacyideautils.render import OUTPUT_FORMATS
 
 
 @click.group()
@@ -36,7 +37,12 @@ def user(ctx):
 
 @user.command()
 @click.pass_context
-def list(ctx):
+@click.option('--format', 'outformat', help="The output format of the user list.",
+              type=click.Choice(OUTPUT_FORMATS), default="table")
+@click.option('--autosize', is_flag=True,
+              help="Determine the column widths from the first users and do not "
+                   "truncate the cells of the table.")
+def list(ctx, outformat, autosize):
     """
     List all available users
     """
@@ -59,4 +65,5 @@ def list(ctx):
                result['value'],
                {'tabsize': tabsize, 'tabstr': tabstr,
                 'tabdelim': tabdelim, 'tabvisible': tabvisible,
-                'tabhead': tabhead, 'tabentry': tabentry})
+                'tabhead': tabhead, 'tabentry': tabentry},
+               outformat=outformat, autosize=autosize)
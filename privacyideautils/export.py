@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Write exports of the privacyIDEA server to files, emails or CIFS shares.
+
+The export is passed as a stream of chunks of bytes. Each sink writes the
+chunks as soon as they arrive, so neither the memory nor a temporary file
+needs to hold the complete export. The chunks can be compressed with gzip
+on the fly.
+"""
+from __future__ import print_function
+import base64
+import datetime
+import smtplib
+import subprocess
+import sys
+import zlib
+from email.utils import formatdate, make_msgid
+
+# The base64 encoding of 57 bytes is a line of 76 characters
+MAIL_LINE_BYTES = 57
+SMBCLIENT = "smbclient"
+
+
+def export_filename(extension="csv", compress=False):
+    """
+    Return a timestamped filename like 200413-153012_privacyideaadm.csv
+    """
+    filename = datetime.datetime.now().strftime(
+        "%y%m%d-%H%M%S_privacyideaadm.") + extension
+    if compress:
+        filename += ".gz"
+    return filename
+
+
+class FileSink(object):
+    """
+    Write the export to a file or to stdout.
+    """
+
+    def __init__(self, filename=None):
+        """
+        :param filename: The name of the file. If it is None, the export
+            is written to stdout.
+        """
+        if filename:
+            self.f = open(filename, "wb")
+        else:
+            self.f = getattr(sys.stdout, "buffer", sys.stdout)
+        self.filename = filename
+
+    def write(self, data):
+        self.f.write(data)
+
+    def close(self):
+        if self.filename:
+            self.f.close()
+        else:
+            self.f.flush()
+
+    abort = close
+
+
+class GzipSink(object):
+    """
+    Compress the data with gzip and pass it to another sink.
+    """
+
+    def __init__(self, sink, level=6):
+        self.sink = sink
+        # wbits 31 writes the gzip header and trailer
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def write(self, data):
+        compressed = self.compressor.compress(data)
+        if compressed:
+            self.sink.write(compressed)
+
+    def close(self):
+        self.sink.write(self.compressor.flush())
+        self.sink.close()
+
+    def abort(self):
+        self.sink.abort()
+
+
+class MailSink(object):
+    """
+    Send the export as the attachment of an email.
+
+    The message is written to the SMTP DATA command while the export is
+    read. The attachment is base64 encoded line by line.
+    """
+
+    def __init__(self, mail_host, mail_to, attachment, mail_from=None,
+                 subject="privacyIDEA export", text="", mail_port=25,
+                 mail_tls=False, mail_user=None, mail_password=None,
+                 content_type="text/csv"):
+        self.buffer = b""
+        self.boundary = "==privacyidea-export-{0!s}==".format(
+            make_msgid().strip("<>").split("@")[0])
+        mail_from = mail_from or mail_to
+        self.mail = smtplib.SMTP(mail_host, mail_port or 25)
+        try:
+            self.mail.ehlo()
+            if mail_tls:
+                self.mail.starttls()
+                self.mail.ehlo()
+            if mail_user:
+                self.mail.login(mail_user, mail_password)
+            self._check(self.mail.mail(mail_from), 250)
+            self._check(self.mail.rcpt(mail_to), 250, 251)
+            self.mail.putcmd("data")
+            self._check(self.mail.getreply(), 354)
+        except Exception:
+            self.mail.close()
+            raise
+        headers = ["From: {0!s}".format(mail_from),
+                   "To: {0!s}".format(mail_to),
+                   "Subject: {0!s}".format(subject),
+                   "Date: {0!s}".format(formatdate(localtime=True)),
+                   "MIME-Version: 1.0",
+                   'Content-Type: multipart/mixed; boundary="{0!s}"'.format(
+                       self.boundary),
+                   "",
+                   "--" + self.boundary,
+                   'Content-Type: text/plain; charset="utf-8"',
+                   "Content-Transfer-Encoding: base64",
+                   "",
+                   base64.encodebytes(text.encode("utf-8")).decode(
+                       "ascii").replace("\n", "\r\n"),
+                   "--" + self.boundary,
+                   'Content-Type: {0!s}; name="{1!s}"'.format(content_type,
+                                                             attachment),
+                   "Content-Transfer-Encoding: base64",
+                   'Content-Disposition: attachment; filename="{0!s}"'.format(
+                       attachment),
+                   "", ""]
+        self.mail.send("\r\n".join(headers).encode("ascii"))
+
+    @staticmethod
+    def _check(reply, *codes):
+        code, message = reply
+        if code not in codes:
+            raise smtplib.SMTPResponseException(code, message)
+
+    def _send_lines(self, data):
+        self.mail.send(base64.encodebytes(data).replace(b"\n", b"\r\n"))
+
+    def write(self, data):
+        self.buffer += data
+        # Only send complete lines of the base64 encoding
+        complete = len(self.buffer) - len(self.buffer) % MAIL_LINE_BYTES
+        if complete:
+            self._send_lines(self.buffer[:complete])
+            self.buffer = self.buffer[complete:]
+
+    def close(self):
+        try:
+            if self.buffer:
+                self._send_lines(self.buffer)
+            self.mail.send("\r\n--{0!s}--\r\n.\r\n".format(
+                self.boundary).encode("ascii"))
+            self._check(self.mail.getreply(), 250)
+            self.mail.quit()
+        finally:
+            self.mail.close()
+
+    def abort(self):
+        # The server discards the message, if the connection is closed
+        # during the DATA command.
+        self.mail.close()
+
+
+class CifsSink(object):
+    """
+    Push the export to a CIFS share. The data is piped to smbclient.
+    """
+
+    def __init__(self, cifs_server, cifs_user, cifs_password, filename,
+                 cifs_dir="."):
+        """
+        :param cifs_server: The share like //server/share
+        :param filename: The name of the file on the share
+        """
+        print("Pushing %s to %s/%s" % (filename, cifs_server, cifs_dir),
+              file=sys.stderr)
+        args = [SMBCLIENT, cifs_server,
+                "-U", "%s%%%s" % (cifs_user, cifs_password), "-c",
+                "put /dev/stdin %s\\%s" % (cifs_dir, filename)]
+        self.p = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.STDOUT)
+
+    def write(self, data):
+        self.p.stdin.write(data)
+
+    def close(self):
+        self.p.stdin.close()
+        output = self.p.stdout.read()
+        self.p.stdout.close()
+        if self.p.wait() != 0:
+            raise IOError("smbclient failed: {0!s}".format(
+                output.decode("utf-8", "replace")))
+
+    def abort(self):
+        self.p.kill()
+        self.p.wait()
+
+
+def write_export(chunks, sinks):
+    """
+    Write the chunks to all sinks and close the sinks.
+
+    :param chunks: An iterable of bytes
+    :param sinks: A list of sinks
+    :return: the number of bytes of the export
+    """
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            for sink in sinks:
+                sink.write(chunk)
+    except Exception:
+        # Do not deliver an incomplete export
+        for sink in sinks:
+            sink.abort()
+        raise
+    for sink in sinks:
+        sink.close()
+    return size
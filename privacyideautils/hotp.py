@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Calculate many HOTP (RFC 4226) and TOTP (RFC 6238) values at once.
+
+This is used to precompute OTP values, e.g. for offline windows or test
+data. The HMAC of a key is calculated from the hash states of the inner and
+outer padded key, which are computed only once per key and copied for each
+counter. The digests of a range are collected in one buffer and truncated
+together.
+
+find_counter searches the counter of two consecutive OTP values in a large
+window, e.g. to resynchronize a token, whose seed is known.
+"""
+import hashlib
+import os
+import struct
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+PACK_COUNTER = struct.Struct(">Q").pack
+UNPACK_BINARY = struct.Struct(">I").unpack_from
+# The number of counters, that a worker of find_counter checks at once
+CHUNK_SIZE = 100000
+
+
+class HmacOtp(object):
+    """
+    Calculate the OTP values of one key.
+
+    The OTP values are returned as strings with leading zeros.
+    """
+
+    def __init__(self, key, digits=6, hashfunc=hashlib.sha1):
+        """
+        :param key: The OTP key as bytes
+        :param digits: The number of digits of an OTP value
+        :param hashfunc: The hash function like hashlib.sha1 or
+            hashlib.sha256
+        """
+        self.digits = digits
+        self.modulo = 10 ** digits
+        self.format = "{0:0" + str(digits) + "d}"
+        inner = hashfunc()
+        outer = hashfunc()
+        block_size = inner.block_size
+        self.digest_size = inner.digest_size
+        if len(key) > block_size:
+            key = hashfunc(key).digest()
+        key = bytearray(key.ljust(block_size, b"\0"))
+        inner.update(bytes(bytearray(b ^ 0x36 for b in key)))
+        outer.update(bytes(bytearray(b ^ 0x5c for b in key)))
+        self._inner = inner
+        self._outer = outer
+
+    def hmac(self, counter):
+        """
+        :return: The HMAC of the counter as bytes
+        """
+        inner = self._inner.copy()
+        inner.update(PACK_COUNTER(counter))
+        outer = self._outer.copy()
+        outer.update(inner.digest())
+        return outer.digest()
+
+    def truncate(self, buf, count=1):
+        """
+        Truncate the digests in the buffer to OTP values.
+
+        :param buf: The digests one after another
+        :param count: The number of digests in the buffer
+        :return: list of OTP values
+        """
+        size = self.digest_size
+        modulo = self.modulo
+        fmt = self.format.format
+        buf = bytearray(buf)
+        otps = []
+        for base in range(0, count * size, size):
+            offset = base + (buf[base + size - 1] & 0x0f)
+            otps.append(fmt((UNPACK_BINARY(buf, offset)[0] & 0x7fffffff) %
+                            modulo))
+        return otps
+
+    def generate(self, counter):
+        """
+        :return: The OTP value of the counter
+        """
+        return self.truncate(self.hmac(counter))[0]
+
+    def generate_range(self, start, count):
+        """
+        Calculate the OTP values of the counters start to start + count - 1.
+
+        :return: list of OTP values
+        """
+        inner_copy = self._inner.copy
+        outer_copy = self._outer.copy
+        digests = []
+        for counter in range(start, start + count):
+            inner = inner_copy()
+            inner.update(PACK_COUNTER(counter))
+            outer = outer_copy()
+            outer.update(inner.digest())
+            digests.append(outer.digest())
+        return self.truncate(b"".join(digests), count)
+
+    def generate_time(self, count, timestamp=None, timestep=30):
+        """
+        Calculate the TOTP values of count time steps starting with the time
+        step of the timestamp.
+
+        :param timestamp: The unix time. The default is now.
+        :return: list of OTP values
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        return self.generate_range(int(timestamp // timestep), count)
+
+
+def generate_many(keys, start=0, count=1, digits=6, hashfunc=hashlib.sha1):
+    """
+    Calculate the OTP values of the same counter range for many keys.
+
+    :param keys: The OTP keys as bytes
+    :return: list with a list of OTP values for each key
+    """
+    return [HmacOtp(key, digits, hashfunc).generate_range(start, count)
+            for key in keys]
+
+
+def _search_chunk(key, otp1, otp2, start, count, digits, hashname):
+    """
+    Return the first counter in start to start + count - 1, that generates
+    otp1, while the next counter generates otp2, or None.
+    """
+    otp = HmacOtp(key, digits, getattr(hashlib, hashname))
+    # One more value, so that otp2 is found at the end of the chunk
+    values = otp.generate_range(start, count + 1)
+    index = -1
+    while True:
+        try:
+            # The scan of the list runs in C
+            index = values.index(otp1, index + 1, count)
+        except ValueError:
+            return None
+        if values[index + 1] == otp2:
+            return start + index
+
+
+def find_counter(key, otp1, otp2, start=0, window=1000000, digits=6,
+                 hashname="sha1", workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Find the counter of two consecutive OTP values.
+
+    The window is split into chunks, which are searched in worker
+    processes. The chunks are checked in the order of the counter and the
+    search stops at the first chunk, that contains the OTP values.
+
+    :param key: The OTP key as bytes
+    :param otp1: The first OTP value
+    :param otp2: The next OTP value
+    :param start: The first counter of the window. For TOTP this is the time
+        step.
+    :param window: The number of counters to search
+    :param hashname: The name of the hash function in hashlib
+    :param workers: The number of processes. The default is the number of
+        CPUs.
+    :return: The counter of otp1 or None
+    """
+    chunks = ((chunk_start, min(chunk_size, start + window - chunk_start))
+              for chunk_start in range(start, start + window, chunk_size))
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or window <= chunk_size:
+        for chunk_start, count in chunks:
+            counter = _search_chunk(key, otp1, otp2, chunk_start, count,
+                                    digits, hashname)
+            if counter is not None:
+                return counter
+        return None
+
+    pending = deque()
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for chunk_start, count in chunks:
+            pending.append(pool.submit(_search_chunk, key, otp1, otp2,
+                                       chunk_start, count, digits, hashname))
+            # Keep all workers busy, but do not queue the whole window
+            if len(pending) >= 2 * workers:
+                counter = pending.popleft().result()
+                if counter is not None:
+                    return counter
+        while pending:
+            counter = pending.popleft().result()
+            if counter is not None:
+                return counter
+        return None
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
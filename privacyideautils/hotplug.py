@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Wait for USB devices to be plugged in.
+
+On Linux the kernel sends a uevent over a netlink socket, when a device is
+added. The watcher listens on this socket, so that a new device is noticed
+at once without enumerating the USB bus again and again. On other systems
+or if the socket can not be opened, the watcher falls back to polling.
+"""
+import logging
+import select
+import socket
+import time
+
+log = logging.getLogger(__name__)
+
+NETLINK_KOBJECT_UEVENT = 15
+# The multicast group of the uevents sent by the kernel
+UEVENT_GROUP_KERNEL = 1
+YUBICO_VENDOR_ID = 0x1050
+# A device sends several uevents, when it is plugged in, and udev needs some
+# time to set up the device node. So we wait until no event was received
+# for this number of seconds.
+DEBOUNCE = 0.3
+POLL_INTERVAL = 1
+
+
+def parse_uevent(data):
+    """
+    Parse a kernel uevent like "add@/devices/...\\0ACTION=add\\0...".
+
+    :param data: The message as bytes
+    :return: dictionary of the environment of the event
+    """
+    event = {}
+    for field in data.split(b"\0")[1:]:
+        key, sep, value = field.partition(b"=")
+        if sep:
+            event[key.decode("ascii", "replace")] = \
+                value.decode("utf-8", "replace")
+    return event
+
+
+def is_usb_arrival(event, vendor_id=None):
+    """
+    Check, if the uevent reports a new USB device of the vendor.
+
+    :param vendor_id: The USB vendor ID or None for all vendors
+    """
+    if event.get("ACTION") != "add" or event.get("SUBSYSTEM") != "usb" or \
+            event.get("DEVTYPE") != "usb_device":
+        return False
+    if vendor_id is None:
+        return True
+    # PRODUCT is vendor/product/bcdDevice in hex without leading zeros
+    try:
+        return int(event.get("PRODUCT", "").split("/")[0], 16) == vendor_id
+    except ValueError:
+        return False
+
+
+class HotplugWatcher(object):
+    """
+    Wait for USB devices of a vendor to be plugged in.
+    """
+
+    def __init__(self, vendor_id=YUBICO_VENDOR_ID, debounce=DEBOUNCE,
+                 poll_interval=POLL_INTERVAL, sock=None):
+        """
+        :param vendor_id: The USB vendor ID or None for all vendors
+        :param debounce: The number of seconds without events, after which
+            an arrival is reported
+        :param poll_interval: The number of seconds to wait, if there are no
+            uevents
+        :param sock: An opened uevent socket. By default a netlink socket
+            is opened.
+        """
+        self.vendor_id = vendor_id
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.sock = sock if sock is not None else self._open_netlink()
+
+    @staticmethod
+    def _open_netlink():
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                                 NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, UEVENT_GROUP_KERNEL))
+        except (AttributeError, socket.error) as e:
+            log.info("Can not listen for uevents, polling for devices: "
+                     "{0!s}".format(e))
+            return None
+        return sock
+
+    @property
+    def event_driven(self):
+        """
+        True, if the arrival of devices is reported by uevents
+        """
+        return self.sock is not None
+
+    def _read(self, timeout):
+        """
+        :return: The next uevent or None, if there was no event within
+            timeout seconds
+        """
+        if timeout is not None and timeout <= 0:
+            return None
+        readable, _w, _x = select.select([self.sock], [], [], timeout)
+        if not readable:
+            return None
+        return parse_uevent(self.sock.recv(65536))
+
+    def wait_for_arrival(self, timeout=None):
+        """
+        Wait until a device was plugged in.
+
+        Without uevents this waits for the poll interval and the caller
+        needs to look for a new device.
+
+        :param timeout: The maximum number of seconds to wait
+        :return: True, if a device was plugged in, False after the timeout
+            and None without uevents
+        """
+        if not self.event_driven:
+            time.sleep(self.poll_interval if timeout is None
+                       else max(0, min(timeout, self.poll_interval)))
+            return None
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            event = self._read(remaining)
+            if event is not None and is_usb_arrival(event, self.vendor_id):
+                break
+        # Wait for the remaining events of the device to settle
+        while self._read(self.debounce) is not None:
+            pass
+        return True
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+A journal, that records the progress of long running bulk jobs.
+
+Each item of a job is stored with its status in an SQLite file. If a job is
+interrupted, it can be restarted with the same journal. Items, that are
+done, are skipped and only the pending and failed items are processed
+again.
+
+The journal can be used from several threads.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobJournal(object):
+    """
+    The journal holds the items of several operations. An operation is a
+    string, that identifies the job like "token delete realm1 hotp".
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: The SQLite file. It is created with the mode 0600,
+            since the data of the items may contain secrets.
+        """
+        self.filename = filename
+        if not os.path.exists(filename):
+            os.close(os.open(filename, os.O_WRONLY | os.O_CREAT, 0o600))
+        # The connection is shared by all threads and guarded by the lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS journal "
+                          "(operation TEXT, item TEXT, status TEXT, "
+                          "data TEXT, error TEXT, updated REAL, "
+                          "PRIMARY KEY (operation, item))")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def known(self, operation):
+        """
+        Return True, if the journal contains items of the operation.
+        """
+        with self.lock:
+            cur = self.conn.execute("SELECT 1 FROM journal "
+                                    "WHERE operation=? LIMIT 1", (operation,))
+            return cur.fetchone() is not None
+
+    def add(self, operation, items):
+        """
+        Add items to the operation with the status pending. Items, that
+        are already in the journal, keep their status.
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO journal "
+                                  "(operation, item, status, updated) "
+                                  "VALUES (?, ?, ?, ?)",
+                                  ((operation, item, PENDING, now)
+                                   for item in items))
+
+    def record(self, operation, item, status, data=None, error=None):
+        """
+        Set the status of an item.
+
+        :param data: Additional data of the item, that is needed to
+            continue the job. It must be serializable as JSON.
+        :param error: The error message of a failed item
+        """
+        with self.lock, self.conn:
+            # An upsert keeps the rowid and thus the order of the items
+            self.conn.execute("INSERT INTO journal "
+                              "(operation, item, status, data, error, "
+                              "updated) VALUES (?, ?, ?, ?, ?, ?) "
+                              "ON CONFLICT (operation, item) DO UPDATE SET "
+                              "status=excluded.status, data=excluded.data, "
+                              "error=excluded.error, "
+                              "updated=excluded.updated",
+                              (operation, item, status,
+                               json.dumps(data) if data is not None else None,
+                               None if error is None else str(error),
+                               time.time()))
+
+    def items(self, operation, statuses=(PENDING, FAILED)):
+        """
+        Return the items of the operation with one of the given statuses in
+        the order they were added.
+
+        :return: list of tuples (item, data)
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT item, data FROM journal "
+                                     "WHERE operation=? AND status IN ({0!s}) "
+                                     "ORDER BY rowid".format(
+                                         ",".join("?" * len(statuses))),
+                                     (operation,) + tuple(statuses)).fetchall()
+        return [(item, json.loads(data) if data else None)
+                for item, data in rows]
+
+    def done(self, operation):
+        """
+        Return the items of the operation, that are done.
+
+        :return: dictionary of items and their data
+        """
+        return dict(self.items(operation, (DONE,)))
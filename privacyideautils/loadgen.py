@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Generate load on the /validate/check endpoint of a privacyIDEA server.
+
+A number of worker threads send authentication requests for a given
+duration. The requests of all workers share one connection pool, so that
+the handshake of new connections is not measured. If a rate is given, the
+workers start the requests at this rate. The latency of a request is then
+measured from the time, at which it should have been started, so that an
+overloaded server is not hidden by workers waiting for their last response.
+"""
+import csv
+import io
+import itertools
+import json
+import math
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+# Use a clock, that is not changed by NTP, if it is available
+clock = getattr(time, "monotonic", time.time)
+
+PERCENTILES = (50, 95, 99)
+
+
+def read_credentials(filename):
+    """
+    Read the users and passwords from a CSV file. Each line contains the
+    username, the password and optionally the realm. Empty lines and lines
+    starting with # are skipped.
+
+    :return: list of dictionaries with the parameters user, pass and realm
+    """
+    credentials = []
+    with io.open(filename, encoding="utf-8", newline="") as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith("#"):
+                continue
+            if len(row) < 2:
+                raise ValueError("The line {0!r} does not contain a user and "
+                                 "a password.".format(",".join(row)))
+            data = {"user": row[0].strip(), "pass": row[1]}
+            if len(row) > 2 and row[2].strip():
+                data["realm"] = row[2].strip()
+            credentials.append(data)
+    if not credentials:
+        raise ValueError("No credentials found in {0!s}".format(filename))
+    return credentials
+
+
+def percentile(values, p):
+    """
+    Return the p-th percentile of the sorted values by the nearest rank
+    method.
+    """
+    if not values:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+class RateLimiter(object):
+    """
+    Hand out start times at a fixed rate to all workers. If the workers fall
+    behind, the start times in the past are handed out immediately.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_start = None
+
+    def wait(self):
+        """
+        Wait for the next start time.
+
+        :return: the start time
+        """
+        with self.lock:
+            if self.next_start is None:
+                self.next_start = clock()
+            start = self.next_start
+            self.next_start += self.interval
+        delay = start - clock()
+        if delay > 0:
+            time.sleep(delay)
+        return start
+
+
+class LoadReport(object):
+    """
+    The results of a load run. The latencies are in seconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = {}
+        self.duration = 0
+
+    def add(self, latency, outcome):
+        with self.lock:
+            self.latencies.append(latency)
+            if outcome is True:
+                self.accepted += 1
+            elif outcome is False:
+                self.rejected += 1
+            else:
+                self.errors[outcome] = self.errors.get(outcome, 0) + 1
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    def as_dict(self):
+        latencies = sorted(self.latencies)
+        latency = {"p{0:d}".format(p): percentile(latencies, p)
+                   for p in PERCENTILES}
+        latency["max"] = latencies[-1] if latencies else None
+        return {"requests": self.requests,
+                "duration": self.duration,
+                "throughput": self.requests / self.duration
+                if self.duration else 0,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "errors": dict(self.errors),
+                "latency": latency}
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=4, sort_keys=True)
+
+    def to_text(self):
+        result = self.as_dict()
+        lines = ["requests:   {0:d} in {1:.1f}s".format(result["requests"],
+                                                       result["duration"]),
+                 "throughput: {0:.1f} req/s".format(result["throughput"]),
+                 "accepted:   {0:d}".format(result["accepted"]),
+                 "rejected:   {0:d}".format(result["rejected"]),
+                 "errors:     {0:d}".format(sum(result["errors"].values()))]
+        for error, count in sorted(result["errors"].items()):
+            lines.append("    {0!s}: {1:d}".format(error, count))
+        for name in ["p{0:d}".format(p) for p in PERCENTILES] + ["max"]:
+            value = result["latency"][name]
+            lines.append("{0!s:11} {1!s}".format(
+                name + ":", "-" if value is None else
+                "{0:.1f}ms".format(value * 1000)))
+        return "\n".join(lines)
+
+
+class LoadGenerator(object):
+    """
+    Send /validate/check requests with the given credentials from several
+    workers.
+    """
+
+    def __init__(self, url, credentials, workers=4, rate=None,
+                 verify=True, timeout=5, client=None):
+        """
+        :param url: The URL of the privacyIDEA server
+        :param credentials: list of request parameters like user, pass and
+            realm. The workers use them one after another.
+        :param workers: The number of concurrent requests
+        :param rate: The number of requests per second of all workers or
+            None to send the requests as fast as possible
+        :param client: The client IP, that is sent with each request
+        """
+        self.url = url.rstrip("/") + "/validate/check"
+        self.credentials = itertools.cycle(credentials)
+        self.credentials_lock = threading.Lock()
+        self.workers = max(1, int(workers))
+        self.limiter = RateLimiter(rate) if rate else None
+        self.timeout = timeout
+        self.client = client
+        self.session = requests.Session()
+        self.session.verify = verify
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _next_data(self):
+        with self.credentials_lock:
+            data = dict(next(self.credentials))
+        if self.client:
+            data["client"] = self.client
+        return data
+
+    def check(self, data):
+        """
+        Send one request.
+
+        :return: True or False for the authentication result or a string
+            describing the error
+        """
+        try:
+            r = self.session.post(self.url, data=data, timeout=self.timeout)
+        except requests.RequestException as e:
+            return type(e).__name__
+        if r.status_code != 200:
+            return "HTTP {0:d}".format(r.status_code)
+        try:
+            result = r.json().get("result", {})
+        except ValueError:
+            return "invalid response"
+        if not result.get("status"):
+            return "error {0!s}".format(result.get("error", {}).get("code"))
+        return bool(result.get("value"))
+
+    def _worker(self, deadline, report):
+        while True:
+            start = self.limiter.wait() if self.limiter else clock()
+            if start >= deadline:
+                return
+            outcome = self.check(self._next_data())
+            report.add(clock() - start, outcome)
+
+    def run(self, duration):
+        """
+        Run the workers for duration seconds.
+
+        :return: LoadReport
+        """
+        report = LoadReport()
+        begin = clock()
+        deadline = begin + duration
+        threads = [threading.Thread(target=self._worker,
+                                    args=(deadline, report))
+                   for _i in range(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report.duration = clock() - begin
+        return report
+
+    def close(self):
+        self.session.close()
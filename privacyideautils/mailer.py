@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Send many emails over a small number of SMTP connections.
+
+Each worker thread keeps its own connection to the mail server. The
+connection is opened, secured with STARTTLS and authenticated once and then
+used for many messages. If the server closes the connection, the worker
+connects again and retries the message.
+"""
+import logging
+import smtplib
+import threading
+from email.mime.text import MIMEText
+from privacyideautils.bulk import BulkExecutor
+
+log = logging.getLogger(__name__)
+
+
+def create_message(sender, recipient, subject, text):
+    """
+    Create a plain text email.
+
+    :return: the message as string
+    """
+    msg = MIMEText(text)
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = recipient
+    return msg.as_string()
+
+
+class MailDispatcher(object):
+    """
+    Send emails with a bounded number of reused SMTP connections::
+
+        with MailDispatcher("mail.example.com", sender="pi@example.com",
+                            tls=True, user="pi", password="secret") as mailer:
+            for res in mailer.send([(recipient, subject, text), ...]):
+                if res.error:
+                    print(res.item[0], res.error)
+    """
+
+    def __init__(self, host, port=25, sender=None, tls=False, user=None,
+                 password=None, workers=1, max_messages=100, timeout=30):
+        """
+        :param workers: The number of connections, that send mails in
+            parallel.
+        :type workers: int
+        :param max_messages: The number of messages, that are sent over one
+            connection, before it is opened again. Some relays limit the
+            messages per session.
+        :type max_messages: int
+        :param timeout: The timeout of the socket operations in seconds
+        """
+        self.host = host
+        self.port = port or 25
+        self.sender = sender
+        self.tls = tls
+        self.user = user
+        self.password = password
+        self.workers = workers
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self.sent = 0
+        self.failed = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _connect(self):
+        mail = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            mail.ehlo()
+            if self.tls:
+                mail.starttls()
+                mail.ehlo()
+            if self.user:
+                mail.login(self.user, self.password)
+        except Exception:
+            mail.close()
+            raise
+        with self._lock:
+            self._connections.append(mail)
+        self._local.count = 0
+        return mail
+
+    def _disconnect(self, mail, quit=False):
+        with self._lock:
+            if mail in self._connections:
+                self._connections.remove(mail)
+        try:
+            if quit:
+                mail.quit()
+            else:
+                mail.close()
+        except OSError:
+            # SMTPException is a subclass of OSError
+            pass
+        if getattr(self._local, "connection", None) is mail:
+            self._local.connection = None
+
+    def _connection(self):
+        mail = getattr(self._local, "connection", None)
+        if mail is not None and self._local.count >= self.max_messages:
+            self._disconnect(mail, quit=True)
+            mail = None
+        if mail is None:
+            mail = self._local.connection = self._connect()
+        return mail
+
+    def send_message(self, recipient, subject, text):
+        """
+        Send one email over the connection of the current thread. If the
+        connection is broken, the message is sent once more over a new
+        connection.
+        """
+        message = create_message(self.sender, recipient, subject, text)
+        for attempt in (1, 2):
+            mail = self._connection()
+            try:
+                mail.sendmail(self.sender, [recipient], message)
+                self._local.count += 1
+                return recipient
+            except smtplib.SMTPServerDisconnected as e:
+                log.debug("Lost the connection to the mail server: "
+                          "{0!r}".format(e))
+                self._disconnect(mail)
+                if attempt == 2:
+                    raise
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code != 421:
+                    raise
+                # The server is shutting down the session
+                self._disconnect(mail)
+                if attempt == 2:
+                    raise
+            except smtplib.SMTPException:
+                # The recipient was refused. The connection is still usable.
+                raise
+            except OSError as e:
+                log.debug("Lost the connection to the mail server: "
+                          "{0!r}".format(e))
+                self._disconnect(mail)
+                if attempt == 2:
+                    raise
+
+    def send(self, messages):
+        """
+        Send the messages with the worker threads.
+
+        :param messages: An iterable of tuples (recipient, subject, text)
+        :return: generator of BulkResult in the order of the messages. The
+            item of the result is the tuple of the message.
+        """
+        executor = BulkExecutor(self.workers)
+        for res in executor.run(lambda m: self.send_message(*m), messages):
+            if res.error:
+                self.failed += 1
+            else:
+                self.sent += 1
+            yield res
+
+    def close(self):
+        """
+        Close all connections to the mail server.
+        """
+        with self._lock:
+            connections = self._connections[:]
+        for mail in connections:
+            self._disconnect(mail, quit=True)
@@ -26,83 +26,252 @@ Used to do offline authentication
 import base64
 from os import urandom
 import binascii
+import hmac
 from hashlib import sha256
+import six
 import sqlite3
 
+HASH_PREFIX = '{SSHA256}'
+
 
 def salted_hash_256(data, salt_length=16, salt=None):
+    """
+    Return the salted SHA-256 hash {SSHA256}base64(sha256(data + salt) + salt)
+
+    :param data: The OTP value
+    :param salt_length: The number of random bytes of a new salt. The salt
+        is the hexlified random bytes.
+    :param salt: The salt as bytes. If it is not given, a new salt is created.
+    """
+    if isinstance(data, six.text_type):
+        data = data.encode("utf-8")
     if not salt:
         b_ret = urandom(salt_length)
         salt = binascii.hexlify(b_ret)
-    h = '{SSHA256}' + base64.b64encode(sha256(data + salt).digest() + salt)
+    h = HASH_PREFIX + base64.b64encode(sha256(data + salt).digest() +
+                                       salt).decode("ascii")
     return h
 
 
-def verify_salted_hash_256(data, h, salt_length=16):
-    h_raw = h[len('{SSHA256}'):]
-    h_bin = base64.b64decode(h_raw)
-    salt = h_bin[-salt_length:]
+def verify_salted_hash_256(data, h):
+    """
+    Check, if the hash h was created from data by salted_hash_256.
+    """
+    if not h.startswith(HASH_PREFIX):
+        return False
+    try:
+        h_bin = base64.b64decode(h[len(HASH_PREFIX):])
+    except (TypeError, ValueError, binascii.Error):
+        return False
+    # The salt follows the digest
+    salt = h_bin[sha256().digest_size:]
     h_test = salted_hash_256(data, salt=salt)
-    return h == h_test
+    return hmac.compare_digest(h.encode("ascii"), h_test.encode("ascii"))
+
+
+# The version of the database schema, stored in PRAGMA user_version
+SCHEMA_VERSION = 3
+
+# The statements, that upgrade the file from the previous version
+SCHEMA = {1: ["CREATE TABLE IF NOT EXISTS authitems "
+              "(user TEXT NOT NULL, counter INTEGER NOT NULL, "
+              "tokenowner TEXT, otp TEXT NOT NULL, "
+              "PRIMARY KEY (user, counter)) WITHOUT ROWID"],
+          # The highest counter of each user, that was used to log in
+          2: ["CREATE TABLE IF NOT EXISTS consumed "
+              "(user TEXT NOT NULL PRIMARY KEY, counter INTEGER NOT NULL)"],
+          # The local user of each offline token
+          3: ["CREATE TABLE IF NOT EXISTS tokens "
+              "(serial TEXT NOT NULL PRIMARY KEY, user TEXT NOT NULL)"]}
+
+
+def _table_exists(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' "
+                        "AND name=?", (name,)).fetchone() is not None
+
+
+def _migrate(conn):
+    """
+    Create or upgrade the tables. Files of older versions have an authitems
+    table without a key. Their entries are copied to the new table.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    with conn:
+        if version == 0 and _table_exists(conn, "authitems"):
+            conn.execute("ALTER TABLE authitems RENAME TO authitems_v0")
+            for statement in SCHEMA[1]:
+                conn.execute(statement)
+            conn.execute("INSERT OR REPLACE INTO authitems "
+                         "(user, counter, tokenowner, otp) "
+                         "SELECT user, CAST(counter AS INTEGER), tokenowner, "
+                         "otp FROM authitems_v0 WHERE user IS NOT NULL "
+                         "AND otp IS NOT NULL")
+            conn.execute("DROP TABLE authitems_v0")
+            version = 1
+        for step in range(version + 1, SCHEMA_VERSION + 1):
+            for statement in SCHEMA[step]:
+                conn.execute(statement)
+        # PRAGMA does not accept parameters
+        conn.execute("PRAGMA user_version = {0:d}".format(SCHEMA_VERSION))
+
+
+def connect(sqlfile):
+    """
+    Open the SQLite file with the offline OTP hashes and create or upgrade
+    the tables.
+
+    The file is used in WAL mode, so that checking an OTP value does not
+    block while the hashes are refreshed.
+
+    :param sqlfile: The SQLite file. If it does not exist, it will be
+        generated.
+    :return: sqlite3 connection
+    """
+    conn = sqlite3.connect(sqlfile)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _migrate(conn)
+    return conn
 
 
 def check_otp(user, otp, sqlfile="offlineotp.sqlite", window=10):
     """
     compare the given otp values with the next hashes of the user.
 
-    DB entries older than the matching counter will be deleted from the
-    database.
+    DB entries older than the matching counter and the matching entry will
+    be deleted from the database, so that an OTP value can only be used
+    once. The matching counter is remembered, so that a later refill does
+    not store the used hashes again.
 
     :param user: The local user in the sql file
     :param otp: The otp value
     :param sqlfile: The sqlite file
+    :param window: The number of hashes, that are compared
     :return: True or False
     """
-    conn = sqlite3.connect(sqlfile)
-    c = conn.cursor()
-    c.execute("SELECT * FROM authitems WHERE user='%s' ORDER by counter" % user)
-    for x in range(0, window):
-        r = c.fetchone()
+    conn = connect(sqlfile)
+    # We handle the transaction ourselves. BEGIN IMMEDIATE takes the write
+    # lock before reading the hashes, so that concurrent checks of the same
+    # OTP value can not both succeed.
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        # The primary key (user, counter) returns the next rows in the order
+        # of the counter without sorting.
+        rows = conn.execute("SELECT counter, otp FROM authitems "
+                            "WHERE user=? ORDER BY counter LIMIT ?",
+                            (user, window)).fetchall()
+        for counter, otphash in rows:
+            if verify_salted_hash_256(otp, otphash):
+                conn.execute("DELETE FROM authitems "
+                             "WHERE user=? AND counter<=?", (user, counter))
+                conn.execute("INSERT INTO consumed (user, counter) "
+                             "VALUES (?, ?) ON CONFLICT (user) DO UPDATE "
+                             "SET counter=max(counter, excluded.counter)",
+                             (user, counter))
+                conn.execute("COMMIT")
+                return True
+        conn.execute("ROLLBACK")
+        return False
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def stored_hashes(sqlfile):
+    """
+    Return the number of unused hashes of each user in the sqlite file.
+
+    Users, that have used all their hashes, are contained with the number 0.
+
+    :param sqlfile: The SQLite file
+    :return: dictionary with the user as key and the number as value
+    """
+    conn = connect(sqlfile)
+    try:
+        return dict(conn.execute("SELECT users.user, count(authitems.counter) "
+                                 "FROM (SELECT user FROM consumed UNION "
+                                 "SELECT user FROM authitems) AS users "
+                                 "LEFT JOIN authitems "
+                                 "ON authitems.user=users.user "
+                                 "GROUP BY users.user"))
+    finally:
+        conn.close()
+
 
-        print(r)
+def tokens_to_refill(sqlfile, serials, depth):
+    """
+    Return the serials of the offline tokens, whose user has less than depth
+    unused hashes. Tokens, that were never fetched with their serial, e.g.
+    since they were just assigned to the machine, are always returned.
+
+    :param sqlfile: The SQLite file
+    :param serials: The serials of the offline tokens of the machine
+    :param depth: The number of unused hashes, that a user should have
+    :return: list of serials
+    """
+    conn = connect(sqlfile)
+    try:
+        users = dict(conn.execute("SELECT serial, user FROM tokens"))
+    finally:
+        conn.close()
+    remaining = stored_hashes(sqlfile)
+    return [serial for serial in serials
+            if serial not in users or remaining.get(users[serial], 0) < depth]
 
 
-def save_auth_item(sqlfile, authitem):
+def save_auth_item(sqlfile, authitem, serial=None):
     """
     Save the given authitem to the sqlite file to be used later for offline
     authentication.
 
-    There is only one table in it with the columns:
-
-        username, counter, otp
+    The hashes are stored with the key user and counter. A hash of a counter,
+    that is already stored, replaces the old one. Hashes of counters, that
+    were already used to log in, are dropped. All other hashes are kept,
+    since the server hands out each counter only once.
 
     :param sqlfile: An SQLite file. If it does not exist, it will be generated.
     :type sqlfile: basestring
     :param authitem: A dictionary with all authitem information being:
     username, count, and a response dict with counter and otphash.
+    :param serial: The serial of the token, if the authitem was fetched for
+        this token. It is remembered for tokens_to_refill.
 
-    :return:
+    :return: The number of unused hashes of the user
     """
-    conn = sqlite3.connect(sqlfile)
-    c = conn.cursor()
-    # Create the table if necessary
-    try:
-        c.execute("CREATE TABLE authitems "
-                  "(counter int, user text, tokenowner text, otp text)")
-    except:
-        pass
+    conn = connect(sqlfile)
     user = authitem.get("user")
     tokenowner = authitem.get("username")
-
-    for counter, otphash in authitem.get("response").items():
-        # Insert the OTP hash
-        c.execute("INSERT INTO authitems (counter, user, tokenowner, otp) "
-                  "VALUES ('%s','%s','%s','%s')"
-                  % (counter, user, tokenowner, otphash))
-
-    # Save (commit) the changes
-    conn.commit()
-
-    # We can also close the connection if we are done with it.
-    # Just be sure any changes have been committed or they will be lost.
-    conn.close()
+    try:
+        with conn:
+            if serial:
+                conn.execute("INSERT INTO tokens (serial, user) "
+                             "VALUES (?, ?) ON CONFLICT (serial) DO UPDATE "
+                             "SET user=excluded.user", (serial, user))
+            row = conn.execute("SELECT counter FROM consumed WHERE user=?",
+                               (user,)).fetchone()
+            consumed = row[0] if row else -1
+            conn.execute("DELETE FROM authitems WHERE user=? AND counter<=?",
+                         (user, consumed))
+            hashes = sorted((int(counter), otphash) for counter, otphash in
+                            authitem.get("response").items()
+                            if int(counter) > consumed)
+            # All hashes are inserted with one statement
+            conn.executemany("INSERT INTO authitems "
+                             "(user, counter, tokenowner, otp) "
+                             "VALUES (?, ?, ?, ?) "
+                             "ON CONFLICT (user, counter) DO UPDATE "
+                             "SET tokenowner=excluded.tokenowner, "
+                             "otp=excluded.otp",
+                             ((user, counter, tokenowner, otphash)
+                              for counter, otphash in hashes))
+            stored = conn.execute("SELECT count(*) FROM authitems "
+                                  "WHERE user=?", (user,)).fetchone()[0]
+    finally:
+        conn.close()
+    return stored
@@ -26,12 +26,10 @@ class HmacOtp(object):
         return digest.digest()
 
     def truncate(self, digest):
-        offset = ord(digest[-1:]) & 0x0f
-
-        binary = (ord(digest[offset + 0]) & 0x7f) << 24
-        binary |= (ord(digest[offset + 1]) & 0xff) << 16
-        binary |= (ord(digest[offset + 2]) & 0xff) << 8
-        binary |= (ord(digest[offset + 3]) & 0xff)
+        # bytearray gives integers on Python 2 and Python 3
+        digest = bytearray(digest)
+        offset = digest[-1] & 0x0f
+        binary = struct.unpack_from(">I", digest, offset)[0] & 0x7fffffff
 
         return binary % (10 ** self.digits)
 
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Render lists of tokens, users etc. either as an ascii table for humans or
+in a machine readable format (TSV, CSV, JSON lines).
+
+The rows are read from an iterable, which may be a generator that fetches
+the data while it is rendered. Each row is formatted once and the output is
+written in chunks of many rows.
+"""
+import csv
+import itertools
+import json
+import sys
+
+OUTPUT_FORMATS = ["table", "tsv", "csv", "jsonl"]
+# The number of rows, that are written with one call
+CHUNK_ROWS = 1000
+# The number of rows, that are used to determine the column widths
+SAMPLE_ROWS = 100
+
+DEFAULT_TABFORMAT = {'tabsize': [4, 16, 14, 20, 20, 4, 4, 4, 4],
+                     'tabstr': ["%4s", "%16s", "%14s", "%20s", "%20s", "%4s",
+                                "%4s", "%4s", "%4s", "%4s"],
+                     'tabdelim': '|',
+                     'tabvisible': [0, 1, 2, 3, 4, 5, 6, 7, 8],
+                     'tabhead': ['Id', 'Desc', 'S/N', 'User', 'Resolver',
+                                 'MaxFail', 'Active', 'FailCount', 'Window'],
+                     'tabentry': ['id',
+                                  'description',
+                                  'serial',
+                                  'username',
+                                  'resolver',
+                                  'maxfail',
+                                  'active',
+                                  'failcount',
+                                  'sync_window']}
+
+
+def _text(value):
+    return value if type(value) == str else str(value)
+
+
+def _write_chunked(stream, lines):
+    for chunk in iter(lambda: "".join(itertools.islice(lines, CHUNK_ROWS)),
+                      ""):
+        stream.write(chunk)
+
+
+def _render_table(rows, tabformat, stream, autosize):
+    tabentry = tabformat['tabentry']
+    tabhead = list(tabformat['tabhead'])
+    tabsize = list(tabformat['tabsize'])
+    tabstr = list(tabformat['tabstr'])
+    delim = " " + tabformat['tabdelim'].replace("%", "%%") + " "
+    columns = len(tabentry)
+    # Set the default, if a too short tabformat is passed
+    tabhead.extend(['head'] * (columns - len(tabhead)))
+    tabsize.extend([10] * (columns - len(tabsize)))
+    tabstr.extend(["%10s"] * (columns - len(tabstr)))
+
+    if autosize:
+        # Determine the column widths from the first rows. Cells are not
+        # truncated in this case.
+        sample = list(itertools.islice(rows, SAMPLE_ROWS))
+        rows = itertools.chain(sample, rows)
+        widths = [len(_text(h)) for h in tabhead[:columns]]
+        for row in sample:
+            for i, key in enumerate(tabentry):
+                widths[i] = max(widths[i], len(_text(row.get(key))))
+        rowformat = delim.join("%{0:d}s".format(w) for w in widths)
+        tabsize = [None] * columns
+    else:
+        rowformat = delim.join(tabstr[:columns])
+    rowformat += delim + "\n"
+
+    def lines():
+        yield rowformat % tuple(_text(h)[:tabsize[i]]
+                                for i, h in enumerate(tabhead[:columns]))
+        for row in rows:
+            yield rowformat % tuple(_text(row.get(key))[:tabsize[i]]
+                                    for i, key in enumerate(tabentry))
+
+    _write_chunked(stream, lines())
+
+
+def _render_tsv(rows, tabentry, stream):
+    def cell(value):
+        if value is None:
+            return ""
+        return _text(value).replace("\t", " ").replace("\n", " ")
+
+    def lines():
+        yield "\t".join(tabentry) + "\n"
+        for row in rows:
+            yield "\t".join([cell(row.get(key)) for key in tabentry]) + "\n"
+
+    _write_chunked(stream, lines())
+
+
+def _render_csv(rows, tabentry, stream):
+    writer = csv.writer(stream)
+    writer.writerow(tabentry)
+    while True:
+        chunk = [[row.get(key) for key in tabentry]
+                 for row in itertools.islice(rows, CHUNK_ROWS)]
+        if not chunk:
+            break
+        writer.writerows(chunk)
+
+
+def _render_jsonl(rows, stream):
+    _write_chunked(stream, (json.dumps(row) + "\n" for row in rows))
+
+
+def render(data, tabformat=None, outformat="table", stream=None,
+           autosize=False):
+    """
+    Write the rows in data to the stream.
+
+    :param data: An iterable of dictionaries
+    :param tabformat: A dictionary like DEFAULT_TABFORMAT. The entries
+        'tabentry' define the columns.
+    :param outformat: One of OUTPUT_FORMATS. The format "jsonl" writes the
+        complete rows, the other formats only the columns in 'tabentry'.
+    :param stream: The file to write to. Defaults to sys.stdout
+    :param autosize: In the table format, determine the column widths from
+        the first rows and do not truncate the cells.
+    """
+    tabformat = tabformat or DEFAULT_TABFORMAT
+    stream = stream or sys.stdout
+    rows = iter(data)
+    if outformat == "table":
+        _render_table(rows, tabformat, stream, autosize)
+    elif outformat == "tsv":
+        _render_tsv(rows, tabformat['tabentry'], stream)
+    elif outformat == "csv":
+        _render_csv(rows, tabformat['tabentry'], stream)
+    elif outformat == "jsonl":
+        _render_jsonl(rows, stream)
+    else:
+        raise ValueError("Unknown output format {0!r}".format(outformat))
+    stream.flush()
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Look up the SSH keys of a user on this machine for the sshd
+AuthorizedKeysCommand.
+
+The keys can either be fetched from the privacyIDEA server directly or from
+a resident daemon. The daemon keeps an authenticated connection to the
+server and caches the keys, so that it answers most lookups from memory.
+The daemon listens on a UNIX socket and uses a line based protocol:
+
+The client sends the username followed by a newline. The daemon answers
+with a line "OK" followed by one key per line or with a line "ERROR" and
+the error message. Then the daemon closes the connection.
+
+Without the daemon, the keys can be stored in cache files, that are shared
+by all invocations of privacyidea-authorizedkeys. See SSHKeyCache.
+
+Only the keys of the requested user are fetched from the server. So the
+cost of a login does not depend on the number of keys attached to the
+machine.
+"""
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+from six.moves.socketserver import StreamRequestHandler, ThreadingMixIn
+from six.moves.socketserver import UnixStreamServer
+from privacyideautils.authcache import AuthTokenCache
+from privacyideautils.clientutils import privacyideaclient, TIMEOUT
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = "/etc/privacyidea/authorizedkeyscommand"
+DEFAULT_SOCKET = "/run/privacyidea/authorizedkeys.sock"
+# The number of seconds, that the daemon keeps the keys of a user
+DEFAULT_CACHE_TTL = 60
+# The number of seconds, that cached keys are used, if the privacyIDEA
+# server can not be reached
+DEFAULT_CACHE_MAX_STALE = 86400
+# The usernames, that sshd may pass to us
+VALID_USER = re.compile(r"^[^\s/:]{1,256}$")
+
+
+class KeyLookupError(Exception):
+    pass
+
+
+def read_config(filename=DEFAULT_CONFIG):
+    """
+    Read the section [Default] of the config file.
+
+    :return: dictionary with the options url, admin, password and the
+        optional settings nosslcheck, hostname, authcache, socket,
+        socketmode, cachedir, cachettl, cachemaxstale and timeout
+    """
+    config = configparser.RawConfigParser()
+    if not config.read(filename):
+        raise KeyLookupError("Could not read the config file "
+                             "{0!s}".format(filename))
+    settings = {"nosslcheck": False,
+                "hostname": socket.gethostname(),
+                "authcache": None,
+                "socket": None,
+                "socketmode": "0600",
+                "cachedir": None,
+                "cachettl": DEFAULT_CACHE_TTL,
+                "cachemaxstale": DEFAULT_CACHE_MAX_STALE,
+                "timeout": TIMEOUT}
+    settings.update(config.items("Default"))
+    for option in ("url", "admin", "password"):
+        if not settings.get(option):
+            raise KeyLookupError("The option {0!s} is missing in the config "
+                                 "file {1!s}".format(option, filename))
+    if settings["nosslcheck"] in ("0", "false", "False", "no"):
+        settings["nosslcheck"] = False
+    settings["cachettl"] = float(settings["cachettl"])
+    settings["cachemaxstale"] = float(settings["cachemaxstale"])
+    settings["timeout"] = float(settings["timeout"])
+    return settings
+
+
+def create_client(settings, nosslcheck=False):
+    """
+    Create a privacyideaclient from the settings of read_config.
+
+    Each request is aborted after the timeout of the settings, so that a
+    slow server does not block the login and the cached keys can be used.
+    """
+    token_cache = None
+    if settings.get("authcache"):
+        token_cache = AuthTokenCache(settings["authcache"])
+    return privacyideaclient(settings["admin"], settings["password"],
+                             settings["url"],
+                             no_ssl_check=bool(nosslcheck or
+                                               settings["nosslcheck"]),
+                             token_cache=token_cache,
+                             timeout=settings.get("timeout", TIMEOUT))
+
+
+def fetch_ssh_keys(client, hostname, user):
+    """
+    Fetch the SSH keys of the user on the machine from the privacyIDEA
+    server.
+
+    The server only returns the keys of the given user. The keys of other
+    users are still skipped, in case an old server ignores the parameter.
+
+    :return: list of the keys
+    """
+    response = client.get("/machine/authitem/ssh", {"hostname": hostname,
+                                                     "user": user})
+    result = response.data.get("result")
+    if not result.get("status"):
+        raise KeyLookupError("error fetching list")
+    keys = []
+    for sshkey in result.get("value", {}).get("ssh", []):
+        if sshkey.get("user", "root") == user:
+            keys.append(sshkey.get("sshkey"))
+    return keys
+
+
+class SSHKeyCache(object):
+    """
+    Files, that hold the SSH keys of the users on a machine. There is one
+    file for each user.
+
+    Keys younger than ttl seconds are used without asking the server. When
+    half of the ttl has passed, the keys are refreshed in a background
+    process, so that logins do not wait for the server. Older keys are
+    fetched again, but if the server can not be reached, the cached keys are
+    used for up to max_stale seconds.
+
+    The files are replaced atomically, so that concurrent invocations of sshd
+    always read a complete file. A lock file makes sure, that only one
+    process refreshes the keys of a user in the background.
+    """
+
+    def __init__(self, cachedir, hostname, ttl=DEFAULT_CACHE_TTL,
+                 max_stale=DEFAULT_CACHE_MAX_STALE):
+        self.cachedir = os.path.join(cachedir, hostname)
+        self.ttl = ttl
+        self.max_stale = max_stale
+
+    def _filename(self, user, extension="json"):
+        # The username is hashed, so that it can not escape the directory
+        return os.path.join(self.cachedir, "{0!s}.{1!s}".format(
+            hashlib.sha256(user.encode("utf-8")).hexdigest(), extension))
+
+    def load(self, user):
+        """
+        :return: tuple of the time of the fetch and the keys of the user or
+            (None, None)
+        """
+        try:
+            with open(self._filename(user)) as f:
+                entry = json.load(f)
+            return float(entry["fetched"]), entry["keys"]
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None, None
+
+    def store(self, user, keys):
+        if not os.path.isdir(self.cachedir):
+            os.makedirs(self.cachedir, 0o700)
+        fd, tmpname = tempfile.mkstemp(dir=self.cachedir, prefix=".sshkeys")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"fetched": time.time(), "user": user,
+                           "keys": keys}, f)
+            os.replace(tmpname, self._filename(user))
+        except Exception:
+            os.unlink(tmpname)
+            raise
+
+    def _refresh(self, user, fetch):
+        try:
+            self.store(user, fetch(user))
+        except Exception as e:
+            log.warning("Could not refresh the SSH keys: {0!s}".format(e))
+
+    def refresh_in_background(self, user, fetch):
+        """
+        Fetch the keys in a child process, unless another process is
+        already doing this. The child does not inherit stdout, since sshd
+        waits for stdout to be closed.
+        """
+        lockfile = self._filename(user, "lock")
+        try:
+            fd = os.open(lockfile, os.O_WRONLY | os.O_CREAT, 0o600)
+        except OSError as e:
+            log.warning("Could not open the lock file: {0!s}".format(e))
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            os.close(fd)
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                log.warning("Could not lock {0!s}: {1!s}".format(lockfile, e))
+            return
+        pid = os.fork()
+        if pid:
+            # The child holds the lock until it exits
+            os.close(fd)
+            return
+        try:
+            os.setsid()
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for stream in (0, 1, 2):
+                os.dup2(devnull, stream)
+            self._refresh(user, fetch)
+        finally:
+            os._exit(0)
+
+    def lookup(self, user, fetch):
+        """
+        Return the keys of the user.
+
+        :param fetch: A callable, that fetches the keys of a user from the
+            server.
+        :return: list of the keys
+        """
+        fetched, keys = self.load(user)
+        age = time.time() - fetched if fetched else None
+        if age is not None and 0 <= age < self.ttl:
+            if age >= self.ttl / 2:
+                self.refresh_in_background(user, fetch)
+            return keys
+        try:
+            fresh_keys = fetch(user)
+        except Exception as e:
+            if age is not None and age < self.max_stale:
+                log.warning("Using the cached SSH keys from {0:.0f} seconds "
+                            "ago: {1!s}".format(age, e))
+                return keys
+            raise
+        try:
+            self.store(user, fresh_keys)
+        except (IOError, OSError) as e:
+            log.warning("Could not write the SSH key cache {0!s}: "
+                        "{1!s}".format(self.cachedir, e))
+        return fresh_keys
+
+
+class KeyRequestHandler(StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline(1024).decode("utf-8", "replace")
+        user = line.rstrip("\r\n")
+        try:
+            if not VALID_USER.match(user):
+                raise KeyLookupError("invalid username")
+            keys = self.server.lookup(user)
+            answer = "OK\n" + "".join(key + "\n" for key in keys)
+        except Exception as e:
+            log.warning("Could not look up the keys of {0!r}: {1!s}".format(
+                user, e))
+            answer = "ERROR {0!s}\n".format(str(e).replace("\n", " "))
+        self.wfile.write(answer.encode("utf-8"))
+
+
+class KeyServer(ThreadingMixIn, UnixStreamServer):
+    """
+    The daemon, that answers the key lookups. The keys of each user are
+    cached for ttl seconds. Users without keys are cached as well.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, client, hostname,
+                 ttl=DEFAULT_CACHE_TTL, mode=0o600):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        UnixStreamServer.__init__(self, socket_path, KeyRequestHandler)
+        os.chmod(socket_path, mode)
+        self.client = client
+        self.hostname = hostname
+        self.ttl = ttl
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def lookup(self, user):
+        """
+        Return the keys of the user from the cache or the server.
+        """
+        with self.lock:
+            entry = self.cache.get(user)
+        if entry and time.time() - entry[0] < self.ttl:
+            return entry[1]
+        keys = fetch_ssh_keys(self.client, self.hostname, user)
+        with self.lock:
+            self.cache[user] = (time.time(), keys)
+        return keys
+
+    def server_close(self):
+        UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def query_daemon(socket_path, user, timeout=5):
+    """
+    Ask the daemon for the keys of the user.
+
+    :raises socket.error: if the daemon is not running
+    :raises KeyLookupError: if the daemon could not look up the keys
+    :return: list of the keys
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        sock.sendall((user + "\n").encode("utf-8"))
+        chunks = []
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            chunks.append(data)
+    finally:
+        sock.close()
+    lines = b"".join(chunks).decode("utf-8").splitlines()
+    if not lines or lines[0] != "OK":
+        raise KeyLookupError(lines[0] if lines else "empty answer")
+    return lines[1:]
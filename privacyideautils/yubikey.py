@@ -25,7 +25,7 @@ except ImportError as e:
     print("please get it from https://github.com/Yubico/python-yubico if you want to enroll yubikeys")
     print(str(e))
     
-from time import sleep
+from time import sleep, time
 import sys
 import re
 import os
@@ -33,6 +33,7 @@ import six
 import binascii
 import codecs
 import string
+from privacyideautils.hotplug import HotplugWatcher, YUBICO_VENDOR_ID
 try:
     maketrans = string.maketrans
 except AttributeError:
@@ -104,7 +105,8 @@ def enrollYubikey(digits=6, APPEND_CR=True, debug=False, access_key=None,
                   fixed_string=None,
                   len_fixed_string=None,
                   prefix_serial=False,
-                  challenge_response=False):
+                  challenge_response=False,
+                  yk=None):
     """
     :param mode: Defines if the yubikey should be enrolled in OATH mode (1) or
         Yubico Mode (2)
@@ -121,11 +123,14 @@ def enrollYubikey(digits=6, APPEND_CR=True, debug=False, access_key=None,
     :param len_fixed_string: This specified the length of the random fixed
         string.
     :type len_fixed_string: integer
-    
+
+    :param yk: The yubikey to enroll as returned by find_yubikeys. If it is
+        not given, the first yubikey is used.
+
     :return: tuple of key, serial, fixed_string
     """
     print("Initializing Yubikey in mode {0!s}.".format(mode))
-    YK = yubico.yubikey.find_key(debug=debug)
+    YK = yk or yubico.yubikey.find_key(debug=debug)
     firmware_version = YK.version()
     serial = "%08d" % YK.serial()
     # The fixed string to be returned
@@ -212,6 +217,66 @@ def enrollYubikey(digits=6, APPEND_CR=True, debug=False, access_key=None,
     return key, serial, ret_fixed_string
 
 
+def release_yubikey(YK):
+    """
+    Release the USB interface of the yubikey, so that it can be opened again.
+    """
+    device = getattr(YK, "_device", None)
+    if device is not None and getattr(device, "_usb_handle", None):
+        try:
+            device._close()
+        except (IOError, USBError, AttributeError):
+            pass
+
+
+def find_yubikeys(debug=False):
+    """
+    Find all plugged yubikeys. The yubikeys are only opened to read the
+    serial and released again. Yubikeys, that can not be opened, e.g. since
+    they are still set up or are used by another program, are skipped.
+
+    :return: dictionary of the serials and the positions of the yubikeys,
+        that are passed to open_yubikey
+    """
+    yubikeys = {}
+    skip = 0
+    while True:
+        try:
+            YK = yubico.yubikey.find_key(debug=debug, skip=skip)
+        except YubiKeyError as e:
+            if e.reason == "No YubiKey found":
+                # There are no more yubikeys
+                break
+            print("Could not open yubikey number %s: %s" % (skip + 1,
+                                                            e.reason))
+        except (USBError, yubico.yubico_exception.YubicoError) as e:
+            print("Could not open yubikey number %s: %s" % (skip + 1, e))
+        else:
+            try:
+                yubikeys["%08d" % YK.serial()] = skip
+            except (USBError, yubico.yubico_exception.YubicoError) as e:
+                print("Could not read the serial of yubikey number %s: %s"
+                      % (skip + 1, e))
+            finally:
+                release_yubikey(YK)
+        skip += 1
+    return yubikeys
+
+
+def open_yubikey(serial, position, debug=False):
+    """
+    Open the yubikey with the serial at the position returned by
+    find_yubikeys. Release it with release_yubikey.
+
+    :raises YubiError: if another yubikey is plugged at the position
+    """
+    YK = yubico.yubikey.find_key(debug=debug, skip=position)
+    if "%08d" % YK.serial() != serial:
+        release_yubikey(YK)
+        raise YubiError("The yubikey %s was unplugged." % serial)
+    return YK
+
+
 def main():
     file_template = """<Tokens>
 <Token serial="%s">
@@ -274,35 +339,63 @@ def main():
 
 
 class YubikeyPlug(object):
+    """
+    Wait for yubikeys to be plugged in one after another.
+
+    On Linux the arrival of a yubikey is reported by the kernel, so that the
+    USB bus is only searched, when a yubikey was plugged in. Otherwise the
+    USB bus is searched every second.
+    """
+    # After a yubikey arrived, it may take a moment until it can be opened
+    SETTLE_RETRIES = 10
+    SETTLE_INTERVAL = 0.1
 
-    def __init__(self):
+    def __init__(self, watcher=None):
         self.last_serial = None
+        self.watcher = watcher or HotplugWatcher(YUBICO_VENDOR_ID)
+
+    def _find_serial(self):
+        """
+        :return: The serial of the plugged yubikey or None
+        """
+        try:
+            YK = yubico.yubikey.find_key()
+            return "%08d" % YK.serial()
+        except USBError:
+            sys.stdout.write('u')
+            sys.stdout.flush()
+        except YubiKeyError:
+            sys.stdout.write('.')
+            sys.stdout.flush()
+        return None
 
     def wait_for_new_yubikey(self, timeout=None):
         '''
         This functions waits for a new yubikey to be inserted
+
+        :param timeout: The maximum number of seconds to wait
+        :return: True, if a new yubikey was found
         '''
-        found = False
+        deadline = None if timeout is None else time() + timeout
+        retries = 0
         while 1:
-            try:
-                sleep(1)
-                YK = yubico.yubikey.find_key()
-                #firmware_version = YK.version()
-                serial = "%08d" % YK.serial()
-
-                if serial != self.last_serial:
-                    self.last_serial = serial
-                    print("\nFound Yubikey with serial %r\n" % serial)
-                    found = True
-                    break;
-            except USBError:
-                sys.stdout.write('u')
-                sys.stdout.flush()
-            except YubiKeyError:
-                sys.stdout.write('.')
-                sys.stdout.flush()
-
-        return found
+            serial = self._find_serial()
+            if serial is not None and serial != self.last_serial:
+                self.last_serial = serial
+                print("\nFound Yubikey with serial %r\n" % serial)
+                return True
+            if retries:
+                retries -= 1
+                sleep(self.SETTLE_INTERVAL)
+                continue
+            remaining = None if deadline is None else deadline - time()
+            if remaining is not None and remaining <= 0:
+                return False
+            if self.watcher.wait_for_arrival(remaining):
+                retries = self.SETTLE_RETRIES
+
+    def close(self):
+        self.watcher.close()
 
 
 if __name__ == "__main__":
@@ -52,6 +52,9 @@ setup(name=name,
           "requests",
           "six"
       ],
+      extras_require={
+          "async": ["aiohttp"]
+      },
       cmdclass=cmdclass,
       command_options={
         'build_sphinx': {
@@ -65,6 +68,7 @@ setup(name=name,
       scripts=['scripts/privacyidea',
                'scripts/privacyidea-luks-assign',
                'scripts/privacyidea-authorizedkeys',
+               'scripts/privacyidea-authorizedkeys-daemon',
                'scripts/privacyidea-check-offline-otp',
                'scripts/privacyidea-get-offline-otp',
                'scripts/privacyidea-validate',
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the batch calculation of HOTP values against the calculation of
+one value per call like the pytoken templates do it. Run it like this:
+
+    python -m tests.benchmark_hotp [number of OTP values] [number of keys]
+"""
+from __future__ import print_function
+import hashlib
+import hmac
+import os
+import struct
+import sys
+import time
+from privacyideautils.hotp import HmacOtp, generate_many
+
+
+def single(key, count):
+    otps = []
+    for counter in range(count):
+        digest = bytearray(hmac.new(key, struct.pack(">Q", counter),
+                                    hashlib.sha1).digest())
+        offset = digest[-1] & 0x0f
+        binary = struct.unpack_from(">I", digest, offset)[0] & 0x7fffffff
+        otps.append("{0:06d}".format(binary % 1000000))
+    return otps
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    keys = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    key = os.urandom(20)
+    for name, func in [("one value per call", lambda: single(key, count)),
+                       ("batch range", lambda: HmacOtp(key).generate_range(
+                           0, count))]:
+        start = time.time()
+        otps = func()
+        duration = time.time() - start
+        print("{0!s:30} {1:8.3f}s {2:10.0f} OTP/s".format(
+            name, duration, len(otps) / duration))
+    key_list = [os.urandom(20) for _i in range(keys)]
+    start = time.time()
+    generate_many(key_list, count=10)
+    duration = time.time() - start
+    print("{0!s:30} {1:8.3f}s {2:10.0f} OTP/s".format(
+        "{0:d} keys x 10".format(keys), duration, keys * 10 / duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the start of the privacyidea command line tool with
+"python -X importtime". For each command the time to import all modules,
+that are needed to resolve the command, is printed. The eager import of all
+command modules is measured for comparison. Run it like this:
+
+    python -m tests.benchmark_import [number of runs]
+"""
+from __future__ import print_function
+import re
+import subprocess
+import sys
+from tests.test_lazyload import SCRIPT
+
+LAZY = """
+import runpy, sys, click
+cli = runpy.run_path(sys.argv[1], run_name="privacyidea")["cli"]
+cli.get_command(click.Context(cli), sys.argv[2])
+"""
+
+EAGER = """
+import runpy, sys, click
+import privacyideautils.commands.token, privacyideautils.yubikey
+import privacyideautils.etokenng, privacyideautils.nitrokey
+import privacyideautils.initdaplug, privacyideautils.mailer, qrcode
+cli = runpy.run_path(sys.argv[1], run_name="privacyidea")["cli"]
+cli.get_command(click.Context(cli), sys.argv[2])
+"""
+
+IMPORTTIME = re.compile(r"^import time:\s+(\d+) \|")
+
+
+def import_time(code, command):
+    """
+    Return the sum of the import times of all modules in milliseconds
+    """
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", code,
+                        SCRIPT, command], stdout=subprocess.DEVNULL,
+                       stderr=subprocess.PIPE, check=True)
+    total = 0
+    for line in p.stderr.decode("utf-8").splitlines():
+        m = IMPORTTIME.match(line)
+        if m:
+            total += int(m.group(1))
+    return total / 1000.0
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for label, code, command in [("eager imports", EAGER, "config"),
+                                 ("config", LAZY, "config"),
+                                 ("user", LAZY, "user"),
+                                 ("token", LAZY, "token")]:
+        best = min(import_time(code, command) for _i in range(runs))
+        print("{0!s:20} {1:8.1f}ms".format(label, best))
+
+
+if __name__ == '__main__':
+    main()
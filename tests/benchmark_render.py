@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the rendering of a large token list in the different output
+formats. The output is written to /dev/null. Run it like this:
+
+    python -m tests.benchmark_render [number of tokens]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+from privacyideautils.render import render, OUTPUT_FORMATS
+
+
+def print_per_cell(data, stream):
+    # This is how dumpresult printed the tokens before
+    tabentry = ['id', 'description', 'serial', 'username', 'resolver',
+                'maxfail', 'active', 'failcount', 'sync_window']
+    tabsize = [4, 16, 14, 20, 20, 4, 4, 4, 4]
+    for token in data:
+        for i, t in enumerate(tabentry):
+            text = token.get(t)
+            if not type(token.get(t)) == str:
+                text = str(token.get(t))
+            print("%10s" % text[:tabsize[i]], "|", end=' ', file=stream)
+        print(file=stream)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    tokens = [{"id": i, "description": "token number {0!s}".format(i),
+               "serial": "OATH{0:08d}".format(i), "username": "user",
+               "resolver": "resolver1", "maxfail": 10, "active": True,
+               "failcount": 0, "sync_window": 1000} for i in range(count)]
+    with open(os.devnull, "w") as devnull:
+        start = time.time()
+        print_per_cell(tokens, devnull)
+        print("{0!s:20} {1:8.3f}s".format("print per cell",
+                                          time.time() - start))
+        for outformat in OUTPUT_FORMATS:
+            start = time.time()
+            render(tokens, outformat=outformat, stream=devnull)
+            print("{0!s:20} {1:8.3f}s".format(outformat,
+                                              time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
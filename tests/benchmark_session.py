@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the pooled session of the privacyideaclient against the former
+behaviour of one new connection per request.
+
+The benchmark runs against the local stand-in server and is not collected by
+the test runner. The stand-in server delays each new connection to simulate
+the round trips of the TCP and TLS handshake. Run it like this:
+
+    python -m tests.benchmark_session [number of requests] [delay in ms]
+"""
+from __future__ import print_function
+import sys
+import time
+import requests
+from privacyideautils.clientutils import privacyideaclient
+from tests.piserver import PIServer
+
+
+def run_unpooled(client, count):
+    for _i in range(count):
+        requests.get("%s/token/" % client.baseuri, headers=client.headers)
+
+
+def run_pooled(client, count):
+    for _i in range(count):
+        client.listtoken({})
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    server = PIServer(handshake_delay=delay / 1000.0).start()
+    client = privacyideaclient("admin", "test", server.url)
+    try:
+        for name, func in [("new connection per request", run_unpooled),
+                           ("pooled session", run_pooled)]:
+            connections = server.connections
+            start = time.time()
+            func(client, count)
+            duration = time.time() - start
+            print("{0!s:30} {1:8.3f}s {2:8.0f} req/s {3:6d} connections"
+                  "".format(name, duration, count / duration,
+                            server.connections - connections))
+    finally:
+        client.close()
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+A small stand-in for the privacyIDEA REST API.
+
+It is used by the unit tests and benchmarks, which must not depend on a
+running privacyIDEA server. Only the endpoints used by the admin client are
+implemented and the data is kept in memory.
+
+The server speaks HTTP/1.1 with keep-alive and counts the TCP connections it
+accepted, so that tests can check whether connections are reused.
+"""
+import base64
+import json
+import threading
+import time
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.BaseHTTPServer import HTTPServer
+from six.moves.urllib.parse import urlparse, parse_qs
+
+
+def make_jwt(username, lifetime=3600):
+    """
+    Create an unsigned token, that looks like the JWT of privacyIDEA.
+    """
+    def _b64(data):
+        return base64.urlsafe_b64encode(
+            json.dumps(data).encode("utf-8")).rstrip(b"=").decode("ascii")
+    payload = {"username": username,
+               "exp": int(time.time()) + lifetime}
+    return "{0!s}.{1!s}.{2!s}".format(_b64({"alg": "none", "typ": "JWT"}),
+                                      _b64(payload), "signature")
+
+
+class PIRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        if self.server.handshake_delay:
+            # simulate the round trips of a TCP and TLS handshake
+            time.sleep(self.server.handshake_delay)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _params(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            body = self.rfile.read(length).decode("utf-8")
+            params.update({k: v[-1] for k, v in parse_qs(body).items()})
+        return url.path, params
+
+    def _send(self, value, status=200, detail=None):
+        body = {"result": {"status": status < 300, "value": value},
+                "detail": detail or {}}
+        if status >= 300:
+            body["result"]["error"] = {"message": value, "code": status}
+        self._send_raw(json.dumps(body).encode("utf-8"), status,
+                       "application/json")
+
+    def _send_raw(self, data, status=200, content_type="text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        token = self.headers.get("Authorization") or \
+            self.headers.get("PI-Authorization")
+        if token not in self.server.valid_tokens:
+            self._send("Authentication failure", status=401)
+            return False
+        return True
+
+    def _dispatch(self, method):
+        path, params = self._params()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests.append((method, path, params))
+        if method == "POST" and path == "/auth":
+            return self._auth(params)
+        if method == "POST" and path == "/validate/check":
+            return self._send(params.get("pass") == "test")
+        if not self._authorized():
+            return
+        handler = getattr(self, "do_{0!s}_{1!s}".format(
+            method, path.strip("/").split("/")[0]), None)
+        if handler is None:
+            return self._send("Not found", status=404)
+        return handler(path, params)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _auth(self, params):
+        if params.get("password") != self.server.password:
+            return self._send("Wrong credentials", status=401)
+        token = make_jwt(params.get("username"))
+        with self.server.lock:
+            self.server.valid_tokens.add(token)
+        self._send({"token": token, "role": "admin"})
+
+    def do_GET_token(self, path, params):
+        tokens = self.server.tokens
+        for key in ("serial", "type"):
+            if params.get(key):
+                tokens = [t for t in tokens if t.get(key) == params.get(key)]
+        if params.get("user"):
+            tokens = [t for t in tokens
+                      if t.get("username") == params.get("user")]
+        if params.get("tokenrealm"):
+            tokens = [t for t in tokens
+                      if params.get("tokenrealm") in t.get("realms", [])]
+        if params.get("outform") == "csv":
+            # The CSV export contains all tokens
+            lines = ["{0!s}, {1!s}, {2!s}\n".format(t.get("serial"),
+                                                    t.get("type", "hotp"),
+                                                    t.get("username", ""))
+                     for t in tokens]
+            return self._send_raw("".join(lines).encode("utf-8"),
+                                  content_type="text/csv")
+        pagesize = int(params.get("pagesize", 15))
+        page = int(params.get("page", 1))
+        chunk = tokens[(page - 1) * pagesize:page * pagesize]
+        has_next = page * pagesize < len(tokens)
+        self._send({"tokens": chunk,
+                    "count": len(tokens),
+                    "current": page,
+                    "next": page + 1 if has_next else None,
+                    "prev": page - 1 if page > 1 else None})
+
+    def do_POST_token(self, path, params):
+        if path == "/token/init":
+            serial = params.get("serial") or \
+                "TOK{0:08d}".format(len(self.server.tokens) + 1)
+            token = {"serial": serial,
+                     "tokentype": params.get("type", "hotp"),
+                     "description": params.get("description", ""),
+                     "username": params.get("user", ""),
+                     "user_realm": params.get("realm", ""),
+                     "realms": [params.get("realm")]
+                     if params.get("realm") else [],
+                     "active": True}
+            with self.server.lock:
+                self.server.tokens.append(token)
+            detail = {"serial": serial}
+            if params.get("genkey"):
+                detail["otpkey"] = {"value": "seed://" + "00" * 20}
+            if params.get("type") == "registration":
+                detail["registrationcode"] = "REG" + serial
+            return self._send(True, detail=detail)
+        return self._send(True)
+
+    def do_DELETE_token(self, path, params):
+        serial = path.rstrip("/").split("/")[-1]
+        with self.server.lock:
+            before = len(self.server.tokens)
+            self.server.tokens = [t for t in self.server.tokens
+                                  if t.get("serial") != serial]
+            deleted = before - len(self.server.tokens)
+        self._send(deleted)
+
+    def do_GET_machine(self, path, params):
+        if path != "/machine/authitem/ssh":
+            return self._send("Not found", status=404)
+        keys = [{"user": k.get("user"), "sshkey": k.get("sshkey")}
+                for k in self.server.sshkeys
+                if k.get("hostname") == params.get("hostname")]
+        if params.get("user"):
+            keys = [k for k in keys if k.get("user") == params.get("user")]
+        self._send({"ssh": keys})
+
+    def do_GET_user(self, path, params):
+        self._send(self.server.users)
+
+    def do_GET_audit(self, path, params):
+        entries = sorted(self.server.audit,
+                         key=lambda e: e.get("number"),
+                         reverse=params.get("sortorder", "desc") == "desc")
+        rp = int(params.get("rp", 15))
+        page = int(params.get("page", 1))
+        chunk = entries[(page - 1) * rp:page * rp]
+        self._send({"auditdata": chunk,
+                    "count": len(entries),
+                    "current": page})
+
+    def do_GET_system(self, path, params):
+        self._send(dict(self.server.config))
+
+    def do_POST_system(self, path, params):
+        with self.server.lock:
+            self.server.config.update(params)
+        self._send({k: "insert" for k in params})
+
+    def do_DELETE_system(self, path, params):
+        key = path.rstrip("/").split("/")[-1]
+        with self.server.lock:
+            self.server.config.pop(key, None)
+        self._send(True)
+
+
+class PIServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), password="test",
+                 latency=0, handshake_delay=0):
+        HTTPServer.__init__(self, address, PIRequestHandler)
+        self.lock = threading.Lock()
+        self.password = password
+        self.latency = latency
+        self.handshake_delay = handshake_delay
+        self.connections = 0
+        self.requests = []
+        self.valid_tokens = set()
+        self.tokens = []
+        self.users = []
+        # dictionaries with hostname, user and sshkey
+        self.sshkeys = []
+        self.audit = []
+        self.config = {}
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://{0!s}:{1!s}".format(*self.server_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
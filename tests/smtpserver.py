@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+A minimal SMTP server for the tests.
+
+It accepts every message and stores it in memory. The smtpd module is not
+available in newer Python versions, so the protocol is implemented here.
+"""
+
+import threading
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+
+
+class SMTPRequestHandler(StreamRequestHandler):
+
+    def _reply(self, line):
+        self.wfile.write((line + "\r\n").encode("ascii"))
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        messages = 0
+        mail_from = None
+        rcpt_to = []
+        self._reply("220 localhost ESMTP test server")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.decode("utf-8").rstrip("\r\n")
+            command = line[:4].upper()
+            if command in ("EHLO", "HELO"):
+                self._reply("250-localhost")
+                self._reply("250 AUTH PLAIN")
+            elif command == "AUTH":
+                with server.lock:
+                    server.logins += 1
+                self._reply("235 Authentication successful")
+            elif command == "MAIL":
+                mail_from = line.split(":", 1)[1].strip()
+                rcpt_to = []
+                self._reply("250 OK")
+            elif command == "RCPT":
+                recipient = line.split(":", 1)[1].strip().strip("<>")
+                if recipient in server.reject:
+                    self._reply("550 No such user")
+                else:
+                    rcpt_to.append(recipient)
+                    self._reply("250 OK")
+            elif command == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while True:
+                    line = self.rfile.readline().decode("utf-8")
+                    if not line:
+                        # The client aborted the message
+                        return
+                    if line in (".\r\n", ".\n"):
+                        break
+                    data.append(line)
+                with server.lock:
+                    server.messages.append((mail_from, rcpt_to,
+                                            "".join(data)))
+                self._reply("250 OK")
+                messages += 1
+                if server.drop_after and messages >= server.drop_after:
+                    # Simulate a relay, that closes the session
+                    return
+            elif command == "RSET":
+                mail_from = None
+                rcpt_to = []
+                self._reply("250 OK")
+            elif command == "NOOP":
+                self._reply("250 OK")
+            elif command == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("500 Unknown command")
+
+
+class SMTPServer(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=("127.0.0.1", 0), drop_after=0):
+        ThreadingTCPServer.__init__(self, address, SMTPRequestHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.logins = 0
+        self.messages = []
+        self.reject = set()
+        self.drop_after = drop_after
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
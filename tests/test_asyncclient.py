@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+from privacyideautils.asyncclient import (asyncprivacyideaclient,
+                                          AIOHTTP_AVAILABLE)
+from privacyideautils.clientutils import PrivacyIDEAClientError
+from tests.piserver import PIServer
+
+
+@unittest.skipUnless(AIOHTTP_AVAILABLE, "aiohttp is not installed")
+class TestAsyncClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = PIServer(latency=0.01).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_01_same_endpoints(self):
+        async def run():
+            async with asyncprivacyideaclient("admin", "test",
+                                              self.server.url) as client:
+                self.assertTrue(client.auth_token)
+                response = await client.inittoken({"serial": "S1",
+                                                   "genkey": 1,
+                                                   "otpkey": None})
+                self.assertEqual(response.status, 200)
+                self.assertEqual(response.data["detail"]["serial"], "S1")
+                response = await client.listtoken({"serial": "S1"})
+                value = response.data["result"]["value"]
+                self.assertEqual(value["count"], 1)
+                response = await client.deletetoken("S1")
+                self.assertEqual(response.data["result"]["value"], 1)
+                with self.assertRaises(PrivacyIDEAClientError):
+                    await client.get("/unknown/")
+
+        asyncio.run(run())
+
+    def test_02_concurrent_requests(self):
+        async def run():
+            async with asyncprivacyideaclient("admin", "test",
+                                              self.server.url,
+                                              pool_maxsize=5) as client:
+                responses = await asyncio.gather(
+                    *[client.auditsearch({}) for _i in range(50)])
+            return responses
+
+        responses = asyncio.run(run())
+        self.assertEqual(len(responses), 50)
+        self.assertTrue(all(r.status == 200 for r in responses))
+        # The connections are pooled
+        self.assertTrue(self.server.connections <= 6, self.server.connections)
+
+    def test_03_wrong_credentials(self):
+        async def run():
+            async with asyncprivacyideaclient("admin", "wrong",
+                                              self.server.url):
+                pass
+
+        self.assertRaises(Exception, asyncio.run, run())
+
+    def test_04_reauthenticate_on_401(self):
+        async def run():
+            async with asyncprivacyideaclient("admin", "test",
+                                              self.server.url) as client:
+                self.server.valid_tokens.clear()
+                return await client.getconfig({})
+
+        response = asyncio.run(run())
+        self.assertEqual(response.status, 200)
+        self.assertEqual(len([r for r in self.server.requests
+                              if r[1] == "/auth"]), 2)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from click.testing import CliRunner
+from privacyideautils.clientutils import privacyideaclient
+from privacyideautils.commands.audit import audit
+from tests.piserver import PIServer
+
+
+def audit_entry(number):
+    return {"number": number,
+            "action": "POST /validate/check",
+            "success": number % 2,
+            "user": "user{0!s}".format(number)}
+
+
+class TestAudit(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = PIServer().start()
+        self.server.audit = [audit_entry(i) for i in range(1, 1001)]
+        self.client = privacyideaclient("admin", "test", self.server.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _invoke(self, args):
+        result = CliRunner().invoke(audit, args,
+                                    obj={"pi_client": self.client})
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result
+
+    def _audit_requests(self):
+        return [r[2] for r in self.server.requests if r[1] == "/audit/"]
+
+    def test_01_export_jsonl(self):
+        outfile = os.path.join(self.tmpdir, "audit.jsonl")
+        self._invoke(["export", "--rp", "30", "--parallel", "4",
+                      "--outfile", outfile])
+        with open(outfile) as f:
+            numbers = [json.loads(line)["number"] for line in f]
+        self.assertEqual(numbers, list(range(1, 1001)))
+        self.assertEqual(len(self._audit_requests()), 34)
+
+    def test_02_export_csv(self):
+        outfile = os.path.join(self.tmpdir, "audit.csv")
+        self._invoke(["export", "--rp", "100", "--format", "csv",
+                      "--sortorder", "desc", "--outfile", outfile])
+        with open(outfile) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 1000)
+        self.assertEqual(rows[0]["number"], "1000")
+        self.assertEqual(rows[-1]["user"], "user1")
+
+    def test_03_export_empty(self):
+        self.server.audit = []
+        self._invoke(["export"])
+        self.assertEqual(len(self._audit_requests()), 1)
+
+    def _sync(self, statefile, *args):
+        result = self._invoke(["sync", "--statefile", statefile,
+                               "--rp", "10"] + list(args))
+        return [json.loads(line)["number"]
+                for line in result.output.splitlines()]
+
+    def test_04_sync(self):
+        statefile = os.path.join(self.tmpdir, "state")
+        # The first call only records the newest entry
+        self.assertEqual(self._sync(statefile), [])
+        with open(statefile) as f:
+            self.assertEqual(json.load(f), {"number": 1000})
+
+        # no new entries: one request
+        del self.server.requests[:]
+        self.assertEqual(self._sync(statefile), [])
+        self.assertEqual(len(self._audit_requests()), 1)
+
+        self.server.audit.extend(audit_entry(i) for i in range(1001, 1026))
+        del self.server.requests[:]
+        self.assertEqual(self._sync(statefile), list(range(1001, 1026)))
+        self.assertEqual(len(self._audit_requests()), 3)
+        self.assertEqual(self._sync(statefile), [])
+
+    def test_05_sync_initial(self):
+        statefile = os.path.join(self.tmpdir, "state")
+        self.assertEqual(self._sync(statefile, "--initial", "15"),
+                         list(range(986, 1001)))
+        self.assertEqual(self._sync(statefile), [])
+
+    def test_06_follow(self):
+        from privacyideautils.commands import audit as audit_module
+        statefile = os.path.join(self.tmpdir, "state")
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            if len(waits) == 2:
+                self.server.audit.append(audit_entry(1001))
+            if len(waits) == 5:
+                raise KeyboardInterrupt()
+
+        original_sleep = audit_module.time.sleep
+        audit_module.time.sleep = sleep
+        try:
+            result = CliRunner().invoke(audit, ["follow", "--statefile",
+                                                statefile, "--interval", "1",
+                                                "--max-interval", "3"],
+                                        obj={"pi_client": self.client})
+        finally:
+            audit_module.time.sleep = original_sleep
+        numbers = [json.loads(line)["number"]
+                   for line in result.output.splitlines()
+                   if line.startswith("{")]
+        self.assertEqual(numbers, [1001])
+        self.assertEqual(waits, [1, 2, 1, 1, 2])
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+from privacyideautils.authcache import AuthTokenCache, jwt_expiry
+from privacyideautils.clientutils import privacyideaclient
+from tests.piserver import PIServer, make_jwt
+
+
+class TestAuthTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = AuthTokenCache(os.path.join(self.tmpdir, "sub",
+                                                 "authtoken.json"))
+        self.server = PIServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _auth_requests(self):
+        return len([r for r in self.server.requests if r[1] == "/auth"])
+
+    def test_01_jwt_expiry(self):
+        token = make_jwt("admin", lifetime=100)
+        self.assertTrue(abs(jwt_expiry(token) - time.time() - 100) < 2)
+        self.assertEqual(jwt_expiry("no.jwt"), None)
+        self.assertEqual(jwt_expiry("nojwt"), None)
+
+    def test_02_get_set(self):
+        token = make_jwt("admin")
+        self.cache.set("https://pi/", "admin", token)
+        self.assertEqual(self.cache.get("https://pi", "admin"), token)
+        self.assertEqual(self.cache.get("https://pi", "other"), None)
+        self.assertEqual(self.cache.get("https://other", "admin"), None)
+        mode = stat.S_IMODE(os.stat(self.cache.filename).st_mode)
+        self.assertEqual(mode, 0o600)
+
+        # expired tokens are not returned
+        self.cache.set("https://pi", "old", make_jwt("old", lifetime=10))
+        self.assertEqual(self.cache.get("https://pi", "old"), None)
+
+        self.cache.delete("https://pi", "admin")
+        self.assertEqual(self.cache.get("https://pi", "admin"), None)
+
+    def test_03_client_reuses_cached_token(self):
+        client = privacyideaclient("admin", "test", self.server.url,
+                                   token_cache=self.cache)
+        client.close()
+        self.assertEqual(self._auth_requests(), 1)
+
+        client = privacyideaclient("admin", "test", self.server.url,
+                                   token_cache=self.cache)
+        response = client.listtoken({})
+        client.close()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self._auth_requests(), 1)
+
+    def test_04_reauthenticate_on_401(self):
+        client = privacyideaclient("admin", "test", self.server.url,
+                                   token_cache=self.cache)
+        old_token = client.auth_token
+        # The server does not accept the token anymore
+        self.server.valid_tokens.clear()
+        time.sleep(1)
+        response = client.listtoken({})
+        client.close()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self._auth_requests(), 2)
+        self.assertNotEqual(client.auth_token, old_token)
+        # The new token was written to the cache
+        self.assertEqual(self.cache.get(self.server.url, "admin"),
+                         client.auth_token)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from click.testing import CliRunner
+from privacyideautils.bulk import BulkExecutor, bulk_executor
+from privacyideautils.clientutils import privacyideaclient
+from privacyideautils.commands.config import config
+from privacyideautils.commands.token import token
+from tests.piserver import PIServer
+
+
+class TestBulkExecutor(unittest.TestCase):
+
+    def test_01_results_in_order(self):
+        executor = BulkExecutor(parallel=4)
+
+        def slow_square(i):
+            # later items finish first
+            time.sleep((10 - i) / 1000.0)
+            return i * i
+
+        results = list(executor.run(slow_square, range(10)))
+        self.assertEqual([r.item for r in results], list(range(10)))
+        self.assertEqual([r.response for r in results],
+                         [i * i for i in range(10)])
+        self.assertEqual(executor.succeeded, 10)
+        self.assertEqual(executor.failed, 0)
+
+    def test_02_errors_are_collected(self):
+        executor = BulkExecutor(parallel=3)
+
+        def check(i):
+            if i % 2:
+                raise ValueError(i)
+            return i
+
+        results = list(executor.run(check, range(6)))
+        self.assertEqual(len(results), 6)
+        self.assertTrue(isinstance(results[1].error, ValueError))
+        self.assertEqual(results[2].response, 2)
+        self.assertEqual(executor.failed, 3)
+        self.assertEqual(executor.succeeded, 3)
+
+    def test_03_bounded_in_flight(self):
+        executor = BulkExecutor(parallel=5)
+        lock = threading.Lock()
+        state = {"running": 0, "max": 0}
+
+        def operation(i):
+            with lock:
+                state["running"] += 1
+                state["max"] = max(state["max"], state["running"])
+            time.sleep(0.005)
+            with lock:
+                state["running"] -= 1
+
+        consumed = []
+
+        def items():
+            for i in range(100):
+                consumed.append(i)
+                yield i
+
+        run = executor.run(operation, items())
+        next(run)
+        # The stream is only read a bounded window ahead
+        self.assertTrue(len(consumed) <= 2 * 5 + 1, consumed)
+        list(run)
+        self.assertEqual(len(consumed), 100)
+        self.assertTrue(state["max"] <= 5, state)
+
+    def test_04_sequential(self):
+        executor = BulkExecutor(parallel=0)
+        self.assertEqual(executor.parallel, 1)
+        results = list(executor.run(str, [1, 2]))
+        self.assertEqual([r.response for r in results], ["1", "2"])
+
+
+class TestBulkCommands(unittest.TestCase):
+
+    def setUp(self):
+        self.server = PIServer(latency=0.02).start()
+        self.client = privacyideaclient("admin", "test", self.server.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_01_pool_is_resized(self):
+        bulk_executor(self.client, 50)
+        self.assertEqual(self.client.pool_maxsize, 50)
+
+    def test_02_delete_tokens_in_parallel(self):
+        self.server.tokens = [{"serial": "S{0!s}".format(i),
+                               "type": "hotp",
+                               "realms": ["realm1"]} for i in range(12)]
+        start = time.time()
+        result = CliRunner().invoke(token, ["delete", "--realm", "realm1",
+                                            "--type", "hotp",
+                                            "--parallel", "10"],
+                                    obj={"pi_client": self.client})
+        duration = time.time() - start
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(self.server.tokens, [])
+        # 12 sequential deletes would take at least 0.24 seconds
+        self.assertTrue(duration < 0.2, duration)
+        self.assertTrue(result.output.index("Delete token S0") <
+                        result.output.index("Delete token S11"))
+
+    def test_03_set_config_in_parallel(self):
+        result = CliRunner().invoke(config, ["set", "--parallel", "4",
+                                             "--config", "a=1",
+                                             "--config", "b=2",
+                                             "--config", "c=3"],
+                                    obj={"pi_client": self.client})
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(self.server.config, {"a": "1", "b": "2", "c": "3"})
+
+        result = CliRunner().invoke(config, ["delete", "--parallel", "4",
+                                             "--key", "a", "--key", "b"],
+                                    obj={"pi_client": self.client})
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(self.server.config, {"c": "3"})
+
+    def test_04_registration_lists_tokens_once(self):
+        self.server.users = [{"username": "user{0!s}".format(i),
+                              "email": "user{0!s}@localhost".format(i)}
+                             for i in range(40)]
+        # Every second user already has a token
+        self.server.tokens = [{"serial": "T{0!s}".format(i),
+                               "username": "user{0!s}".format(i),
+                               "user_realm": "realm1",
+                               "realms": ["realm1"]} for i in range(0, 40, 2)]
+        del self.server.requests[:]
+        result = CliRunner().invoke(token, ["registration", "--realm", "realm1",
+                                            "--dump", "--mail_host", "localhost",
+                                            "--mail_from", "admin@localhost",
+                                            "--mail_subject", "Registration",
+                                            "--mail_body", "%(registration)s"],
+                                    obj={"pi_client": self.client})
+        self.assertEqual(result.exit_code, 0, result.output)
+        new_tokens = [t["username"] for t in self.server.tokens[20:]]
+        self.assertEqual(sorted(new_tokens),
+                         sorted("user{0!s}".format(i) for i in range(1, 40, 2)))
+        paths = [r[1] for r in self.server.requests]
+        self.assertEqual(paths.count("/user/"), 1)
+        # The 20 tokens fit on one page
+        self.assertEqual(paths.count("/token/"), 1)
+        self.assertEqual(paths.count("/token/init"), 20)
+
+
+class TestInitBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = PIServer().start()
+        self.client = privacyideaclient("admin", "test", self.server.url)
+        self.results = os.path.join(self.tmpdir, "results.jsonl")
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _init_batch(self, filename):
+        return CliRunner().invoke(token, ["init-batch", "--file", filename,
+                                          "--results", self.results,
+                                          "--parallel", "3"],
+                                  obj={"pi_client": self.client})
+
+    def _read_results(self):
+        with open(self.results) as f:
+            return [json.loads(line) for line in f
+                    if line.endswith("}\n")]
+
+    def test_01_csv(self):
+        filename = os.path.join(self.tmpdir, "tokens.csv")
+        with open(filename, "w") as f:
+            f.write("type, serial, otpkey, user, realm, description\n")
+            for i in range(20):
+                f.write("hotp, H{0:02d}, {1!s}, , , vendor seed\n".format(
+                    i, "3132" * 10 if i % 2 else ""))
+        result = self._init_batch(filename)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertTrue("Enrolled 20 tokens, 0 failed, 0 skipped" in
+                        result.output, result.output)
+        results = self._read_results()
+        self.assertEqual([r["serial"] for r in results],
+                         ["H{0:02d}".format(i) for i in range(20)])
+        # OTP keys were generated for the tokens without otpkey
+        self.assertTrue(results[0]["otpkey"])
+        self.assertFalse("otpkey" in results[1])
+        self.assertEqual(stat.S_IMODE(os.stat(self.results).st_mode), 0o600)
+        self.assertEqual(len(self.server.tokens), 20)
+
+    def test_02_jsonl_resume(self):
+        filename = os.path.join(self.tmpdir, "tokens.jsonl")
+        with open(filename, "w") as f:
+            for i in range(10):
+                f.write(json.dumps({"serial": "J{0!s}".format(i),
+                                    "type": "totp"}) + "\n")
+        # A previous run enrolled the first four tokens and failed on one
+        with open(self.results, "w") as f:
+            for i in range(1, 5):
+                f.write(json.dumps({"line": i, "status": "ok"}) + "\n")
+            f.write(json.dumps({"line": 5, "status": "error"}) + "\n")
+            f.write('{"line": 6, "sta')
+        result = self._init_batch(filename)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertTrue("Enrolled 6 tokens, 0 failed, 4 skipped" in
+                        result.output, result.output)
+        self.assertEqual(sorted(t["serial"] for t in self.server.tokens),
+                         ["J{0!s}".format(i) for i in range(4, 10)])
+        results = self._read_results()[-6:]
+        self.assertEqual([r["line"] for r in results], list(range(5, 11)))
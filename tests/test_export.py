@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import email
+import gzip
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from click.testing import CliRunner
+from privacyideautils import export
+from privacyideautils.clientutils import privacyideaclient
+from privacyideautils.commands.token import token
+from privacyideautils.export import FileSink, GzipSink, MailSink, write_export
+from tests.piserver import PIServer
+from tests.smtpserver import SMTPServer
+
+FAKE_SMBCLIENT = """#!/bin/sh
+# Store the arguments and the data of "put /dev/stdin"
+printf '%s\\n' "$*" > "{0!s}/args"
+cat > "{0!s}/data"
+"""
+
+
+class TestSinks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.chunks = [("line {0!s}\n".format(i) * 500).encode("ascii")
+                       for i in range(20)]
+        self.data = b"".join(self.chunks)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_01_file_and_gzip(self):
+        plain = os.path.join(self.tmpdir, "export.csv")
+        compressed = os.path.join(self.tmpdir, "export.csv.gz")
+        size = write_export(iter(self.chunks),
+                            [FileSink(plain), GzipSink(FileSink(compressed))])
+        self.assertEqual(size, len(self.data))
+        with open(plain, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+        with gzip.open(compressed, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertTrue(os.path.getsize(compressed) < len(self.data) / 10)
+
+    def test_02_mail_attachment(self):
+        smtp = SMTPServer().start()
+        try:
+            sink = MailSink("127.0.0.1", "admin@localhost", "export.csv",
+                            mail_port=smtp.port, text="The token export")
+            write_export(iter(self.chunks), [sink])
+        finally:
+            smtp.stop()
+        self.assertEqual(len(smtp.messages), 1)
+        msg = email.message_from_string(smtp.messages[0][2])
+        text, attachment = msg.get_payload()
+        self.assertEqual(text.get_payload(decode=True), b"The token export")
+        self.assertEqual(attachment.get_filename(), "export.csv")
+        self.assertEqual(attachment.get_payload(decode=True), self.data)
+
+    def test_03_abort(self):
+        smtp = SMTPServer().start()
+
+        def chunks():
+            yield b"partial"
+            raise IOError("connection lost")
+
+        try:
+            sink = MailSink("127.0.0.1", "admin@localhost", "export.csv",
+                            mail_port=smtp.port)
+            self.assertRaises(IOError, write_export, chunks(), [sink])
+        finally:
+            smtp.stop()
+        self.assertEqual(smtp.messages, [])
+
+
+class TestTokenExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = PIServer().start()
+        self.server.tokens = [{"serial": "S{0!s}".format(i), "type": "hotp"}
+                              for i in range(100)]
+        self.client = privacyideaclient("admin", "test", self.server.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_01_export_gzip_file(self):
+        outfile = os.path.join(self.tmpdir, "tokens.csv.gz")
+        result = CliRunner().invoke(token, ["list", "--csv", "--gzip",
+                                            "--outfile", outfile],
+                                    obj={"pi_client": self.client})
+        self.assertEqual(result.exit_code, 0, result.output)
+        with gzip.open(outfile, "rt") as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 100)
+        self.assertEqual(lines[0], "S0, hotp, \n")
+
+    def test_02_export_stdout(self):
+        result = CliRunner().invoke(token, ["list", "--csv"],
+                                    obj={"pi_client": self.client})
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(result.output.count("\n"), 100)
+
+    def test_03_export_cifs(self):
+        smbclient = os.path.join(self.tmpdir, "smbclient")
+        with open(smbclient, "w") as f:
+            f.write(FAKE_SMBCLIENT.format(self.tmpdir))
+        os.chmod(smbclient, stat.S_IRWXU)
+        old_smbclient = export.SMBCLIENT
+        export.SMBCLIENT = smbclient
+        try:
+            result = CliRunner().invoke(token, ["list", "--csv",
+                                                "--cifs_server", "//server/share",
+                                                "--cifs_user", "admin",
+                                                "--cifs_password", "secret",
+                                                "--cifs_dir", "exports"],
+                                        obj={"pi_client": self.client})
+        finally:
+            export.SMBCLIENT = old_smbclient
+        self.assertEqual(result.exit_code, 0, result.output)
+        with open(os.path.join(self.tmpdir, "data")) as f:
+            self.assertEqual(len(f.readlines()), 100)
+        with open(os.path.join(self.tmpdir, "args")) as f:
+            args = f.read()
+        self.assertTrue(args.startswith("//server/share -U admin%secret -c "
+                                        "put /dev/stdin exports\\"), args)
+        self.assertTrue(args.strip().endswith("_privacyideaadm.csv"), args)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import hmac
+import os
+import runpy
+import time
+import unittest
+from click.testing import CliRunner
+from privacyideautils.commands.token import token
+from privacyideautils.hotp import HmacOtp, generate_many, find_counter
+
+KEY = b"12345678901234567890"
+# RFC 4226, Appendix D
+RFC4226 = ["755224", "287082", "359152", "969429", "338314",
+           "254676", "287922", "162583", "399871", "520489"]
+# RFC 6238, Appendix B
+RFC6238 = [(59, "94287082", "46119246", "90693936"),
+           (1111111109, "07081804", "68084774", "25091201"),
+           (1234567890, "89005924", "91819424", "93441116"),
+           (20000000000, "65353130", "77737706", "47863826")]
+
+PACKAGE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "privacyideautils")
+
+
+class TestHmacOtp(unittest.TestCase):
+
+    def test_01_hotp(self):
+        otp = HmacOtp(KEY)
+        self.assertEqual(otp.generate_range(0, 10), RFC4226)
+        self.assertEqual([otp.generate(c) for c in range(10)], RFC4226)
+        self.assertEqual(otp.generate_range(4, 3), RFC4226[4:7])
+        self.assertEqual(otp.generate_range(0, 0), [])
+
+    def test_02_totp(self):
+        keys = {hashlib.sha1: KEY,
+                hashlib.sha256: KEY + b"123456789012",
+                hashlib.sha512: KEY * 3 + b"1234"}
+        for timestamp, sha1, sha256, sha512 in RFC6238:
+            for hashfunc, expected in [(hashlib.sha1, sha1),
+                                       (hashlib.sha256, sha256),
+                                       (hashlib.sha512, sha512)]:
+                otp = HmacOtp(keys[hashfunc], digits=8, hashfunc=hashfunc)
+                self.assertEqual(otp.generate_time(1, timestamp), [expected])
+
+    def test_03_hmac(self):
+        # Keys longer than the block size are hashed first
+        for key in [b"", b"short", os.urandom(64), os.urandom(100)]:
+            otp = HmacOtp(key)
+            self.assertEqual(otp.hmac(12345), hmac.new(
+                key, b"\0\0\0\0\0\0\x30\x39", hashlib.sha1).digest())
+
+    def test_04_many_keys(self):
+        keys = [os.urandom(20) for _i in range(5)] + [KEY]
+        values = generate_many(keys, start=2, count=3)
+        self.assertEqual(len(values), 6)
+        self.assertEqual(values[-1], RFC4226[2:5])
+        self.assertEqual(values[0], HmacOtp(keys[0]).generate_range(2, 3))
+
+    def test_05_pytoken_templates(self):
+        for name in ["pytoken.template.py", "pytoken-totp.py"]:
+            module = runpy.run_path(os.path.join(PACKAGE, name))
+            otp = module["HmacOtp"](KEY)
+            self.assertEqual(["{0:06d}".format(otp.generate(counter=c))
+                              for c in range(1, 10)], RFC4226[1:])
+
+
+class TestFindCounter(unittest.TestCase):
+
+    def test_01_find_counter(self):
+        values = HmacOtp(KEY).generate_range(0, 5000)
+        otp1, otp2 = values[4321:4323]
+        self.assertEqual(find_counter(KEY, otp1, otp2, window=5000), 4321)
+        # The pair is found at the border of two chunks
+        for workers in (1, 2):
+            self.assertEqual(find_counter(KEY, otp1, otp2, window=5000,
+                                          workers=workers, chunk_size=4322),
+                             4321)
+            self.assertEqual(find_counter(KEY, otp1, otp2, window=5000,
+                                          workers=workers, chunk_size=100),
+                             4321)
+        self.assertEqual(find_counter(KEY, otp1, otp2, start=4322,
+                                      window=600, chunk_size=100,
+                                      workers=2), None)
+        self.assertEqual(find_counter(KEY, otp2, otp1, window=5000), None)
+
+    def test_02_command(self):
+        otp = HmacOtp(KEY, digits=8, hashfunc=hashlib.sha256)
+        values = otp.generate_range(777, 2)
+        result = CliRunner().invoke(token, [
+            "find-counter", "--otpkey", KEY.hex(), "--otp1", values[0],
+            "--otp2", values[1], "--window", "1000", "--digits", "8",
+            "--hashlib", "sha256"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertTrue("counter 777." in result.output, result.output)
+        # TOTP searches the time steps around now
+        values = HmacOtp(KEY).generate_time(2, time.time() - 3600)
+        result = CliRunner().invoke(token, [
+            "find-counter", "--otpkey", KEY.hex(), "--otp1", values[0],
+            "--otp2", values[1], "--window", "1000", "--timestep", "30"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertTrue("-3" in result.output, result.output)
+        result = CliRunner().invoke(token, [
+            "find-counter", "--otpkey", "xyz", "--otp1", "1", "--otp2", "2"])
+        self.assertEqual(result.exit_code, 2, result.output)
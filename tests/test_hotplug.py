@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import threading
+import time
+import unittest
+from privacyideautils.hotplug import (HotplugWatcher, parse_uevent,
+                                      is_usb_arrival, YUBICO_VENDOR_ID)
+from privacyideautils.yubikey import YubikeyPlug
+
+
+def uevent(action="add", product="1050/407/512", devtype="usb_device",
+           subsystem="usb"):
+    devpath = "/devices/pci0000:00/0000:00:14.0/usb1/1-2"
+    fields = ["{0!s}@{1!s}".format(action, devpath),
+              "ACTION=" + action, "DEVPATH=" + devpath,
+              "SUBSYSTEM=" + subsystem, "DEVTYPE=" + devtype,
+              "PRODUCT=" + product, "SEQNUM=4711"]
+    return "\0".join(fields).encode("utf-8") + b"\0"
+
+
+class FakePlug(YubikeyPlug):
+    """
+    A YubikeyPlug, that gets the serials of the plugged yubikeys from a
+    list instead of the USB bus.
+    """
+
+    def __init__(self, watcher, serials):
+        YubikeyPlug.__init__(self, watcher)
+        self.serials = serials
+        self.lookups = 0
+
+    def _find_serial(self):
+        self.lookups += 1
+        return self.serials[0] if self.serials else None
+
+
+class TestHotplug(unittest.TestCase):
+
+    def setUp(self):
+        self.kernel, sock = socket.socketpair(socket.AF_UNIX,
+                                              socket.SOCK_DGRAM)
+        self.watcher = HotplugWatcher(debounce=0.1, sock=sock)
+
+    def tearDown(self):
+        self.watcher.close()
+        self.kernel.close()
+
+    def _send_later(self, delay, *events):
+        def send():
+            time.sleep(delay)
+            for event in events:
+                self.kernel.send(event)
+        thread = threading.Thread(target=send)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_01_parse(self):
+        event = parse_uevent(uevent())
+        self.assertEqual(event["ACTION"], "add")
+        self.assertEqual(event["PRODUCT"], "1050/407/512")
+        self.assertTrue(is_usb_arrival(event, YUBICO_VENDOR_ID))
+        self.assertTrue(is_usb_arrival(parse_uevent(uevent(
+            product="46d/c52b/1211")), None))
+        for data in [uevent(action="remove"), uevent(devtype="usb_interface"),
+                     uevent(product="46d/c52b/1211"), uevent(product="x"),
+                     b"libudev\0garbage", b""]:
+            self.assertFalse(is_usb_arrival(parse_uevent(data),
+                                            YUBICO_VENDOR_ID), data)
+
+    def test_02_arrival(self):
+        self._send_later(0.1, uevent(product="46d/c52b/1211"),
+                         uevent(devtype="usb_interface"), uevent(),
+                         uevent(devtype="usb_interface"))
+        start = time.time()
+        self.assertTrue(self.watcher.wait_for_arrival(timeout=5))
+        self.assertTrue(time.time() - start < 1)
+        # The events of the device were consumed by the debounce
+        self.assertFalse(self.watcher.wait_for_arrival(timeout=0.2))
+
+    def test_03_timeout(self):
+        self._send_later(0, uevent(action="remove"))
+        start = time.time()
+        self.assertFalse(self.watcher.wait_for_arrival(timeout=0.3))
+        self.assertTrue(0.3 <= time.time() - start < 1)
+
+    def test_04_polling(self):
+        watcher = HotplugWatcher(poll_interval=0.05)
+        # Without the socket the watcher polls
+        watcher.close()
+        self.assertFalse(watcher.event_driven)
+        self.assertEqual(watcher.wait_for_arrival(timeout=1), None)
+
+    def test_05_yubikey_plug(self):
+        plug = FakePlug(self.watcher, ["00000001"])
+        self.assertTrue(plug.wait_for_new_yubikey(timeout=1))
+        self.assertEqual(plug.last_serial, "00000001")
+        # The same yubikey is still plugged in
+        self.assertFalse(plug.wait_for_new_yubikey(timeout=0.2))
+        lookups = plug.lookups
+
+        def swap():
+            time.sleep(0.2)
+            plug.serials = ["00000002"]
+            self.kernel.send(uevent())
+        thread = threading.Thread(target=swap)
+        thread.start()
+        start = time.time()
+        self.assertTrue(plug.wait_for_new_yubikey(timeout=5))
+        thread.join()
+        self.assertEqual(plug.last_serial, "00000002")
+        self.assertTrue(time.time() - start < 1)
+        # The USB bus is only searched again after the arrival
+        self.assertEqual(plug.lookups - lookups, 2)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from click.testing import CliRunner
+from privacyideautils.clientutils import privacyideaclient
+from privacyideautils.commands.token import token
+from privacyideautils.journal import JobJournal, PENDING, DONE, FAILED
+from tests.piserver import PIServer
+
+REGISTRATION_ARGS = ["registration", "--realm", "realm1", "--dump",
+                     "--mail_host", "localhost", "--mail_from", "admin@localhost",
+                     "--mail_subject", "Registration",
+                     "--mail_body", "%(registration)s"]
+
+
+class TestJobJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "journal.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_01_record_and_resume(self):
+        with JobJournal(self.filename) as journal:
+            self.assertFalse(journal.known("op"))
+            journal.add("op", ["a", "b", "c", "d"])
+            journal.record("op", "a", DONE)
+            journal.record("op", "b", FAILED, data={"x": 1}, error="timeout")
+            journal.add("other", ["a"])
+        self.assertEqual(stat.S_IMODE(os.stat(self.filename).st_mode), 0o600)
+
+        with JobJournal(self.filename) as journal:
+            self.assertTrue(journal.known("op"))
+            self.assertEqual(journal.items("op"),
+                             [("b", {"x": 1}), ("c", None), ("d", None)])
+            self.assertEqual(journal.items("op", (PENDING,)),
+                             [("c", None), ("d", None)])
+            self.assertEqual(journal.done("op"), {"a": None})
+            # Adding items again does not reset their status
+            journal.add("op", ["a", "e"])
+            self.assertEqual(journal.done("op"), {"a": None})
+            self.assertEqual(journal.items("op")[-1], ("e", None))
+            self.assertEqual(journal.items("other"), [("a", None)])
+
+
+class TestJournalCommands(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "journal.db")
+        self.server = PIServer().start()
+        self.client = privacyideaclient("admin", "test", self.server.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_01_resume_delete(self):
+        self.server.tokens = [{"serial": "S{0!s}".format(i),
+                               "type": "hotp",
+                               "realms": ["realm1"]} for i in range(10)]
+        args = ["delete", "--realm", "realm1", "--type", "hotp",
+                "--journal", self.filename]
+        result = CliRunner().invoke(token, args,
+                                    obj={"pi_client": self.client})
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(self.server.tokens, [])
+
+        # Simulate an interrupted run: Some tokens are left and the journal
+        # still lists them as pending.
+        self.server.tokens = [{"serial": "S{0!s}".format(i),
+                               "type": "hotp",
+                               "realms": ["realm1"]} for i in range(10, 13)]
+        with JobJournal(self.filename) as journal:
+            operation = [op for op in
+                         journal.conn.execute("SELECT DISTINCT operation "
+                                              "FROM journal")][0][0]
+            journal.add(operation, ["S10", "S11"])
+        del self.server.requests[:]
+        result = CliRunner().invoke(token, args,
+                                    obj={"pi_client": self.client})
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertTrue("2 tokens are left" in result.output, result.output)
+        # The token list is not read again
+        self.assertEqual([r[0] for r in self.server.requests],
+                         ["DELETE", "DELETE"])
+        self.assertEqual([t["serial"] for t in self.server.tokens], ["S12"])
+
+    def test_02_resume_registration(self):
+        self.server.users = [{"username": "user{0!s}".format(i),
+                              "email": "user{0!s}@localhost".format(i)}
+                             for i in range(4)]
+        with JobJournal(self.filename) as journal:
+            # user0 got a token, but the email was not sent. user1 already
+            # got the email.
+            journal.record("token registration realm1", "user0", DONE,
+                           data={"username": "user0", "serial": "R0",
+                                 "registration": "REGR0"})
+            journal.record("token registration realm1", "user1", DONE,
+                           data={"username": "user1", "serial": "R1",
+                                 "registration": "REGR1"})
+            journal.record("token registration mail realm1", "user1", DONE)
+        result = CliRunner().invoke(token, REGISTRATION_ARGS +
+                                    ["--journal", self.filename],
+                                    obj={"pi_client": self.client})
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(sorted(t["username"] for t in self.server.tokens),
+                         ["user2", "user3"])
+        self.assertTrue("REGR0" in result.output)
+        self.assertFalse("REGR1" in result.output)
+
+        # All users are done now
+        with JobJournal(self.filename) as journal:
+            self.assertEqual(len(journal.done("token registration mail realm1")),
+                             4)
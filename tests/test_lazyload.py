@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "scripts", "privacyidea")
+
+# Modules, that must not be imported, unless a command needs them
+HEAVY_MODULES = ["qrcode", "yubico", "usb", "smtplib", "email.mime.text",
+                 "privacyideautils.yubikey", "privacyideautils.etokenng",
+                 "privacyideautils.nitrokey", "privacyideautils.initdaplug",
+                 "privacyideautils.mailer", "privacyideautils.export"]
+
+# Load the command line tool and resolve a subcommand in a fresh interpreter
+RESOLVE = """
+import runpy, sys, click
+cli = runpy.run_path(sys.argv[1], run_name="privacyidea")["cli"]
+cmd = cli.get_command(click.Context(cli), sys.argv[2])
+print(cmd.name)
+print(" ".join(sorted(cli.list_commands(None))))
+print(" ".join(m for m in sys.argv[3:] if m in sys.modules))
+"""
+
+
+def resolve(command):
+    output = subprocess.check_output([sys.executable, "-c", RESOLVE, SCRIPT,
+                                      command] + HEAVY_MODULES +
+                                     ["privacyideautils.commands.token"])
+    return output.decode("utf-8").split("\n")
+
+
+def run(*args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    process = subprocess.Popen([sys.executable, SCRIPT] + list(args),
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, env=env)
+    output = process.communicate(b"")[0]
+    return process.returncode, output.decode("utf-8")
+
+
+class TestLazyCommands(unittest.TestCase):
+
+    def test_01_config_does_not_import_token_modules(self):
+        name, commands, loaded = resolve("config")[:3]
+        self.assertEqual(name, "config")
+        self.assertEqual(commands.split(),
+                         ["audit", "certificate", "config", "machine",
+                          "realm", "resolver", "securitymodule", "token",
+                          "user"])
+        self.assertEqual(loaded, "")
+
+    def test_02_token_does_not_import_hardware_modules(self):
+        name, _commands, loaded = resolve("token")[:3]
+        self.assertEqual(name, "token")
+        self.assertEqual(loaded, "privacyideautils.commands.token")
+
+
+class TestLazyClient(unittest.TestCase):
+
+    def test_01_offline_command(self):
+        # The counter is found without the URL and the credentials
+        code, output = run("token", "find-counter", "--otpkey",
+                           "3132333435363738393031323334353637383930",
+                           "--otp1", "755224", "--otp2", "287082")
+        self.assertEqual(code, 0, output)
+        self.assertTrue("counter 0." in output, output)
+
+    def test_02_missing_url(self):
+        code, output = run("-a", "admin", "-p", "test", "token", "list")
+        self.assertEqual(code, 2, output)
+        self.assertTrue("Missing option '-U' / '--url'." in output, output)
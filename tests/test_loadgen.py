@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import unittest
+from privacyideautils.loadgen import (read_credentials, percentile,
+                                      LoadGenerator)
+from tests.piserver import PIServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "scripts", "privacyidea-validate")
+
+
+class TestLoadGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = PIServer().start()
+        self.csvfile = os.path.join(self.tmpdir, "users.csv")
+        with open(self.csvfile, "w") as f:
+            f.write("# user, password, realm\n"
+                    "alice,test,realm1\n"
+                    "bob,wrong\n"
+                    "\n"
+                    "\"carol\",\"te,st\"\n")
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_01_read_credentials(self):
+        self.assertEqual(read_credentials(self.csvfile),
+                         [{"user": "alice", "pass": "test",
+                           "realm": "realm1"},
+                          {"user": "bob", "pass": "wrong"},
+                          {"user": "carol", "pass": "te,st"}])
+
+    def test_02_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertEqual(percentile([], 50), None)
+
+    def test_03_rate(self):
+        generator = LoadGenerator(self.server.url,
+                                  read_credentials(self.csvfile),
+                                  workers=4, rate=100)
+        try:
+            report = generator.run(1)
+        finally:
+            generator.close()
+        result = report.as_dict()
+        self.assertTrue(90 <= result["requests"] <= 101, result)
+        self.assertEqual(result["errors"], {})
+        # alice authenticates, bob and carol fail
+        self.assertTrue(abs(result["accepted"] * 2 - result["rejected"]) <= 2,
+                        result)
+        self.assertTrue(result["latency"]["p50"] <= result["latency"]["p99"]
+                        <= result["latency"]["max"])
+        # The workers share the pooled connections
+        self.assertTrue(self.server.connections <= 4)
+        self.assertTrue("p95:" in report.to_text())
+
+    def test_04_errors(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        url = "http://127.0.0.1:{0:d}".format(sock.getsockname()[1])
+        sock.close()
+        generator = LoadGenerator(url, [{"user": "alice", "pass": "test"}],
+                                  workers=2, rate=20)
+        try:
+            report = generator.run(0.5)
+        finally:
+            generator.close()
+        self.assertEqual(report.accepted, 0)
+        self.assertEqual(list(report.errors), ["ConnectionError"])
+        self.assertEqual(report.errors["ConnectionError"], report.requests)
+
+    def test_05_script(self):
+        p = subprocess.run([sys.executable, SCRIPT, "-U", self.server.url,
+                            "--load", self.csvfile, "--duration", "0.5",
+                            "--workers", "2", "--json"],
+                           stdout=subprocess.PIPE, check=True,
+                           env=dict(os.environ, PYTHONPATH=ROOT))
+        result = json.loads(p.stdout.decode("utf-8"))
+        self.assertTrue(result["requests"] > 0)
+        self.assertEqual(set(result["latency"]),
+                         {"p50", "p95", "p99", "max"})
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from click.testing import CliRunner
+from privacyideautils.clientutils import privacyideaclient
+from privacyideautils.commands.token import token
+from privacyideautils.mailer import MailDispatcher
+from tests.piserver import PIServer
+from tests.smtpserver import SMTPServer
+
+
+def _messages(count):
+    return [("user{0!s}@localhost".format(i), "Hello",
+             "Message {0!s}".format(i)) for i in range(count)]
+
+
+class TestMailDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.smtp = SMTPServer().start()
+
+    def tearDown(self):
+        self.smtp.stop()
+
+    def _dispatcher(self, **kwargs):
+        return MailDispatcher("127.0.0.1", self.smtp.port,
+                              sender="admin@localhost", user="admin",
+                              password="secret", **kwargs)
+
+    def test_01_connection_is_reused(self):
+        with self._dispatcher() as mailer:
+            results = list(mailer.send(_messages(20)))
+        self.assertTrue(all(r.error is None for r in results))
+        self.assertEqual(mailer.sent, 20)
+        self.assertEqual(len(self.smtp.messages), 20)
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual(self.smtp.logins, 1)
+        self.assertTrue("Message 0" in self.smtp.messages[0][2])
+        self.assertTrue("Subject: Hello" in self.smtp.messages[0][2])
+
+    def test_02_workers(self):
+        with self._dispatcher(workers=3) as mailer:
+            results = list(mailer.send(_messages(30)))
+        self.assertEqual([r.item[0] for r in results],
+                         ["user{0!s}@localhost".format(i) for i in range(30)])
+        self.assertEqual(mailer.sent, 30)
+        self.assertTrue(self.smtp.connections <= 3, self.smtp.connections)
+
+    def test_03_reconnect(self):
+        # The server closes the connection after 3 messages
+        self.smtp.drop_after = 3
+        with self._dispatcher() as mailer:
+            results = list(mailer.send(_messages(10)))
+        self.assertTrue(all(r.error is None for r in results))
+        self.assertEqual(len(self.smtp.messages), 10)
+        self.assertEqual(self.smtp.connections, 4)
+
+    def test_04_max_messages(self):
+        with self._dispatcher(max_messages=4) as mailer:
+            list(mailer.send(_messages(10)))
+        self.assertEqual(self.smtp.connections, 3)
+
+    def test_05_rejected_recipient(self):
+        self.smtp.reject.add("user2@localhost")
+        with self._dispatcher() as mailer:
+            results = list(mailer.send(_messages(5)))
+        self.assertEqual([r.error is None for r in results],
+                         [True, True, False, True, True])
+        self.assertEqual(mailer.failed, 1)
+        self.assertEqual(self.smtp.connections, 1)
+
+
+class TestRegistrationMail(unittest.TestCase):
+
+    def setUp(self):
+        self.smtp = SMTPServer().start()
+        self.server = PIServer().start()
+        self.client = privacyideaclient("admin", "test", self.server.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        self.smtp.stop()
+
+    def test_01_registration(self):
+        self.server.users = [{"username": "user{0!s}".format(i),
+                              "email": "user{0!s}@localhost".format(i)}
+                             for i in range(10)]
+        self.smtp.reject.add("user3@localhost")
+        result = CliRunner().invoke(
+            token, ["registration", "--realm", "realm1",
+                    "--mail_host", "127.0.0.1",
+                    "--mail_port", str(self.smtp.port),
+                    "--mail_from", "admin@localhost",
+                    "--mail_subject", "Your registration",
+                    "--mail_body", "Hello %(username)s: %(registration)s",
+                    "--mail_connections", "2"],
+            obj={"pi_client": self.client})
+        self.assertEqual(result.exit_code, 1, result.output)
+        self.assertTrue("Could not send email to user3@localhost"
+                        in result.output, result.output)
+        self.assertEqual(len(self.smtp.messages), 9)
+        self.assertTrue(self.smtp.connections <= 2, self.smtp.connections)
+        body = [m[2] for m in self.smtp.messages
+                if m[1] == ["user5@localhost"]][0]
+        self.assertTrue("Subject: Your registration" in body)
+        self.assertTrue("Hello user5: REG" in body)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from privacyideautils.offline import (connect, save_auth_item, check_otp,
+                                      stored_hashes, tokens_to_refill,
+                                      salted_hash_256, verify_salted_hash_256,
+                                      SCHEMA_VERSION)
+
+
+def authitem(user, counters, tokenowner="owner"):
+    return {"user": user, "username": tokenowner,
+            "count": len(counters),
+            "response": {str(c): "hash{0!s}".format(c) for c in counters}}
+
+
+class TestOfflineStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.sqlfile = os.path.join(self.tmpdir, "offlineotp.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _rows(self):
+        conn = connect(self.sqlfile)
+        rows = conn.execute("SELECT user, counter, otp FROM authitems "
+                            "ORDER BY user, counter").fetchall()
+        conn.close()
+        return rows
+
+    def test_01_schema(self):
+        conn = connect(self.sqlfile)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0],
+                         SCHEMA_VERSION)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0],
+                         "wal")
+        # The lookup of the next hashes uses the primary key and no sort
+        plan = " ".join(str(r) for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT counter, otp FROM authitems "
+            "WHERE user=? ORDER BY counter LIMIT 10", ("alice",)))
+        self.assertTrue("PRIMARY KEY" in plan, plan)
+        self.assertFalse("TEMP B-TREE" in plan, plan)
+        conn.close()
+
+    def test_02_save_auth_item(self):
+        save_auth_item(self.sqlfile, authitem("alice", range(3)))
+        save_auth_item(self.sqlfile, authitem("bob", [5]))
+        # Saving the same counters again does not create duplicates
+        save_auth_item(self.sqlfile, authitem("alice", range(2, 4)))
+        self.assertEqual(self._rows(),
+                         [("alice", 0, "hash0"), ("alice", 1, "hash1"),
+                          ("alice", 2, "hash2"), ("alice", 3, "hash3"),
+                          ("bob", 5, "hash5")])
+
+    def test_03_parameterized(self):
+        user = "x' OR '1'='1"
+        save_auth_item(self.sqlfile, authitem(user, [1]))
+        save_auth_item(self.sqlfile, authitem("alice", [1]))
+        self.assertEqual(self._rows(), [("alice", 1, "hash1"),
+                                        (user, 1, "hash1")])
+
+    def test_04_migrate_old_table(self):
+        conn = sqlite3.connect(self.sqlfile)
+        conn.execute("CREATE TABLE authitems "
+                     "(counter int, user text, tokenowner text, otp text)")
+        for counter in ("1", "2", "2"):
+            conn.execute("INSERT INTO authitems VALUES (?, 'alice', 'o', ?)",
+                         (counter, "hash" + counter))
+        conn.commit()
+        conn.close()
+        self.assertEqual(self._rows(), [("alice", 1, "hash1"),
+                                        ("alice", 2, "hash2")])
+
+    def test_05_salted_hash(self):
+        h = salted_hash_256("123456")
+        self.assertTrue(h.startswith("{SSHA256}"))
+        self.assertTrue(verify_salted_hash_256("123456", h))
+        self.assertTrue(verify_salted_hash_256(u"123456", h))
+        self.assertFalse(verify_salted_hash_256("123457", h))
+        self.assertFalse(verify_salted_hash_256("123456", "{SSHA256}!!"))
+        self.assertFalse(verify_salted_hash_256("123456", "hash1"))
+        # Each hash has an own salt
+        self.assertNotEqual(h, salted_hash_256("123456"))
+
+    def test_06_check_otp(self):
+        otps = ["{0:06d}".format(c * 111) for c in range(20)]
+        save_auth_item(self.sqlfile, {
+            "user": "alice", "username": "owner", "count": 20,
+            "response": {str(c): salted_hash_256(otp)
+                         for c, otp in enumerate(otps)}})
+        save_auth_item(self.sqlfile, {
+            "user": "bob", "username": "owner", "count": 1,
+            "response": {"0": salted_hash_256(otps[0])}})
+        self.assertFalse(check_otp("alice", "999999", self.sqlfile))
+        # The OTP value of counter 12 is outside of the window
+        self.assertFalse(check_otp("alice", otps[12], self.sqlfile, window=10))
+        self.assertTrue(check_otp("alice", otps[3], self.sqlfile, window=10))
+        # The matching value and all older values are removed
+        counters = [r[1] for r in self._rows() if r[0] == "alice"]
+        self.assertEqual(counters, list(range(4, 20)))
+        self.assertFalse(check_otp("alice", otps[3], self.sqlfile))
+        self.assertFalse(check_otp("alice", otps[1], self.sqlfile))
+        # Now counter 12 is within the window
+        self.assertTrue(check_otp("alice", otps[12], self.sqlfile))
+        # The hashes of other users are not touched
+        self.assertEqual([r[:2] for r in self._rows() if r[0] == "bob"],
+                         [("bob", 0)])
+        self.assertFalse(check_otp("carol", otps[0], self.sqlfile))
+
+    def test_07_migrate_version_1(self):
+        conn = sqlite3.connect(self.sqlfile)
+        conn.execute("CREATE TABLE authitems "
+                     "(user TEXT NOT NULL, counter INTEGER NOT NULL, "
+                     "tokenowner TEXT, otp TEXT NOT NULL, "
+                     "PRIMARY KEY (user, counter)) WITHOUT ROWID")
+        conn.execute("INSERT INTO authitems VALUES ('alice', 1, 'o', 'h1')")
+        conn.execute("PRAGMA user_version = 1")
+        conn.commit()
+        conn.close()
+        self.assertEqual(self._rows(), [("alice", 1, "h1")])
+        conn = connect(self.sqlfile)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0],
+                         SCHEMA_VERSION)
+        self.assertEqual(conn.execute("SELECT * FROM consumed").fetchall(),
+                         [])
+        conn.close()
+
+    def test_08_refill(self):
+        otps = ["{0:06d}".format(c * 7) for c in range(30)]
+
+        def fetch(start, count):
+            return {"user": "alice", "username": "owner", "count": count,
+                    "response": {str(c): salted_hash_256(otps[c])
+                                 for c in range(start, start + count)}}
+
+        self.assertEqual(save_auth_item(self.sqlfile, fetch(0, 10)), 10)
+        self.assertTrue(check_otp("alice", otps[2], self.sqlfile))
+        self.assertEqual(stored_hashes(self.sqlfile), {"alice": 7})
+        # The server returns the used counters again. They are not stored.
+        self.assertEqual(save_auth_item(self.sqlfile, fetch(0, 20)), 17)
+        self.assertEqual([r[1] for r in self._rows()], list(range(3, 20)))
+        self.assertFalse(check_otp("alice", otps[2], self.sqlfile))
+        # Syncing again and again does not grow the store
+        for _i in range(5):
+            save_auth_item(self.sqlfile, fetch(0, 20))
+        self.assertEqual(stored_hashes(self.sqlfile), {"alice": 17})
+        self.assertTrue(check_otp("alice", otps[7], self.sqlfile))
+        self.assertEqual(save_auth_item(self.sqlfile, fetch(0, 30)), 22)
+
+    def test_09_exhausted_user(self):
+        otps = ["{0:06d}".format(c * 13) for c in range(3)]
+        save_auth_item(self.sqlfile, {
+            "user": "alice", "username": "owner", "count": 3,
+            "response": {str(c): salted_hash_256(otp)
+                         for c, otp in enumerate(otps)}})
+        save_auth_item(self.sqlfile, authitem("bob", range(5)))
+        self.assertTrue(check_otp("alice", otps[2], self.sqlfile))
+        # alice has no hashes left, so the store needs a refill
+        self.assertEqual(stored_hashes(self.sqlfile), {"alice": 0, "bob": 5})
+
+    def test_10_fetched_hashes_are_kept(self):
+        otps = ["{0:06d}".format(c * 11) for c in range(60)]
+        # The server hands out the next ten counters on each fetch
+        server = {"counter": 0}
+
+        def fetch():
+            start = server["counter"]
+            server["counter"] += 10
+            return {"user": "alice", "username": "owner", "count": 10,
+                    "response": {str(c): salted_hash_256(otps[c])
+                                 for c in range(start, start + 10)}}
+
+        self.assertEqual(save_auth_item(self.sqlfile, fetch(), "HOTP1"), 10)
+        # A sync, that does not overlap the stored hashes, is kept
+        self.assertEqual(save_auth_item(self.sqlfile, fetch(), "HOTP1"), 20)
+        self.assertEqual([r[1] for r in self._rows()], list(range(20)))
+        # Refilling with a depth leaves no gap in the counters
+        for counter in range(45):
+            self.assertTrue(check_otp("alice", otps[counter], self.sqlfile),
+                            counter)
+            if tokens_to_refill(self.sqlfile, ["HOTP1"], 5):
+                save_auth_item(self.sqlfile, fetch(), "HOTP1")
+        self.assertTrue(stored_hashes(self.sqlfile)["alice"] >= 5)
+
+    def test_11_tokens_to_refill(self):
+        save_auth_item(self.sqlfile, authitem("alice", range(5)), "HOTP1")
+        save_auth_item(self.sqlfile, authitem("bob", range(2)), "HOTP2")
+        # carol's token is new on the machine
+        self.assertEqual(tokens_to_refill(self.sqlfile,
+                                          ["HOTP1", "HOTP2", "HOTP3"], 5),
+                         ["HOTP2", "HOTP3"])
+        self.assertEqual(tokens_to_refill(self.sqlfile, ["HOTP1"], 5), [])
+        self.assertEqual(tokens_to_refill(self.sqlfile, ["HOTP1"], 6),
+                         ["HOTP1"])
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import privacyideautils.clientutils as clientutils
+from tests.piserver import PIServer
+
+
+class TestPooledSession(unittest.TestCase):
+
+    def setUp(self):
+        self.server = PIServer().start()
+        self.client = clientutils.privacyideaclient("admin", "test",
+                                                    self.server.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_01_connection_is_reused(self):
+        for _i in range(20):
+            response = self.client.listtoken({})
+            self.assertEqual(response.status, 200)
+        # /auth and all following requests use the same connection
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len(self.server.requests), 21)
+
+    def test_02_close_and_reconnect(self):
+        self.client.getconfig({})
+        self.client.close()
+        # The session can still be used after closing. It reconnects.
+        response = self.client.getconfig({})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_03_set_pool_size(self):
+        self.client.set_pool_size(32)
+        self.assertEqual(self.client.pool_maxsize, 32)
+        adapter = self.client.session.get_adapter(self.server.url)
+        self.assertEqual(adapter._pool_maxsize, 32)
+        response = self.client.listtoken({})
+        self.assertEqual(response.status, 200)
+
+    def test_04_context_manager(self):
+        with clientutils.privacyideaclient("admin", "test",
+                                           self.server.url) as client:
+            client.listtoken({})
+        self.assertFalse(client.session.get_adapter(
+            self.server.url).poolmanager.pools)
+
+    def test_05_wrong_credentials(self):
+        self.assertRaises(Exception, clientutils.privacyideaclient,
+                          "admin", "wrong", self.server.url)
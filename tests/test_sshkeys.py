@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+import fcntl
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from privacyideautils.clientutils import privacyideaclient
+from privacyideautils.sshkeys import (read_config, fetch_ssh_keys, KeyServer,
+                                      SSHKeyCache, query_daemon, KeyLookupError,
+                                      create_client)
+from tests.piserver import PIServer
+
+CONFIG = """[Default]
+url = {0!s}
+admin = admin
+password = test
+hostname = host1
+nosslcheck = False
+socket = {1!s}
+cachettl = 30
+"""
+
+
+class TestSSHKeys(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = PIServer().start()
+        self.server.sshkeys = [
+            {"hostname": "host1", "user": "alice", "sshkey": "ssh-rsa AAAA alice1"},
+            {"hostname": "host1", "user": "alice", "sshkey": "ssh-rsa AAAA alice2"},
+            {"hostname": "host1", "user": "bob", "sshkey": "ssh-rsa AAAA bob"},
+            {"hostname": "host2", "user": "alice", "sshkey": "ssh-rsa AAAA other"}]
+        self.client = privacyideaclient("admin", "test", self.server.url)
+        self.socket_path = os.path.join(self.tmpdir, "keys.sock")
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _lookups(self):
+        return len([r for r in self.server.requests
+                    if r[1] == "/machine/authitem/ssh"])
+
+    def test_01_read_config(self):
+        filename = os.path.join(self.tmpdir, "authorizedkeyscommand")
+        with open(filename, "w") as f:
+            f.write(CONFIG.format(self.server.url, self.socket_path))
+        settings = read_config(filename)
+        self.assertEqual(settings["url"], self.server.url)
+        self.assertEqual(settings["hostname"], "host1")
+        self.assertEqual(settings["cachettl"], 30)
+        self.assertFalse(settings["nosslcheck"])
+        self.assertRaises(KeyLookupError, read_config,
+                          os.path.join(self.tmpdir, "missing"))
+
+    def test_02_fetch(self):
+        self.assertEqual(fetch_ssh_keys(self.client, "host1", "alice"),
+                         ["ssh-rsa AAAA alice1", "ssh-rsa AAAA alice2"])
+        self.assertEqual(fetch_ssh_keys(self.client, "host2", "bob"), [])
+
+    def test_03_only_keys_of_user_are_requested(self):
+        self.server.sshkeys.extend(
+            {"hostname": "host1", "user": "user{0!s}".format(i),
+             "sshkey": "ssh-rsa AAAA {0!s}".format(i)} for i in range(1000))
+        self.assertEqual(fetch_ssh_keys(self.client, "host1", "bob"),
+                         ["ssh-rsa AAAA bob"])
+        request = self.server.requests[-1]
+        self.assertEqual(request[1], "/machine/authitem/ssh")
+        self.assertEqual(request[2], {"hostname": "host1", "user": "bob"})
+
+    def test_04_daemon(self):
+        server = KeyServer(self.socket_path, self.client, "host1", ttl=30)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            self.assertEqual(os.stat(self.socket_path).st_mode & 0o777,
+                             0o600)
+            for _i in range(5):
+                self.assertEqual(query_daemon(self.socket_path, "alice"),
+                                 ["ssh-rsa AAAA alice1",
+                                  "ssh-rsa AAAA alice2"])
+                self.assertEqual(query_daemon(self.socket_path, "carol"), [])
+            # The keys and the missing keys are cached
+            self.assertEqual(self._lookups(), 2)
+            self.assertRaises(KeyLookupError, query_daemon,
+                              self.socket_path, "bad user")
+            # The server does not accept the admin anymore
+            self.server.valid_tokens.clear()
+            self.server.password = "changed"
+            self.assertRaises(KeyLookupError, query_daemon,
+                              self.socket_path, "bob")
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertFalse(os.path.exists(self.socket_path))
+        self.assertRaises(socket.error, query_daemon, self.socket_path,
+                          "alice")
+
+    def test_05_slow_server(self):
+        filename = os.path.join(self.tmpdir, "authorizedkeyscommand")
+        with open(filename, "w") as f:
+            f.write(CONFIG.format(self.server.url, self.socket_path) +
+                    "timeout = 0.5\n")
+        settings = read_config(filename)
+        self.assertEqual(settings["timeout"], 0.5)
+        client = create_client(settings)
+        self.addCleanup(client.close)
+        cache = SSHKeyCache(os.path.join(self.tmpdir, "cache"), "host1",
+                            ttl=30, max_stale=3600)
+
+        def fetch(user):
+            return fetch_ssh_keys(client, "host1", user)
+
+        cache.lookup("alice", fetch)
+        filename = cache._filename("alice")
+        with open(filename) as f:
+            entry = json.load(f)
+        entry["fetched"] = time.time() - 120
+        with open(filename, "w") as f:
+            json.dump(entry, f)
+        # The server hangs, the request is aborted and the stale keys are used
+        self.server.latency = 3
+        start = time.time()
+        self.assertEqual(cache.lookup("alice", fetch),
+                         ["ssh-rsa AAAA alice1", "ssh-rsa AAAA alice2"])
+        self.assertTrue(time.time() - start < 2)
+
+
+class TestSSHKeyCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.tmpdir, "cache")
+        self.cache = SSHKeyCache(self.cachedir, "host1", ttl=60,
+                                 max_stale=3600)
+        self.fetches = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def fetch(self, user):
+        self.fetches += 1
+        if user == "alice":
+            return ["ssh-rsa AAAA alice{0!s}".format(self.fetches)]
+        return []
+
+    def fail(self, user):
+        raise socket.error("connection refused")
+
+    def _age(self, seconds, user="alice"):
+        filename = self.cache._filename(user)
+        with open(filename) as f:
+            entry = json.load(f)
+        entry["fetched"] = time.time() - seconds
+        with open(filename, "w") as f:
+            json.dump(entry, f)
+
+    def test_01_fresh(self):
+        self.assertEqual(self.cache.lookup("alice", self.fetch),
+                         ["ssh-rsa AAAA alice1"])
+        self.assertEqual(self.cache.lookup("alice", self.fetch),
+                         ["ssh-rsa AAAA alice1"])
+        self.assertEqual(self.fetches, 1)
+        # Each user has an own entry
+        self.assertEqual(self.cache.lookup("bob", self.fetch), [])
+        self.assertEqual(self.cache.lookup("bob", self.fetch), [])
+        self.assertEqual(self.fetches, 2)
+        self.assertEqual(len(os.listdir(os.path.join(self.cachedir,
+                                                     "host1"))), 2)
+        self.assertEqual(self.cache.lookup("../alice", self.fetch), [])
+
+    def test_02_stale_if_error(self):
+        self.cache.lookup("alice", self.fetch)
+        self._age(120)
+        # The server is down, the stale keys are used
+        self.assertEqual(self.cache.lookup("alice", self.fail),
+                         ["ssh-rsa AAAA alice1"])
+        # The keys are refreshed, if the server is up
+        self.assertEqual(self.cache.lookup("alice", self.fetch),
+                         ["ssh-rsa AAAA alice2"])
+        self._age(7200)
+        self.assertRaises(socket.error, self.cache.lookup, "alice", self.fail)
+
+    def test_03_background_refresh(self):
+        self.cache.lookup("alice", self.fetch)
+        self._age(40)
+        # The cached keys are returned and a child process refreshes them
+        self.assertEqual(self.cache.lookup("alice", self.fetch),
+                         ["ssh-rsa AAAA alice1"])
+        for _i in range(100):
+            fetched, keys = self.cache.load("alice")
+            if keys == ["ssh-rsa AAAA alice2"]:
+                break
+            time.sleep(0.05)
+        self.assertEqual(keys, ["ssh-rsa AAAA alice2"])
+        self.assertTrue(time.time() - fetched < 10)
+
+    def test_04_only_one_refresh(self):
+        self.cache.lookup("alice", self.fetch)
+        self._age(40)
+        with open(self.cache._filename("alice", "lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.cache.lookup("alice", self.fetch)
+            time.sleep(0.2)
+            fetched, keys = self.cache.load("alice")
+        self.assertEqual(keys, ["ssh-rsa AAAA alice1"])
+        self.assertTrue(time.time() - fetched >= 40)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import json
+import unittest
+from click.testing import CliRunner
+from privacyideautils import render
+from privacyideautils.clientutils import privacyideaclient
+from privacyideautils.commands.token import token
+from tests.piserver import PIServer
+
+
+class TestTokenList(unittest.TestCase):
+
+    def setUp(self):
+        self.server = PIServer().start()
+        self.server.tokens = [{"serial": "S{0:04d}".format(i),
+                               "type": "hotp",
+                               "description": "token {0!s}".format(i),
+                               "realms": ["realm1"] if i % 2 else []}
+                              for i in range(250)]
+        self.client = privacyideaclient("admin", "test", self.server.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def _token_requests(self):
+        return [r[2] for r in self.server.requests if r[1] == "/token/"]
+
+    def test_01_iter_tokens(self):
+        serials = [t["serial"] for t in self.client.iter_tokens(pagesize=100)]
+        self.assertEqual(serials, ["S{0:04d}".format(i) for i in range(250)])
+        pages = [p["page"] for p in self._token_requests()]
+        self.assertEqual(pages, ["1", "2", "3"])
+
+    def test_02_iter_tokens_with_filter(self):
+        tokens = list(self.client.iter_tokens({"tokenrealm": "realm1"},
+                                              pagesize=30))
+        self.assertEqual(len(tokens), 125)
+        self.assertEqual(len(self._token_requests()), 5)
+
+    def test_03_stop_early(self):
+        tokens = self.client.iter_tokens(pagesize=10)
+        self.assertEqual(next(tokens)["serial"], "S0000")
+        tokens.close()
+        # Only the first page and the prefetched second page were read
+        self.assertTrue(len(self._token_requests()) <= 2)
+
+    def test_04_token_list_command(self):
+        result = CliRunner().invoke(token, ["list", "--pagesize", "50"],
+                                    obj={"pi_client": self.client})
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertTrue("S0000" in result.output)
+        self.assertTrue("S0249" in result.output)
+        self.assertEqual(len(self._token_requests()), 5)
+
+    def test_05_token_list_jsonl(self):
+        result = CliRunner().invoke(token, ["list", "--format", "jsonl"],
+                                    obj={"pi_client": self.client})
+        self.assertEqual(result.exit_code, 0, result.output)
+        serials = [json.loads(line)["serial"]
+                   for line in result.output.splitlines()]
+        self.assertEqual(len(serials), 250)
+
+    def test_06_delete_all_pages(self):
+        result = CliRunner().invoke(token, ["delete", "--realm", "realm1",
+                                            "--type", "hotp"],
+                                    obj={"pi_client": self.client})
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(len(self.server.tokens), 125)
+
+    def test_07_resync(self):
+        result = CliRunner().invoke(token, ["resync", "--serial", "S0001",
+                                            "--otp1", "111111",
+                                            "--otp2", "222222"],
+                                    obj={"pi_client": self.client})
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(self.server.requests[-1],
+                         ("POST", "/token/resync",
+                          {"serial": "S0001", "otp1": "111111",
+                           "otp2": "222222"}))
+
+
+class TestRender(unittest.TestCase):
+
+    rows = [{"id": 1, "description": "a very long description, that is "
+                                     "longer than the column",
+             "serial": "S1", "username": None, "active": True},
+            {"id": 2, "description": "tab\tand\nnewline",
+             "serial": "S2", "username": "alice", "active": False}]
+
+    def _render(self, rows=None, **kwargs):
+        stream = io.StringIO()
+        render.render(rows or self.rows, stream=stream, **kwargs)
+        return stream.getvalue()
+
+    def test_01_table(self):
+        lines = self._render(self.rows[:1]).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith("  Id |             Desc |"))
+        self.assertTrue("a very long desc |" in lines[1])
+
+    def test_02_table_autosize(self):
+        lines = self._render(self.rows[:1], autosize=True).splitlines()
+        self.assertTrue(self.rows[0]["description"] in lines[1])
+        self.assertEqual(len(set(len(line) for line in lines)), 1)
+
+    def test_03_machine_formats(self):
+        lines = self._render(outformat="tsv").splitlines()
+        self.assertEqual(lines[0].split("\t")[:3],
+                         ["id", "description", "serial"])
+        self.assertEqual(lines[2].split("\t")[:4],
+                         ["2", "tab and newline", "S2", "alice"])
+        self.assertEqual(lines[1].split("\t")[3], "")
+
+        rows = list(csv.DictReader(io.StringIO(self._render(outformat="csv"))))
+        self.assertEqual(rows[1]["description"], "tab\tand\nnewline")
+        self.assertEqual(rows[0]["active"], "True")
+
+        rows = [json.loads(line) for line in
+                self._render(outformat="jsonl").splitlines()]
+        self.assertEqual(rows, self.rows)
+
+    def test_04_chunks(self):
+        stream = io.StringIO()
+        rows = ({"id": i, "serial": "S{0!s}".format(i)} for i in range(2500))
+        render.render(rows, outformat="tsv", stream=stream)
+        self.assertEqual(len(stream.getvalue().splitlines()), 2501)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from click.testing import CliRunner
+import usb
+import yubico.yubikey
+from yubico.yubikey_usb_hid import YubiKeyUSBHIDError
+import privacyideautils.yubikey as yubikey
+from privacyideautils.clientutils import privacyideaclient
+from privacyideautils.commands.token import token
+from privacyideautils.journal import JobJournal
+from tests.piserver import PIServer
+
+YubikeyPlug = yubikey.YubikeyPlug
+
+
+class Stop(Exception):
+    pass
+
+
+class FakeWatcher(object):
+    """
+    Plug in the next group of yubikeys, when the command waits for them.
+    """
+
+    def __init__(self, rounds):
+        self.rounds = rounds
+        self.plugged = rounds.pop(0)
+
+    def wait_for_arrival(self, timeout=None):
+        if not self.rounds:
+            raise Stop()
+        self.plugged = self.rounds.pop(0)
+        return True
+
+    def close(self):
+        pass
+
+
+class FakeDevice(object):
+
+    def __init__(self):
+        self._usb_handle = object()
+        self.closed = 0
+
+    def _close(self):
+        self.closed += 1
+        self._usb_handle = None
+
+
+class FakeKey(object):
+
+    def __init__(self, serial):
+        self._serial = serial
+        self._device = FakeDevice()
+
+    def serial(self):
+        if self._serial is None:
+            raise usb.USBError("Resource busy")
+        return self._serial
+
+
+class TestFindYubikeys(unittest.TestCase):
+
+    def setUp(self):
+        self.keys = []
+        self.addCleanup(setattr, yubico.yubikey, "find_key",
+                        yubico.yubikey.find_key)
+        yubico.yubikey.find_key = self.find_key
+        # The second yubikey is claimed by another program, the fourth is
+        # still set up and the serial of the fifth can not be read
+        self.plugged = [1, usb.USBError("Resource busy"), 3,
+                        YubiKeyUSBHIDError("Failed writing data"), None, 6]
+
+    def find_key(self, debug=False, skip=0):
+        if skip >= len(self.plugged):
+            raise yubico.yubikey.YubiKeyError("No YubiKey found")
+        if isinstance(self.plugged[skip], Exception):
+            raise self.plugged[skip]
+        key = FakeKey(self.plugged[skip])
+        self.keys.append(key)
+        return key
+
+    def test_01_skip_errors(self):
+        self.assertEqual(yubikey.find_yubikeys(),
+                         {"00000001": 0, "00000003": 2, "00000006": 5})
+        # The yubikeys are not kept open
+        self.assertEqual([key._device.closed for key in self.keys],
+                         [1, 1, 1, 1])
+
+    def test_02_open(self):
+        YK = yubikey.open_yubikey("00000003", 2)
+        self.assertEqual(YK.serial(), 3)
+        self.assertEqual(YK._device.closed, 0)
+        yubikey.release_yubikey(YK)
+        yubikey.release_yubikey(YK)
+        self.assertEqual(YK._device.closed, 1)
+        # Another yubikey was plugged in at this position
+        self.assertRaises(yubikey.YubiError, yubikey.open_yubikey,
+                          "00000003", 0)
+        self.assertEqual(self.keys[-1]._device.closed, 1)
+
+
+class TestMultiEnroll(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        # The server is slow
+        self.server = PIServer(latency=0.2).start()
+        self.client = privacyideaclient("admin", "test", self.server.url)
+        self.programmed = []
+        self.lock = threading.Lock()
+        self.released = []
+        self.watcher = None
+        for name, replacement in [("find_yubikeys", self.find_yubikeys),
+                                  ("open_yubikey", self.open),
+                                  ("release_yubikey", self.released.append),
+                                  ("enrollYubikey", self.enroll),
+                                  ("YubikeyPlug", self.plug)]:
+            self.addCleanup(setattr, yubikey, name, getattr(yubikey, name))
+            setattr(yubikey, name, replacement)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def plug(self):
+        return YubikeyPlug(self.watcher)
+
+    def find_yubikeys(self, debug=False):
+        return {serial: position
+                for position, serial in enumerate(self.watcher.plugged)}
+
+    def open(self, serial, position, debug=False):
+        self.assertEqual(self.watcher.plugged[position], serial)
+        return serial
+
+    def enroll(self, yk=None, slot=1, **kwargs):
+        if yk == "broken":
+            raise yubikey.YubiError("write failed")
+        # Programming a yubikey takes a while
+        time.sleep(0.1)
+        with self.lock:
+            self.programmed.append((yk, time.time()))
+        return "00" * 20, yk, ""
+
+    def invoke(self, *args):
+        return CliRunner().invoke(token, ["yubikey-mass-enroll", "--multi"] +
+                                  list(args), obj={"pi_client": self.client})
+
+    def test_01_enroll_in_parallel(self):
+        keys = ["{0:08d}".format(i) for i in range(1, 11)]
+        self.watcher = FakeWatcher([keys[:8], keys[:8], keys[5:] +
+                                    ["broken"]])
+        start = time.time()
+        filename = os.path.join(self.tmpdir, "journal.db")
+        result = self.invoke("--journal", filename)
+        self.assertTrue(isinstance(result.exception, Stop), result.output)
+        # Each yubikey is programmed once, the eight of the first round at
+        # the same time
+        self.assertEqual(sorted(k for k, _t in self.programmed), keys)
+        self.assertEqual(sorted(self.released), keys + ["broken"])
+        first = [t for k, t in self.programmed if k in keys[:8]]
+        self.assertTrue(max(first) - start < 0.5, first)
+        self.assertEqual(sorted(t["serial"] for t in self.server.tokens),
+                         ["UBOM{0!s}_1".format(k) for k in keys])
+        self.assertTrue("keys per minute" in result.output, result.output)
+        self.assertTrue("Could not enroll yubikey broken_1" in result.output,
+                        result.output)
+
+    def test_02_journal(self):
+        filename = os.path.join(self.tmpdir, "journal.db")
+        with JobJournal(filename) as journal:
+            journal.record("token yubikey_mass_enroll", "00000001_1", "done")
+        self.watcher = FakeWatcher([["00000001", "00000002"]])
+        result = self.invoke("--journal", filename)
+        self.assertTrue(isinstance(result.exception, Stop), result.output)
+        self.assertEqual([k for k, _t in self.programmed], ["00000002"])
+        with JobJournal(filename) as journal:
+            self.assertEqual(sorted(journal.done("token yubikey_mass_enroll")),
+                             ["00000001_1", "00000002_1"])
+
+    def test_03_retry(self):
+        filename = os.path.join(self.tmpdir, "journal.db")
+        # The failed yubikey is tried again in the next round, even if
+        # no yubikey was plugged in
+        self.watcher = FakeWatcher([["broken"], ["broken"]])
+        self.watcher.wait_for_arrival = self.poll
+        result = self.invoke("--journal", filename)
+        self.assertTrue(isinstance(result.exception, Stop), result.output)
+        self.assertEqual(result.output.count(
+            "Could not enroll yubikey broken_1"), 2, result.output)
+
+    def poll(self, timeout=None):
+        FakeWatcher.wait_for_arrival(self.watcher)
+
+    def test_04_needs_output(self):
+        self.watcher = FakeWatcher([["00000001"]])
+        result = self.invoke()
+        self.assertEqual(result.exit_code, 2, result.output)
+        self.assertTrue("--journal or --filename" in result.output,
+                        result.output)
+        self.assertEqual(self.programmed, [])